@@ -0,0 +1,150 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+
+from starlette.routing import compile_path
+
+import metrics
+
+
+# 准入控制：读请求和写请求各有一个并发上限，超过上限的请求排队等待。
+# 按最近的平均处理时间估计排队时间，超过排队预算的请求直接返回503，不再进入线程池和数据库
+MAX_READS = int(os.getenv("ADMISSION_MAX_READS", "32"))
+MAX_WRITES = int(os.getenv("ADMISSION_MAX_WRITES", "8"))       # SQLite只有一个写者，太多并发写只会互相等锁
+READ_QUEUE_BUDGET = float(os.getenv("ADMISSION_READ_QUEUE", "1.0"))     # 秒
+WRITE_QUEUE_BUDGET = float(os.getenv("ADMISSION_WRITE_QUEUE", "2.0"))
+# 不受限制的路由：监控接口、文档，以及长连接的推送接口（否则会一直占着名额）
+EXEMPT_ROUTES = ["/metrics", "/api/profiles", "/api/profiles/{profile_id}", "/docs", "/redoc", "/openapi.json",
+                 "/api/project/{project_id}/inventory/stream"]
+# 这些读接口被拒绝时，如果有同一个用户最近的响应，就返回这个快照（带Age响应头）而不是503
+SNAPSHOT_ROUTES = [route.strip() for route in os.getenv("ADMISSION_SNAPSHOT_ROUTES", "").split(",") if route.strip()]
+SNAPSHOT_MAX_AGE = float(os.getenv("ADMISSION_SNAPSHOT_MAX_AGE", "30"))     # 秒
+SNAPSHOT_CACHE_SIZE = 1000
+SNAPSHOT_MAX_BODY = 256 * 1024
+LATENCY_ALPHA = 0.2
+
+
+class Budget:
+    def __init__(self, kind: str, limit: int, queue_budget: float):
+        self.kind = kind
+        self.limit = limit
+        self.queue_budget = queue_budget
+        self.inflight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.latency = 0.05     # 最近处理时间的指数移动平均，秒
+
+    def expected_wait(self) -> float:
+        return (len(self.waiters) + 1) / self.limit * self.latency
+
+    async def acquire(self) -> bool:
+        if self.inflight < self.limit and not self.waiters:
+            self.inflight += 1
+            return True
+        if self.expected_wait() > self.queue_budget:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_budget)
+        except asyncio.TimeoutError:
+            if waiter.done():       # 超时的同时被唤醒，名额已经转交给了这个请求
+                return True
+            self.waiters.remove(waiter)
+            return False
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release(None)
+            else:
+                self.waiters.remove(waiter)
+            raise
+        return True
+
+    def release(self, duration: float | None):
+        if duration is not None:
+            self.latency += LATENCY_ALPHA * (duration - self.latency)
+        # 名额直接转交给下一个等待的请求
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.inflight -= 1
+
+
+budgets = {"read": Budget("read", MAX_READS, READ_QUEUE_BUDGET),
+           "write": Budget("write", MAX_WRITES, WRITE_QUEUE_BUDGET)}
+
+_exempt = [compile_path(route)[0] for route in EXEMPT_ROUTES]
+_snapshot_routes = [compile_path(route)[0] for route in SNAPSHOT_ROUTES]
+_snapshots: OrderedDict[tuple, tuple[float, list, bytes]] = OrderedDict()
+
+
+def _snapshot_key(scope) -> tuple | None:
+    if scope["method"] != "GET" or not any(regex.match(scope["path"]) for regex in _snapshot_routes):
+        return None
+    # 响应可能因用户而不同，带上 Authorization 一起作为键
+    return scope["path"], scope["query_string"], dict(scope["headers"]).get(b"authorization")
+
+
+def _store_snapshot(key: tuple, headers: list, body: bytes):
+    _snapshots[key] = (time.monotonic(), headers, body)
+    _snapshots.move_to_end(key)
+    while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+        _snapshots.popitem(last=False)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or any(regex.match(scope["path"]) for regex in _exempt):
+            await self.app(scope, receive, send)
+            return
+        budget = budgets["read" if scope["method"] in ("GET", "HEAD", "OPTIONS") else "write"]
+        snapshot_key = _snapshot_key(scope)
+        if not await budget.acquire():
+            await self._shed(budget, snapshot_key, send)
+            return
+        metrics.ADMISSION_INFLIGHT.inc(budget.kind)
+        start = time.perf_counter()
+        send_wrapper = send
+        if snapshot_key is not None:
+            response = {}
+            chunks = []
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    response.update(message)
+                elif message["type"] == "http.response.body" and response.get("status") == 200:
+                    chunks.append(message.get("body", b""))
+                    if not message.get("more_body", False) and sum(map(len, chunks)) <= SNAPSHOT_MAX_BODY:
+                        _store_snapshot(snapshot_key, response["headers"], b"".join(chunks))
+                await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            budget.release(time.perf_counter() - start)
+            metrics.ADMISSION_INFLIGHT.dec(budget.kind)
+
+    async def _shed(self, budget: Budget, snapshot_key, send):
+        snapshot = _snapshots.get(snapshot_key) if snapshot_key is not None else None
+        if snapshot is not None and time.monotonic() - snapshot[0] <= SNAPSHOT_MAX_AGE:
+            created, headers, body = snapshot
+            metrics.LOAD_SHED.inc(budget.kind, "snapshot")
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": headers + [(b"age", str(int(time.monotonic() - created)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        metrics.LOAD_SHED.inc(budget.kind, "rejected")
+        body = json.dumps({"detail": "Server is busy, please retry later."}).encode()
+        retry_after = max(1, math.ceil(budget.expected_wait()))
+        await send({"type": "http.response.start", "status": 503,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"retry-after", str(retry_after).encode())]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,146 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+import jwt
+from jwt.exceptions import InvalidTokenError
+
+from routers.login import SECRET_KEY, ALGORITHM
+
+
+# 设置 CAPTURE_FILE 后，每个请求脱敏后追加写入该文件（每行一个JSON），用 tools/replay.py 回放
+CAPTURE_FILE = os.getenv("CAPTURE_FILE")
+CAPTURE_SAMPLE = float(os.getenv("CAPTURE_SAMPLE", "1"))    # 采样比例
+MAX_BODY_SIZE = 64 * 1024
+FLUSH_EVERY = 100
+
+SENSITIVE_KEYS = {"password", "old_password", "new_password", "hashed_password",
+                  "token", "access_token", "refresh_token"}
+# 用户名短且容易猜，直接取哈希能用字典反查。代号用 HMAC 计算，密钥由只有服务端知道的 SECRET_KEY 和采集文件名派生：
+# 同一次采集中（包括多个进程写同一个文件）同一个用户的代号不变，回放时仍能区分用户，不同采集之间的代号无法关联
+_PSEUDONYM_KEY = hmac.new(SECRET_KEY.encode(), f"capture:{CAPTURE_FILE}".encode(), hashlib.sha256).digest()
+_DATETIME = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def _shape(value):
+    # 保留结构、数字和时间，字符串替换成同样长度的占位符，敏感字段去掉
+    if isinstance(value, dict):
+        return {key: None if key in SENSITIVE_KEYS else _shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shape(item) for item in value]
+    if isinstance(value, str):
+        return value if _DATETIME.match(value) else "x" * min(len(value), 256)
+    return value
+
+
+def _pseudonym(authorization: str) -> str | None:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except InvalidTokenError:
+        return None
+    if username is None:
+        return None
+    return hmac.new(_PSEUDONYM_KEY, username.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+class TraceWriter:
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def write(self, trace: dict):
+        line = json.dumps(trace, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._pending += 1
+            if self._pending >= FLUSH_EVERY:
+                self._file.flush()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            self._file.close()
+
+
+_writer: TraceWriter | None = None
+
+
+def close():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+class CaptureMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _writer
+        if scope["type"] != "http" or not CAPTURE_FILE or random.random() >= CAPTURE_SAMPLE:
+            await self.app(scope, receive, send)
+            return
+        body = bytearray()
+        status_code = 500
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) < MAX_BODY_SIZE:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            route = scope.get("route")
+            if route is not None:
+                headers = dict(scope["headers"])
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                query = {key: None if key in SENSITIVE_KEYS else value
+                         for key, value in urllib.parse.parse_qsl(scope["query_string"].decode("latin-1"))}
+                trace = {
+                    "t": round(started, 4),
+                    "m": scope["method"],
+                    "r": route.path,
+                    "p": scope.get("path_params", {}),
+                    "q": query,
+                    "u": _pseudonym(headers.get(b"authorization", b"").decode("latin-1")),
+                    "s": status_code,
+                    "d": round(duration, 5),
+                }
+                if body and len(body) < MAX_BODY_SIZE:
+                    if content_type.startswith("application/json"):
+                        try:
+                            trace["b"] = _shape(json.loads(body))
+                            trace["c"] = "json"
+                        except ValueError:
+                            pass
+                    elif content_type.startswith(("application/x-www-form-urlencoded", "multipart/form-data")):
+                        # 表单（登录、改密码）只记录字段名
+                        fields = urllib.parse.parse_qs(body.decode("latin-1")) if "urlencoded" in content_type else {}
+                        trace["b"] = {key: None for key in fields}
+                        trace["c"] = "form"
+                if _writer is None:
+                    _writer = TraceWriter(CAPTURE_FILE)
+                _writer.write(trace)
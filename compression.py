@@ -0,0 +1,51 @@
+import gzip
+import os
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+
+# 超过 COMPRESS_MIN_SIZE 字节的响应在客户端支持时用 gzip 压缩。只压缩一次发送完整个 body 的响应，
+# 流式响应（如库存推送）原样发送，否则压缩器的缓冲会让推送延迟
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "4096"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "5"))     # 9 压缩率只高一点，慢好几倍
+THREADPOOL_SIZE = 64 * 1024     # 更大的响应放到线程池中压缩，不阻塞事件循环
+
+
+def _compress(body: bytes) -> bytes:
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "gzip" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        start = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is not None:
+                headers = MutableHeaders(raw=start["headers"])
+                body = message.get("body", b"")
+                if (not message.get("more_body", False) and len(body) >= COMPRESS_MIN_SIZE
+                        and "content-encoding" not in headers):
+                    if len(body) >= THREADPOOL_SIZE:
+                        body = await run_in_threadpool(_compress, body)
+                    else:
+                        body = _compress(body)
+                    headers["content-encoding"] = "gzip"
+                    headers["content-length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {**message, "body": body}
+                await send(start)
+                start = None
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,90 @@
+import types
+import typing
+
+from fastapi import HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+# 大的响应不经过 response_model：FastAPI 会把返回的模型先转成字典、按 response_model 再校验一遍，
+# 然后用标准库 json 编码。这里已经是 schema 实例的内容直接用 pydantic-core 序列化成 JSON 字节，
+# ORM 对象等其他内容按 schema 校验一次。路由上仍然写 response_model，只用于文档
+_adapters: dict = {}
+
+
+def adapter(schema) -> TypeAdapter:
+    # 每个 schema 的 TypeAdapter 只构建一次
+    cached = _adapters.get(schema)
+    if cached is None:
+        cached = _adapters[schema] = TypeAdapter(schema)
+    return cached
+
+
+def _item_model(annotation):
+    # list[X]、X | None 中的模型类 X，不是模型时返回None
+    if typing.get_origin(annotation) in (list, typing.Union, types.UnionType):
+        for arg in typing.get_args(annotation):
+            model = _item_model(arg)
+            if model is not None:
+                return model
+        return None
+    return annotation if isinstance(annotation, type) and issubclass(annotation, BaseModel) else None
+
+
+def _is_list(annotation) -> bool:
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        return any(_is_list(arg) for arg in typing.get_args(annotation))
+    return typing.get_origin(annotation) is list
+
+
+def parse_fields(schema, fields: str) -> dict:
+    # ?fields=id,name,prize.name,prize.remain 转换成 pydantic 的 include，列表字段用 "__all__" 作用于每个元素
+    include = {}
+    for path in filter(None, (path.strip() for path in fields.split(","))):
+        node, model = include, _item_model(schema)
+        if _is_list(schema):
+            node = include.setdefault("__all__", {})
+        names = path.split(".")
+        for depth, name in enumerate(names):
+            if model is None or name not in model.model_fields:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f"Unknown field: {path}.")
+            annotation = model.model_fields[name].annotation
+            if depth == len(names) - 1:
+                node[name] = True
+                break
+            if node.get(name) is True:     # 已经包含了整个字段
+                break
+            node = node.setdefault(name, {})
+            if _is_list(annotation):
+                node = node.setdefault("__all__", {})
+            model = _item_model(annotation)
+    return include
+
+
+def fields_query(fields: str | None = Query(default=None,
+                                            description="只返回这些字段，逗号分隔，嵌套字段用`.`连接，如`id,name,prize.name`")):
+    return fields
+
+
+def _render(type_adapter: TypeAdapter, content, trusted: bool, include: dict | None) -> bytes:
+    if not trusted:
+        content = type_adapter.validate_python(content, from_attributes=True)
+    return type_adapter.dump_json(content, include=include)
+
+
+async def response(schema, content, fields: str | None = None, headers: dict | None = None) -> Response:
+    type_adapter = adapter(schema)
+    model = _item_model(schema)
+    if _is_list(schema):
+        trusted = isinstance(content, list) and all(isinstance(item, model) for item in content)
+    else:
+        trusted = isinstance(content, model)
+    include = parse_fields(schema, fields) if fields else None
+    if trusted:
+        body = _render(type_adapter, content, trusted, include)
+    else:
+        # 从 ORM 对象校验时可能懒加载关系，放到线程池中执行，不阻塞事件循环
+        body = await run_in_threadpool(_render, type_adapter, content, trusted, include)
+    return Response(content=body, media_type="application/json", headers=headers)
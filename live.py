@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import json
+import logging
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import select
+
+import sql.models as models
+from sql.database import open_session
+
+
+# 每个进程一个 Hub，每个有人订阅的项目一个轮询任务，所有订阅者共享它读到的库存快照。
+# 本进程内的修改通过 notify 立即唤醒轮询任务，其他进程的修改靠定时轮询发现
+POLL_INTERVAL = 2.0         # 秒
+MIN_INTERVAL = 0.1          # 两次读取之间的最短间隔，合并短时间内的大量修改
+KEEPALIVE_INTERVAL = 15.0
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_inventory(project_id: int) -> dict:
+    with open_session() as session:
+        project = session.get(models.Project, project_id)
+        if not project or project.status == models.PROJECT_DELETED:
+            return {"status": models.PROJECT_DELETED, "prize": []}
+        project_status = project.status
+        # 数据库中的status要等有人读取项目时才更新，这里按截止时间算出实际状态
+        if project_status == 1 and project.deadline <= datetime.datetime.now():
+            project_status = 2
+        elif project_status == 2 and project.deadline > datetime.datetime.now():
+            project_status = 1
+        prizes = session.exec(select(models.Prize.id, models.Prize.remain)
+                              .where(models.Prize.project_id == project_id).order_by(models.Prize.id)).all()
+    return {"status": project_status, "prize": [{"id": id, "remain": remain} for id, remain in prizes]}
+
+
+class Channel:
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.subscribers: set[asyncio.Queue] = set()
+        self.snapshot: dict | None = None
+        self.changed = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def publish(self, snapshot: dict):
+        self.snapshot = snapshot
+        for queue in self.subscribers:
+            # 每个订阅者只保留最新的快照，慢的客户端不会积压
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(snapshot)
+
+    async def run(self):
+        while True:
+            try:
+                snapshot = await run_in_threadpool(read_inventory, self.project_id)
+                if snapshot != self.snapshot:
+                    self.publish(snapshot)
+            except Exception:
+                logger.exception("Failed to read inventory of project %d.", self.project_id)
+            try:
+                await asyncio.wait_for(self.changed.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            await asyncio.sleep(MIN_INTERVAL)
+
+
+class Hub:
+    def __init__(self):
+        self.channels: dict[int, Channel] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    def subscribe(self, project_id: int) -> asyncio.Queue:
+        self.loop = asyncio.get_running_loop()
+        channel = self.channels.get(project_id)
+        if channel is None:
+            channel = self.channels[project_id] = Channel(project_id)
+            channel.task = asyncio.create_task(channel.run())
+        queue = asyncio.Queue(maxsize=1)
+        channel.subscribers.add(queue)
+        if channel.snapshot is not None:
+            queue.put_nowait(channel.snapshot)
+        return queue
+
+    def unsubscribe(self, project_id: int, queue: asyncio.Queue):
+        channel = self.channels.get(project_id)
+        if channel is None:
+            return
+        channel.subscribers.discard(queue)
+        if not channel.subscribers:
+            channel.task.cancel()
+            del self.channels[project_id]
+
+    def notify(self, project_id: int):
+        # 可以在线程池中调用，没有人订阅这个项目时什么都不做
+        loop = self.loop
+        if loop is None or project_id not in self.channels:
+            return
+        loop.call_soon_threadsafe(self._wake, project_id)
+
+    def _wake(self, project_id: int):
+        channel = self.channels.get(project_id)
+        if channel is not None:
+            channel.changed.set()
+
+
+hub = Hub()
+
+
+async def stream(project_id: int):
+    # Server-Sent Events：连接后先推送一次当前库存，之后只在变化时推送；项目被删除后结束
+    queue = hub.subscribe(project_id)
+    try:
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: inventory\ndata: {json.dumps(snapshot, separators=(',', ':'))}\n\n"
+            if snapshot["status"] == models.PROJECT_DELETED:
+                return
+    finally:
+        hub.unsubscribe(project_id, queue)
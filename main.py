@@ -1,9 +1,20 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routers import backstage, helloworld, login, frontstage
+from routers import backstage, helloworld, login, frontstage, monitor
 from sql.database import create_db_and_tables
+from sql import rollup, purge, archive, jobs, hot, partition
+import capture
 from fastapi.middleware.cors import CORSMiddleware
+from metrics import MetricsMiddleware
+from profiling import ProfilingMiddleware
+from capture import CaptureMiddleware
+from ratelimit import RateLimitMiddleware
+from admission import AdmissionMiddleware
+from compression import CompressionMiddleware
 
 create_db_and_tables()
+partition.setup()
 
 tags_metadata = [
     {
@@ -21,20 +32,47 @@ tags_metadata = [
     {
         "name": "前台用户端",
         "description": "用于用户参与问答抽奖的API，包括答题和抽奖。"
+    },
+    {
+        "name": "监控",
+        "description": "用于观察服务运行状况的API。"
     }
 ]
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    hot.recover()
+    rollup_flusher = asyncio.create_task(rollup.flush_periodically())
+    purger = asyncio.create_task(purge.purge_periodically())
+    archiver = asyncio.create_task(archive.archive_periodically())
+    workers = [asyncio.create_task(jobs.work()) for _ in range(jobs.WORKERS)]
+    yield
+    for worker in workers:
+        worker.cancel()
+    rollup_flusher.cancel()
+    purger.cancel()
+    archiver.cancel()
+    hot.close()
+    rollup.flush()
+    capture.close()
+
+
 app = FastAPI(title="问答抽奖系统", version="0.0.1", 
-            openapi_tags=tags_metadata)
+            openapi_tags=tags_metadata, lifespan=lifespan)
 
 
 app.include_router(helloworld.router, tags=["测试"])
 app.include_router(login.router, tags=["用户模块"], prefix="/api")
 app.include_router(backstage.router, tags=["后台管理端"], prefix="/api")
 app.include_router(frontstage.router, tags=["前台用户端"], prefix="/api")
+app.include_router(monitor.router, tags=["监控"])
 
 
+# 最先添加的在最内层：限流在路由之前执行，被拒绝的请求不会打开数据库会话，但仍带有CORS头。
+# 准入控制在限流之后，被限流的请求不占用并发名额
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -42,6 +80,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CaptureMiddleware)
+app.add_middleware(ProfilingMiddleware)
+# 压缩在记录和剖析之外，记录下来的是原始的响应
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 
 
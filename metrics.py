@@ -0,0 +1,182 @@
+import threading
+import time
+from bisect import bisect_left
+
+from sql import instrument
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((labels, self._copy(value)) for labels, value in self._values.items())
+        for labels, value in items:
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+    def _copy(self, value):
+        return value
+
+    def _render_sample(self, labels, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # 各个桶的计数（最后一个是+Inf），以及总和
+                counts = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def _copy(self, value):
+        return [list(value[0]), value[1]]
+
+    def _render_sample(self, labels, value) -> list[str]:
+        bucket_counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), bucket_counts):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("http_requests_total", "Total HTTP requests.", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency in seconds.",
+                            ("method", "route"))
+IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests currently being processed.", ("method",))
+REQUEST_STATEMENTS = Histogram("http_request_db_statements", "SQL statements executed per HTTP request.",
+                               ("method", "route"), buckets=STATEMENT_BUCKETS)
+REQUEST_DB_TIME = Histogram("http_request_db_duration_seconds", "Time spent in SQL statements per HTTP request.",
+                            ("method", "route"))
+DB_COMMITS = Counter("db_commits_total", "Database transactions committed.")
+DB_LOCK_WAITS = Counter("db_lock_waits_total", "Statements that failed because the database was locked.")
+DB_COMMIT_LATENCY = Histogram("db_commit_duration_seconds", "Time spent in COMMIT, including waiting for the write lock.")
+RATE_LIMITED = Counter("http_requests_rate_limited_total", "HTTP requests rejected by the rate limiter.",
+                       ("method", "route", "key"))
+ADMISSION_INFLIGHT = Gauge("http_requests_admitted_in_progress", "Admitted requests currently holding a slot.",
+                           ("kind",))
+LOAD_SHED = Counter("http_requests_shed_total", "Requests shed by admission control, answered with 503 or a snapshot.",
+                    ("kind", "outcome"))
+
+REGISTRY = [REQUESTS, REQUEST_LATENCY, IN_PROGRESS, REQUEST_STATEMENTS, REQUEST_DB_TIME,
+            DB_COMMITS, DB_LOCK_WAITS, DB_COMMIT_LATENCY, RATE_LIMITED,
+            ADMISSION_INFLIGHT, LOAD_SHED]
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _on_commit(duration: float):
+    DB_COMMITS.inc()
+    DB_COMMIT_LATENCY.observe(value=duration)
+
+
+def _on_lock_wait():
+    DB_LOCK_WAITS.inc()
+
+
+instrument.on_commit.append(_on_commit)
+instrument.on_lock_wait.append(_on_lock_wait)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        IN_PROGRESS.inc(method)
+        sql_stats, token = instrument.start_request()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            IN_PROGRESS.dec(method)
+            route = scope.get("route")
+            # 没有匹配到路由的请求（如404）统一归为一类，避免路径作为标签导致标签数量失控
+            route_path = route.path if route is not None else "unmatched"
+            instrument.end_request(token, f"{method} {route_path}")
+            REQUESTS.inc(method, route_path, status_code)
+            REQUEST_LATENCY.observe(method, route_path, value=duration)
+            REQUEST_STATEMENTS.observe(method, route_path, value=sql_stats.statements)
+            REQUEST_DB_TIME.observe(method, route_path, value=sql_stats.duration)
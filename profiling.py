@@ -0,0 +1,179 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import jwt
+from fastapi.concurrency import run_in_threadpool
+from jwt.exceptions import InvalidTokenError
+from starlette.routing import compile_path
+from sqlmodel import Session, select
+
+import sql.models as models
+from sql import instrument
+from sql.database import engine
+from routers.login import SECRET_KEY, ALGORITHM
+
+
+# 请求头带 X-Profile: 1 且是管理员时，对该请求进行采样分析
+PROFILE_HEADER = b"x-profile"
+# 配置项：逗号分隔的路由模板，匹配的请求总是进行分析，例如 "/api/project/{project_id}"
+PROFILE_ROUTES = [route.strip() for route in os.getenv("PROFILE_ROUTES", "").split(",") if route.strip()]
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL = 0.001     # 秒
+RING_SIZE = 20
+
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_profile_route_regexes = [compile_path(route)[0] for route in PROFILE_ROUTES]
+_recent: deque[dict] = deque(maxlen=RING_SIZE)
+_recent_lock = threading.Lock()
+
+
+class Sampler(threading.Thread):
+    """每隔 SAMPLE_INTERVAL 采样一次所有线程的调用栈。
+
+    同步的依赖函数在线程池中执行，无法只跟踪某一个线程，所以只保留栈中包含本项目代码的线程，
+    这样空闲的工作线程和事件循环不会计入，但同时在处理的其他请求也会出现在结果里。
+    """
+
+    def __init__(self):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.samples = Counter()
+        self.sample_num = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_ident = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            self.sample_num += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                in_app = False
+                while frame is not None:
+                    code = frame.f_code
+                    filename = code.co_filename
+                    if filename.startswith(_APP_ROOT) and "site-packages" not in filename:
+                        in_app = True
+                    if filename.startswith(_APP_ROOT):
+                        filename = os.path.relpath(filename, _APP_ROOT)
+                    stack.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if not in_app:
+                    continue
+                if ident not in names:
+                    thread = threading._active.get(ident)
+                    names[ident] = thread.name if thread else str(ident)
+                self.samples[(names[ident],) + tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _is_manager(scope) -> bool:
+    authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except InvalidTokenError:
+        return False
+    if username is None:
+        return False
+    with Session(engine) as session:
+        user = session.exec(select(models.User).filter_by(username=username)).first()
+    return bool(user and user.manage_permission)
+
+
+def _save(profile: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile['id']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False)
+    summary = {key: profile[key] for key in ("id", "method", "path", "route", "status", "started_at",
+                                             "duration", "sql_statements", "sql_duration")}
+    summary["file"] = path
+    with _recent_lock:
+        _recent.append(summary)
+
+
+def recent_profiles() -> list[dict]:
+    with _recent_lock:
+        return list(reversed(_recent))
+
+
+def load_profile(profile_id: str) -> dict | None:
+    with _recent_lock:
+        summary = next((summary for summary in _recent if summary["id"] == profile_id), None)
+    if summary is None:
+        return None
+    with open(summary["file"], encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = dict(scope["headers"]).get(PROFILE_HEADER) in (b"1", b"true")
+        configured = any(regex.match(scope["path"]) for regex in _profile_route_regexes)
+        if requested and not configured:
+            requested = await run_in_threadpool(_is_manager, scope)
+        if not requested and not configured:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sql_stats = instrument.current()
+        if sql_stats is not None:
+            sql_stats.timeline = []
+        started_at = datetime.datetime.now()
+        sampler = Sampler()
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            duration = time.perf_counter() - start
+            route = scope.get("route")
+            timeline = sql_stats.timeline if sql_stats is not None else []
+            await run_in_threadpool(_save, {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route.path if route is not None else None,
+                "status": status_code,
+                "started_at": started_at.isoformat(),
+                "duration": duration,
+                "sample_interval": SAMPLE_INTERVAL,
+                "sample_num": sampler.sample_num,
+                # 折叠栈格式（线程名;外层函数;...;内层函数 次数），可以直接生成火焰图
+                "stacks": [";".join(stack) + f" {count}" for stack, count in sampler.samples.most_common()],
+                "sql_statements": len(timeline),
+                "sql_duration": sum(item[1] for item in timeline),
+                "sql": [{"offset": item[0] - start, "duration": item[1], "statement": item[2]}
+                        for item in timeline],
+            })
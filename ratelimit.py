@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from jwt.exceptions import InvalidTokenError
+from starlette.routing import compile_path
+
+import metrics
+from routers.login import SECRET_KEY, ALGORITHM
+
+
+# 令牌桶限流，在路由和数据库之前执行。每个路由可以配置多条规则，每条规则：
+# (按什么计数, 每秒补充的令牌数, 桶容量)，按什么计数可以是 user（token中的用户）、ip 或 project（路径中的project_id）
+DEFAULT_LIMITS = {
+    "POST /api/login": [("ip", 1, 10)],
+    "POST /api/register": [("ip", 0.2, 5)],
+    "POST /api/answer": [("user", 1, 5)],
+    "POST /api/raffle/{project_id}": [("user", 2, 10), ("ip", 20, 40), ("project", 200, 400)],
+}
+# 环境变量 RATE_LIMITS 可以用 JSON 覆盖整个配置，格式与上面相同，设为 {} 关闭限流
+RATE_LIMITS = json.loads(os.environ["RATE_LIMITS"]) if "RATE_LIMITS" in os.environ else DEFAULT_LIMITS
+# 多个进程时用共享的后端，例如 sqlite:///ratelimit.db（单独的文件，不占用业务数据库的写锁）
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+MAX_KEYS = 100000
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int = MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        # 返回0表示放行，否则返回还要等待的秒数
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                # 键太多时丢掉最久没用过的，相当于它们的桶重新装满
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / rate
+
+
+class SQLiteBackend:
+    # 同一台机器上的多个进程共享一个SQLite文件，一条 UPSERT 原子地完成补充和扣减
+    SQL = """
+        INSERT INTO bucket (key, tokens, updated, allowed) VALUES (:key, :burst - 1, :now, 1)
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = min(:burst, tokens + (:now - updated) * :rate)
+                     - (min(:burst, tokens + (:now - updated) * :rate) >= 1),
+            updated = :now,
+            allowed = min(:burst, tokens + (:now - updated) * :rate) >= 1
+        RETURNING tokens, allowed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=0.05, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS bucket "
+                         "(key TEXT PRIMARY KEY, tokens REAL, updated REAL, allowed INTEGER)")
+        return conn
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            tokens, allowed = self._connection().execute(
+                self.SQL, {"key": key, "rate": rate, "burst": burst, "now": time.time()}).fetchone()
+        except sqlite3.Error:
+            return 0.0      # 限流后端出问题时放行，不影响正常请求
+        return 0.0 if allowed else (1 - tokens) / rate
+
+
+def create_backend(url: str):
+    if url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    raise ValueError(f"Unknown rate limit backend: {url}")
+
+
+backend = create_backend(RATE_LIMIT_BACKEND)
+
+_rules = []     # (method, route, regex, [(kind, rate, burst)])
+for _route, _limits in RATE_LIMITS.items():
+    _method, _, _path = _route.partition(" ")
+    _rules.append((_method, _path, compile_path(_path)[0], [tuple(limit) for limit in _limits]))
+
+
+def _user(headers: dict) -> str | None:
+    # 只解码token，不查数据库；token无效时按ip计数，请求本身之后会被拒绝
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except InvalidTokenError:
+        return None
+
+
+def check(scope) -> tuple[str, str, float] | None:
+    # 返回 (路由, 规则, 需要等待的秒数)，放行时返回 None
+    for method, route, regex, limits in _rules:
+        if scope["method"] != method:
+            continue
+        match = regex.match(scope["path"])
+        if match is None:
+            continue
+        headers = dict(scope["headers"])
+        ip = scope["client"][0] if scope.get("client") else "unknown"
+        for kind, rate, burst in limits:
+            if kind == "user":
+                value = _user(headers)
+                value = f"user:{value}" if value else f"ip:{ip}"
+            elif kind == "ip":
+                value = f"ip:{ip}"
+            else:
+                value = f"project:{match.groupdict().get('project_id')}"
+            retry_after = backend.take(f"{method} {route} {kind} {value}", rate, burst)
+            if retry_after:
+                return route, kind, retry_after
+        return None
+    return None
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _rules:
+            await self.app(scope, receive, send)
+            return
+        limited = check(scope)
+        if limited is None:
+            await self.app(scope, receive, send)
+            return
+        route, kind, retry_after = limited
+        metrics.RATE_LIMITED.inc(scope["method"], route, kind)
+        body = json.dumps({"detail": "Too many requests."}).encode()
+        await send({"type": "http.response.start", "status": 429,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"retry-after", str(math.ceil(retry_after)).encode())]})
+        await send({"type": "http.response.body", "body": body})
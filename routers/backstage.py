@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, status
 import schemas as sch 
 import sql.crud as crud
+import fastjson
 from routers.login import verify_token
 
 
@@ -60,6 +61,9 @@ async def update_project(project = Depends(crud.update_project)):
             summary="谨慎：删除一个项目。",
             description="""
 使用`id`指定要删除的项目。
+
+项目会立即被标记为已删除，之后所有接口都视为该项目不存在。
+项目的题目、奖品、答题抽奖记录和统计数据由后台任务分批清理。
 """)
 async def delete_project(project = Depends(crud.delete_project)):
     pass
@@ -72,13 +76,17 @@ async def delete_project(project = Depends(crud.delete_project)):
             summary="获取当前用户创建的所有项目的预览（不包含问答题目和抽奖奖品信息）。",
             description="""
 用于在管理员主页展示自己创建的项目预览信息。
+
+可以用`fields`参数只返回需要的字段，如`?fields=id,name,status`。
 """)
-async def get_projects(projects = Depends(crud.read_projects_by_manager)):
-    return projects
+async def get_projects(projects = Depends(crud.read_projects_by_manager),
+                       fields: str | None = Depends(fastjson.fields_query)):
+    return await fastjson.response(list[sch.ProjectResponse], projects, fields)
 
 
 @router.get("/project/{project_id}", response_model=sch.ProjectWithQuestionsAndPrizesForManager,
-            responses={401: {"description": "Not authorized."},
+            responses={304: {"description": "Not modified."},
+                    401: {"description": "Not authorized."},
                     404: {"description": "Project not found."}},
             summary="获取一个项目的详细信息。",
             description="""
@@ -87,9 +95,17 @@ async def get_projects(projects = Depends(crud.read_projects_by_manager)):
 当管理员进入项目详情页时，用此接口展示项目的所有信息，包括参与问答和抽奖的用户信息。
 
 调用此接口不会增加项目的访问次数。（管理员自己看没什么意义）
+
+参与者很多时响应很大，可以用`fields`参数只返回需要的字段，嵌套字段用`.`连接，
+如`?fields=name,prize.name,prize.remain`。
+
+响应头中有`ETag`，再次请求时放在`If-None-Match`中，项目没有变化（包括没有新的答题、抽奖和兑奖，用户没有改名或注销）时返回`304`，没有响应体。
 """)
-async def get_project_details(project = Depends(crud.read_project_details)):
-    return project
+async def get_project_details(etag: str = Depends(crud.check_project_details_etag),
+                              project = Depends(crud.read_project_details),
+                              fields: str | None = Depends(fastjson.fields_query)):
+    return await fastjson.response(sch.ProjectWithQuestionsAndPrizesForManager, project, fields,
+                                   headers={"ETag": etag})
 
 
 @router.post("/question", response_model=sch.QuestionResponse,
@@ -196,10 +212,242 @@ async def publish_project(project = Depends(crud.publish_project)):
 
 
 @router.patch("/prize/claim/{project_id}/{user_id}",
-            response_model=sch.ProjectWithQuestionsAndPrizesForManager,
+            response_model=sch.PrizeClaimResult,
             responses={401: {"description": "Not authorized."},
                         403: {"description": "No permission."},
                         404: {"description": "Record not found."}},
-            summary="为一个用户兑奖并标记为已领取。")
-async def claim_prize(project = Depends(crud.claim_prize)):
-    return project
\ No newline at end of file
+            summary="为一个用户兑奖并标记为已领取。",
+            description="""
+返回这个用户的兑奖结果：`status`为`claimed`表示这次兑奖成功，`already_claimed`表示之前已经兑过奖。
+
+`raffle_result`为用户抽中的奖品id，用于发放奖品。
+""")
+async def claim_prize(result = Depends(crud.claim_prize)):
+    return result
+
+
+@router.post("/prize/claim/{project_id}", response_model=list[sch.PrizeClaimResult],
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="批量兑奖。",
+            description="""
+`user_ids`为用户id列表，`codes`为扫描得到的兑奖码列表，都可以为空，每个最多1000个。
+用户在项目详情中可以看到自己的兑奖码`claim_code`，兑奖码只在对应的项目中有效。
+
+所有用户在一条语句中标记为已领取，按请求中的顺序（先`user_ids`后`codes`）返回每一项的结果`status`：
+- `claimed`：这次兑奖成功
+- `already_claimed`：之前已经兑过奖
+- `not_found`：用户没有参与这个项目的抽奖
+- `invalid_code`：兑奖码不正确
+""")
+async def claim_prizes(results = Depends(crud.claim_prizes)):
+    return results
+
+@router.get("/project/{project_id}/stats", response_model=sch.ProjectStatsResponse,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="获取一个项目的统计数据。",
+            description="""
+使用`id`指定要统计的项目。
+
+统计数据在答题、抽奖、兑奖时增量更新，读取时不需要扫描答题和抽奖记录。
+
+`question_correct_rate`为每道题的正确率，`score_distribution`为答对题数的分布（答对题数: 人数）。
+
+`prize_hit`为每个奖品被抽中的次数（奖品`id`: 次数），`claim_rate`为已兑奖人数占抽过奖人数的比例。
+""")
+async def get_project_stats(stats = Depends(crud.read_project_stats)):
+    return stats
+
+
+@router.post("/project/{project_id}/stats/recompute", response_model=sch.JobResponse,
+            status_code=status.HTTP_202_ACCEPTED,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="根据答题和抽奖记录全量重算一个项目的统计数据。",
+            description="""
+用于统计数据与记录不一致时的修复。修改题目的正确答案时会自动重算，不需要调用此接口。
+
+重算在后台任务中执行，此接口立即返回任务信息，可以用任务接口查询进度，完成后再获取统计数据。
+同一个项目已经有等待执行的重算任务时，返回那个任务而不是新建一个。
+""")
+async def recompute_project_stats(job = Depends(crud.recompute_project_stats)):
+    return job
+
+
+@router.get("/project/{project_id}/rollup", response_model=sch.ParticipationRollupResponse,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="获取一个项目按时间分桶的答题、抽奖、兑奖次数。",
+            description="""
+用于活动期间的实时看板。
+
+`resolution`为时间粒度，可选`1m`（每分钟）、`5m`（每5分钟）、`1h`（每小时）。
+
+`start`和`end`指定时间范围，默认为最近一天。
+
+数据先在内存中按分钟累加，每隔几秒写入汇总表，读取时不会扫描答题和抽奖记录。
+""")
+async def get_project_rollup(rollup = Depends(crud.read_project_rollup)):
+    return rollup
+
+
+@router.post("/project/{project_id}/questions", response_model=list[sch.QuestionResponse],
+            status_code=status.HTTP_201_CREATED,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="批量导入问答题目。",
+            description="""
+请求体为题目数组，每道题的格式与单个添加题目相同，但不需要`project_id`。
+
+所有题目先全部校验，有一道不合法就全部不导入（422），然后在一个事务中一次性插入。
+
+`replace=true`时会在同一个事务中先删除项目原有的全部题目，相当于原子地替换题库。
+已有答题记录的项目替换题库后，可以调用统计重算接口更新统计数据。
+
+返回项目导入后的全部题目。
+""")
+async def import_questions(questions = Depends(crud.import_questions)):
+    return questions
+
+
+@router.post("/project/{project_id}/questions/csv", response_model=list[sch.QuestionResponse],
+            status_code=status.HTTP_201_CREATED,
+            responses={400: {"description": "Invalid CSV file."},
+                        401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="从CSV文件批量导入问答题目。",
+            description="""
+上传一个UTF-8编码的CSV文件，表头为`q,o1,o2,o3,o4,a`，每行一道题。
+
+校验失败时返回422，`detail`中列出每个出错的行号和原因。其他行为与批量导入接口相同。
+""")
+async def import_questions_csv(questions = Depends(crud.import_questions_csv)):
+    return questions
+
+
+@router.post("/project/{project_id}/clone", response_model=sch.ProjectWithQuestionsAndPrizesForManager,
+            status_code=status.HTTP_201_CREATED,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="复制一个项目。",
+            description="""
+复制项目及其全部问答题目和抽奖奖品，得到一个新的未发布项目(`status=0`)，创建者为当前用户。
+
+奖品的剩余数量`remain`重置为总数量`amount`，答题和抽奖记录、统计数据不会复制。
+
+请求体可选，格式与更新项目相同，可以同时修改新项目的`name`、`description`、`deadline`。
+不提供时沿用原项目的值，注意原项目的截止时间可能已经过了。
+
+整个复制在一个事务中完成，题目和奖品在数据库内用`INSERT ... SELECT`批量复制，耗时与题目数量基本无关。
+""")
+async def clone_project(project = Depends(crud.clone_project)):
+    return project
+
+
+@router.post("/project/{project_id}/inventory/reconcile", response_model=sch.JobResponse,
+            status_code=status.HTTP_202_ACCEPTED,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project not found."}},
+            summary="核对一个项目的奖品剩余数量与实际抽出的数量。",
+            description="""
+根据所有抽奖记录重新统计每个奖品发出的数量，与奖品的剩余数量`remain`比较。
+对账在后台任务中执行，此接口立即返回任务信息，用任务接口查询结果。
+
+任务结果中`prize`列出每个奖品的`issued`（记录中抽出的数量）、`expected_remain`（`amount - issued`）
+和`drift`（`remain - expected_remain`，正数表示剩余偏多）。`unknown_prize`为记录中出现但已不存在的奖品。
+`oversold`列出超发的奖品（`issued`大于`amount`，`expected_remain`为负数），`oversold`字段为超发的数量。
+
+`repair=true`时把对不上的`remain`改为`expected_remain`，超发的奖品不自动修复，需要管理员处理。对账期间该项目有人抽奖时（`stable`为`false`）不修复，
+任务稍后自动重试。只报告时不会修改任何数据。
+
+记录按批读取，不会阻塞抽奖，内存占用与记录数量无关。
+""")
+async def reconcile_inventory(job = Depends(crud.reconcile_inventory)):
+    return job
+
+
+@router.get("/project/{project_id}/hot", response_model=sch.HotProjectResponse,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project is not in hot mode."}},
+            summary="获取一个项目的热模式状态。",
+            description="""
+`owner`为持有该项目的进程（主机名:进程号）。`seq`为最新一次抽奖的序号，`durable_seq`为已写入磁盘的序号，
+`applied_seq`为已写入数据库的序号，`user_num`为内存中的用户数。不是由当前进程持有时只返回`owner`和`applied_seq`。
+""")
+async def get_hot_mode(state = Depends(crud.read_hot_mode)):
+    return state
+
+
+@router.put("/project/{project_id}/hot", response_model=sch.HotProjectResponse,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission / Project not published / Project has ended."},
+                        404: {"description": "Project not found."},
+                        409: {"description": "Project is in hot mode in another process."}},
+            summary="让一个项目进入热模式。",
+            description="""
+用于活动刚开始、抽奖请求集中的项目。热模式下，项目的奖品库存和用户的抽奖结果保存在处理此请求的进程的内存中，
+抽奖不再读写数据库：每次抽奖追加到本地的预写日志（`QA_RAFFLE_JOURNAL_DIR`，默认`journal`），
+同一时刻的多个抽奖合并成一次`fsync`，写入磁盘后立即返回，后台每0.2秒把日志中的抽奖批量写进数据库。
+
+进程重启后自动恢复：从数据库读出已写入的状态，再重放日志中还没写入数据库的抽奖，不会丢失已经返回给用户的结果。
+
+注意：
+- 同一时刻只有一个进程持有热模式的项目，其他进程收到该项目的抽奖请求时返回503，部署多个进程时需要把这个项目的抽奖请求路由到持有它的进程。
+- 热模式下不能增删改奖品、删除项目，返回409。
+- 热模式下抽奖接口返回的项目信息不增加`browse_times`。
+- 管理端的项目详情、统计数据比实际的抽奖结果最多落后约0.2秒。
+""")
+async def enable_hot_mode(state = Depends(crud.enable_hot_mode)):
+    return state
+
+
+@router.delete("/project/{project_id}/hot", status_code=status.HTTP_204_NO_CONTENT,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Project is not in hot mode."},
+                        409: {"description": "Project is in hot mode in another process."}},
+            summary="让一个项目退出热模式。",
+            description="""
+需要发给持有该项目的进程。返回前会把日志中的抽奖全部写进数据库，之后抽奖恢复为直接读写数据库。
+""")
+async def disable_hot_mode(disabled = Depends(crud.disable_hot_mode)):
+    pass
+
+
+@router.get("/jobs", response_model=list[sch.JobResponse],
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."}},
+            summary="获取最近的后台任务。",
+            description="""
+按`id`从新到旧返回，可以用`status`和`kind`筛选。
+
+后台任务包括删除项目后的数据清理(`purge_project`)、统计数据重算(`recompute_stats`)和奖品库存对账(`reconcile_inventory`)。
+
+`status`为`pending`（等待执行）、`running`（执行中）、`succeeded`（成功）或`failed`（失败）。
+失败的任务会等待一段时间后重试，间隔每次翻倍，`attempts`达到`max_attempts`后不再重试，
+`last_error`为最近一次失败的错误信息。成功的任务`result`为任务的返回值。已结束的任务保留7天。
+""")
+async def get_jobs(jobs = Depends(crud.read_jobs)):
+    return jobs
+
+
+@router.get("/job/{job_id}", response_model=sch.JobResponse,
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Job not found."}},
+            summary="获取一个后台任务的状态。",
+            description="""
+使用`id`指定要查询的任务。
+""")
+async def get_job(job = Depends(crud.read_job)):
+    return job
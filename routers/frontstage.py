@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Depends, status
+from fastapi.responses import StreamingResponse
 import schemas as sch 
 import sql.crud as crud
+import fastjson
+import live
 from routers.login import verify_token
 
 router = APIRouter()
@@ -11,14 +14,18 @@ router = APIRouter()
             summary="获取用户参与过的所有项目预览（不包含问答题目和抽奖奖品信息）。",
             description="""
 用于在用户主页展示自己参与过的项目预览信息。
+
+可以用`fields`参数只返回需要的字段，如`?fields=id,name,status`。
 """)
-async def get_records_by_user(projects = Depends(crud.read_records_by_user)):
-    return projects
+async def get_records_by_user(projects = Depends(crud.read_records_by_user),
+                              fields: str | None = Depends(fastjson.fields_query)):
+    return await fastjson.response(list[sch.ProjectResponse], projects, fields)
 
 
 @router.get("/project/{project_id}/user", 
             response_model=sch.ProjectWithQuestionsAndPrizesForUser,
-            responses={401: {"description": "Not authorized."},
+            responses={304: {"description": "Not modified."},
+                    401: {"description": "Not authorized."},
                     403: {"description": "Project not published."},
                     404: {"description": "Project not found."}},
             summary="获取一个项目的详细信息。",
@@ -43,13 +50,22 @@ async def get_records_by_user(projects = Depends(crud.read_records_by_user)):
 
 `raffle_time`为用户最新一次抽奖的时间，后端自动生成并更新。
 
+可以用`fields`参数只返回需要的字段，如`?fields=prize.id,prize.remain,raffle_remain_times`。
+
+响应头中有`ETag`，再次请求时放在`If-None-Match`中，项目、奖品剩余数量和自己的记录都没有变化时返回`304`，
+没有响应体（仍然会增加访问次数）。
+
 """)
-async def get_project_details(project = Depends(crud.read_project_details_by_user)):
-    return project
+async def get_project_details(etag: str = Depends(crud.check_project_etag_by_user),
+                              project = Depends(crud.read_project_details_by_user),
+                              fields: str | None = Depends(fastjson.fields_query)):
+    return await fastjson.response(sch.ProjectWithQuestionsAndPrizesForUser, project, fields,
+                                   headers={"ETag": etag})
 
 
 @router.post("/answer", response_model=sch.ProjectWithQuestionsAndPrizesForUser,
-            responses={401: {"description": "Not authorized."}},
+            responses={401: {"description": "Not authorized."},
+                    409: {"description": "A request with this Idempotency-Key is in progress."}},
             summary="提交答题。",
             description="""
 `project_id`指定答题的项目。
@@ -57,6 +73,10 @@ async def get_project_details(project = Depends(crud.read_project_details_by_use
 `answer`是一个包含用户答案(1~4)的数组，数组的每一个元素分别对应一道题的答案。
 
 调用此接口会在数据库中创建一条答题记录，并返回包含用户答案和题目正确答案的完整项目信息。
+
+请求头`Idempotency-Key`可选。带上它时，同一个用户用同一个键重复请求（例如超时重试）只会执行一次，
+之后的请求直接返回第一次的响应，响应头`Idempotent-Replayed`为`true`。键的有效期为24小时。
+第一次请求还在处理时重复请求返回409，同一个键用于不同的请求返回422。
 """)
 async def answer_question(project = Depends(crud.answer_question)):
     return project
@@ -65,7 +85,8 @@ async def answer_question(project = Depends(crud.answer_question)):
 @router.post("/raffle/{project_id}", response_model=sch.ProjectWithQuestionsAndPrizesForUser,
             responses={401: {"description": "Not authorized."},
                     403: {"description": "Project has ended."},
-                    404: {"description": "Project not found."}},
+                    404: {"description": "Project not found."},
+                    409: {"description": "A request with this Idempotency-Key is in progress."}},
             summary="进行一次抽奖。",
             description="""
 使用`id`指定要进行抽奖的项目。
@@ -77,6 +98,38 @@ async def answer_question(project = Depends(crud.answer_question)):
 每种奖品每个用户只会抽到一次，当然安慰奖可以多次抽到。
 
 调用此接口会将抽奖记录存入数据库中，并返回包含抽奖结果的完整项目信息。其中抽奖结果是一个包含每次抽中的奖品的`id`的数组。
+
+请求头`Idempotency-Key`可选。带上它时，同一个用户用同一个键重复请求（例如超时重试）只会执行一次，
+之后的请求直接返回第一次的响应，响应头`Idempotent-Replayed`为`true`。键的有效期为24小时。
+第一次请求还在处理时重复请求返回409，同一个键用于不同的请求返回422。
 """)
 async def raffle_prize(project = Depends(crud.raffle_prize)):
-    return project
\ No newline at end of file
+    return project
+
+
+@router.get("/project/{project_id}/inventory/stream", response_class=StreamingResponse,
+            dependencies=[Depends(crud.check_inventory_access)],
+            responses={200: {"content": {"text/event-stream": {}}},
+                    401: {"description": "Not authorized."},
+                    403: {"description": "Project not published."},
+                    404: {"description": "Project not found."}},
+            summary="订阅一个项目的奖品库存变化（Server-Sent Events）。",
+            description="""
+使用`id`指定要订阅的项目，用于在项目页实时展示奖品剩余数量，代替轮询项目详情接口。
+
+浏览器的`EventSource`不能设置请求头，可以用`?token=`参数传access token。
+
+连接后立即推送一次当前库存，之后在奖品剩余数量`remain`或项目状态`status`变化时推送，每条消息为：
+
+```
+event: inventory
+data: {"status": 1, "prize": [{"id": 1, "remain": 3}, {"id": 2, "remain": 97}]}
+```
+
+`status`为`-1`表示项目已被删除，推送后连接结束。没有变化时每15秒发送一行注释保持连接。
+
+同一个项目的所有订阅者共享同一份数据库查询结果，订阅人数不会增加数据库负担。
+""")
+async def stream_inventory(project_id: int):
+    return StreamingResponse(live.stream(project_id), media_type="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
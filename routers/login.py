@@ -11,6 +11,7 @@ from pydantic import BaseModel
 import schemas as sch
 from sql.database import Session, get_session
 import sql.models as models
+import sql.etag as etag
 
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
@@ -37,6 +38,7 @@ class TokenData(BaseModel):
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 router = APIRouter()
 
@@ -154,6 +156,9 @@ async def update_user(user_update: sch.UserUpdate,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="User not found.")
     user_data = user_update.model_dump(exclude_unset=True)
+    if user_data.get("username", user.username) != user.username:
+        # 项目详情中的用户名变了，缓存的项目详情失效
+        etag.bump_users(session)
     user.sqlmodel_update(user_data)
     session.add(user)
     session.commit()
@@ -227,5 +232,6 @@ async def get_current_user(user = Depends(verify_token)):
             summary="谨慎：注销当前登录用户的账号。")
 async def delete_current_user(user = Depends(verify_token), session: Session = Depends(get_session)):
     session.delete(user)
+    etag.bump_users(session)
     session.commit()
 
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
+import metrics
+import profiling
+import schemas as sch
+from routers.login import verify_token
+from sql.crud import check_permission
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse,
+            summary="以Prometheus文本格式导出运行指标。",
+            description="""
+包括每个路由的请求数、状态码、延迟分布、正在处理的请求数，
+以及每个请求执行的SQL语句数和耗时、事务提交次数和耗时、数据库锁等待次数。
+""")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/api/profiles", response_model=list[sch.ProfileSummary],
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."}},
+            summary="查看最近的请求性能分析记录。",
+            description="""
+管理员在请求头中加上`X-Profile: 1`，该请求就会在采样分析器下运行，响应头`X-Profile-Id`为分析记录的`id`。
+
+也可以通过环境变量`PROFILE_ROUTES`配置总是分析的路由，例如`/api/project/{project_id}`。
+
+分析结果保存在`PROFILE_DIR`目录（默认为`profiles`）中，这里只列出最近的若干条。
+""")
+async def get_profiles(user = Depends(verify_token)):
+    check_permission(user)
+    return profiling.recent_profiles()
+
+
+@router.get("/api/profiles/{profile_id}",
+            responses={401: {"description": "Not authorized."},
+                        403: {"description": "No permission."},
+                        404: {"description": "Profile not found."}},
+            summary="查看一条请求性能分析记录的详细内容。",
+            description="""
+`stacks`为折叠栈格式的采样结果（`线程名;外层函数;...;内层函数 采样次数`），可以直接用来生成火焰图。
+
+`sql`为请求执行的每条SQL语句的开始时间（相对请求开始的秒数）、耗时和语句内容。
+""")
+async def get_profile(profile_id: str, user = Depends(verify_token)):
+    check_permission(user)
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Profile not found.")
+    return profile
@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, Json
+from typing import Any, Literal
 import datetime
 from sqlmodel import SQLModel
 
@@ -309,6 +310,7 @@ class ProjectWithQuestionsAndPrizesForUser(ProjectPublic):
     raffle_result: list[int] = []
     raffle_remain_times: int | None = None
     raffle_time: datetime.datetime | None = None
+    claim_code: str | None = None
     
     model_config = {
         "json_schema_extra": {
@@ -532,3 +534,148 @@ class AnswerQuestions(BaseModel):
         }
     }
 
+
+
+class ProjectStatsResponse(BaseModel):
+    project_id: int
+    answer_num: int = 0
+    question_correct_rate: list[float] = []
+    score_distribution: dict[int, int] = {}
+    raffle_user_num: int = 0
+    raffle_num: int = 0
+    prize_hit: dict[int, int] = {}
+    claim_num: int = 0
+    claim_rate: float = 0.0
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "project_id": 1,
+                "answer_num": 4,
+                "question_correct_rate": [0.5, 1.0, 0.75, 0.25],
+                "score_distribution": {"1": 1, "2": 1, "3": 2},
+                "raffle_user_num": 3,
+                "raffle_num": 9,
+                "prize_hit": {"1": 2, "2": 1, "3": 6},
+                "claim_num": 1,
+                "claim_rate": 0.3333333333333333
+            }
+        }
+    }
+
+
+class RollupBucket(BaseModel):
+    time: datetime.datetime
+    answer_num: int = 0
+    raffle_num: int = 0
+    claim_num: int = 0
+
+
+class ParticipationRollupResponse(BaseModel):
+    project_id: int
+    resolution: str
+    buckets: list[RollupBucket] = []
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "project_id": 1,
+                "resolution": "5m",
+                "buckets": [
+                    {
+                        "time": "2025-01-04T21:50:00",
+                        "answer_num": 12,
+                        "raffle_num": 30,
+                        "claim_num": 0
+                    },
+                    {
+                        "time": "2025-01-04T21:55:00",
+                        "answer_num": 8,
+                        "raffle_num": 25,
+                        "claim_num": 2
+                    }
+                ]
+            }
+        }
+    }
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    route: str | None = None
+    status: int
+    started_at: datetime.datetime
+    duration: float
+    sql_statements: int
+    sql_duration: float
+    file: str
+
+
+class QuestionImport(BaseModel):
+    q: str
+    o1: str
+    o2: str
+    o3: str
+    o4: str
+    a: int = Field(ge=1, le=4)
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "q": "山东大学在哪一年建校？",
+                "o1": "1899",
+                "o2": "1900",
+                "o3": "1901",
+                "o4": "1902",
+                "a": 3
+            }
+        }
+    }
+
+
+class PrizeClaim(BaseModel):
+    user_ids: list[int] = Field(default=[], max_length=1000)
+    codes: list[str] = Field(default=[], max_length=1000)
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "user_ids": [3, 5],
+                "codes": ["8-1f3a9c02"]
+            }
+        }
+    }
+
+
+class PrizeClaimResult(BaseModel):
+    user_id: int | None = None
+    code: str | None = None
+    username: str | None = None
+    raffle_result: list[int] = []
+    status: Literal["claimed", "already_claimed", "not_found", "invalid_code"]
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    payload: Json[Any]
+    dedup_key: str | None = None
+    status: Literal["pending", "running", "succeeded", "failed"]
+    attempts: int
+    max_attempts: int
+    run_after: datetime.datetime
+    last_error: str | None = None
+    result: Json[Any] | None = None
+    create_time: datetime.datetime
+    finish_time: datetime.datetime | None = None
+
+
+class HotProjectResponse(BaseModel):
+    project_id: int
+    owner: str | None = None
+    seq: int | None = None
+    durable_seq: int | None = None
+    applied_seq: int
+    user_num: int | None = None
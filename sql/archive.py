@@ -0,0 +1,172 @@
+import asyncio
+import datetime
+import gzip
+import itertools
+import json
+import logging
+import os
+import time
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, delete
+
+import sql.models as models
+from sql.database import open_session, shard_of
+
+
+# 结束超过 ARCHIVE_AFTER_DAYS 天的项目，答题抽奖记录移到 ARCHIVE_DIR 下的 gzip 压缩 NDJSON 文件中，
+# 数据库里只留下 ProjectArchive 中的一行汇总，详情接口读取时再从文件中读回来
+ARCHIVE_DIR = os.getenv("QA_RAFFLE_ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("QA_RAFFLE_ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL = 3600     # 秒
+BATCH_SIZE = 1000
+BATCH_PAUSE = 0.05
+
+FIELDS = [column.name for column in models.Record.__table__.columns]
+DATETIME_FIELDS = ("answer_time", "raffle_time")
+
+
+logger = logging.getLogger(__name__)
+
+
+def archive_path(project_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"project_{project_id}.ndjson.gz")
+
+
+def _dump(record: models.Record) -> str:
+    row = {field: getattr(record, field) for field in FIELDS}
+    for field in DATETIME_FIELDS:
+        if row[field] is not None:
+            row[field] = row[field].isoformat()
+    return json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _load(line: str) -> models.Record:
+    row = json.loads(line)
+    for field in DATETIME_FIELDS:
+        if row[field] is not None:
+            row[field] = datetime.datetime.fromisoformat(row[field])
+    return models.Record(**row)
+
+
+def _read_file(file: str):
+    with gzip.open(file, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield _load(line)
+
+
+def iter_records(session: Session, project_id: int, yield_per: int = 1000):
+    # 项目的全部记录：归档文件中的加上热表中的。归档之后又产生的记录，或者正在删除的记录还在热表中，以热表为准
+    archive = session.get(models.ProjectArchive, project_id)
+    hot = session.exec(select(models.Record).filter_by(project_id=project_id)
+                       .execution_options(yield_per=yield_per))
+    if archive is None:
+        yield from hot
+        return
+    hot = {record.user_id: record for record in hot}
+    for record in _read_file(archive.file):
+        yield hot.pop(record.user_id, record)
+    yield from hot.values()
+
+
+def read_record(session: Session, project_id: int, user_id: int) -> models.Record | None:
+    record = session.exec(select(models.Record).filter_by(user_id=user_id, project_id=project_id)).first()
+    if record:
+        return record
+    archive = session.get(models.ProjectArchive, project_id)
+    if archive is None:
+        return None
+    for record in _read_file(archive.file):
+        if record.user_id == user_id:
+            return record
+    return None
+
+
+def restore_record(session: Session, project_id: int, user_id: int) -> models.Record | None:
+    # 要修改的记录：热表中没有而归档文件中有时（项目归档后又被重新开放），用原来的id放回热表并提交，
+    # 之后的修改以热表为准，再次归档时覆盖文件中的那一行
+    record = session.exec(select(models.Record).filter_by(user_id=user_id, project_id=project_id)).first()
+    if record or session.get(models.ProjectArchive, project_id) is None:
+        return record
+    record = read_record(session, project_id, user_id)
+    if record is None:
+        return None
+    session.add(record)
+    try:
+        session.commit()
+    except IntegrityError:
+        # 同一用户的另一个请求已经放回去了
+        session.rollback()
+    return session.exec(select(models.Record).filter_by(user_id=user_id, project_id=project_id)).first()
+
+
+def archivable_projects(session: Session, days: int = ARCHIVE_AFTER_DAYS) -> list[int]:
+    # 截止时间已过去 days 天、热表中还有记录的已发布项目（数据库中的status可能还没更新为2）
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    return session.exec(select(models.Record.project_id).distinct()
+                        .join(models.Project, models.Project.id == models.Record.project_id)
+                        .where(models.Project.deadline < cutoff, models.Project.status.in_((1, 2)))).all()
+
+
+def archive_project(project_id: int, batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE) -> models.ProjectArchive:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(project_id)
+    summary = models.ProjectArchive(project_id=project_id, file=path, archive_time=datetime.datetime.now())
+    with open_session() as session:
+        # 先完整写到临时文件并落盘，再替换，已有的归档文件（项目曾被重新开放）会合并进来
+        with open(path + ".tmp", "wb") as raw:
+            with gzip.open(raw, "wt", encoding="utf-8") as f:
+                for record in iter_records(session, project_id):
+                    f.write(_dump(record))
+                    summary.record_num += 1
+                    summary.answer_num += record.answer is not None
+                    summary.raffle_num += record.raffle_result is not None
+                    summary.claim_num += record.prize_claim_status
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(path + ".tmp", path)
+        session.merge(summary)
+        session.commit()
+    # 汇总行提交之后再分批删除热表中已经归档的记录
+    _delete_archived(project_id, path, batch_size, pause)
+    return summary
+
+
+def _delete_archived(project_id: int, file: str, batch_size: int, pause: float) -> int:
+    # 读取和删除之间记录可能又被修改了（例如兑奖），只删除内容与写进文件的完全相同的行，
+    # 修改过的留在热表中，读取时以热表为准，下次归档时再写进文件
+    table = models.Record.__table__
+    stmt = delete(table).where(table.c.project_id == project_id,
+                               *[table.c[field].is_not_distinct_from(bindparam("b_" + field))
+                                 for field in FIELDS if field != "project_id"])
+    deleted = 0
+    records = _read_file(file)
+    while batch := [{"b_" + field: getattr(record, field) for field in FIELDS if field != "project_id"}
+                    for record in itertools.islice(records, batch_size)]:
+        with open_session() as session:
+            result = session.exec(stmt, params=batch, bind_arguments={"shard_id": shard_of(project_id)})
+            session.commit()
+        deleted += result.rowcount
+        time.sleep(pause)
+    return deleted
+
+
+def archive_ended_projects(days: int = ARCHIVE_AFTER_DAYS) -> int:
+    with open_session() as session:
+        project_ids = archivable_projects(session, days)
+    records = 0
+    for project_id in project_ids:
+        records += archive_project(project_id).record_num
+    return records
+
+
+async def archive_periodically(interval: float = ARCHIVE_INTERVAL):
+    while True:
+        try:
+            records = await run_in_threadpool(archive_ended_projects)
+            if records:
+                logger.info("Archived %d records.", records)
+        except Exception:
+            logger.exception("Failed to archive ended projects.")
+        await asyncio.sleep(interval)
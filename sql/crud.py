@@ -1,11 +1,23 @@
 import schemas as sch
 import sql.models as models
-from sql.database import get_session
-from sqlmodel import Session, select
+from sql.models import PROJECT_DELETED
+import sql.stats as stats
+import sql.rollup as rollup
+import sql.archive as archive
+import sql.idempotency as idempotency
+import sql.jobs as jobs
+import sql.reconcile as reconcile
+import sql.hot as hot
+import sql.etag as etag
+import live
+import fastjson
+from sql.database import get_session, open_session, shard_of, MAIN
+from sqlmodel import Session, select, insert, update, delete, literal, case, and_
 from fastapi import Depends, HTTPException, status
-from routers.login import verify_token
-from fastapi import Query, Path
-import datetime, random
+from routers.login import verify_token, optional_oauth2_scheme, SECRET_KEY
+from fastapi import Query, Path, Header, UploadFile, File
+from pydantic import ValidationError
+import datetime, random, csv, io, hmac, hashlib
 
 
 MAX_RAFFLE_TIMES = 5
@@ -22,6 +34,13 @@ def check_project_timeout(project) -> bool:
     return False
 
 
+def check_not_hot(session: Session, project_id: int):
+    # 热模式下奖品库存在所有者进程的内存里，不能直接修改数据库
+    if session.get(models.HotProject, project_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, 
+                            detail="Project is in hot mode.")
+
+
 def check_permission(user: models.User):
     if user.manage_permission == False:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
@@ -45,15 +64,22 @@ def update_project(project_id: int, project_update: sch.ProjectUpdate,
                 session: Session=Depends(get_session)):
     check_permission(user)
     project = session.get(models.Project, project_id)
-    if not project:
+    if not project or project.status == PROJECT_DELETED:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Project not found.")
+    hot_project = hot.get(project_id)
+    if hot_project is None:
+        check_not_hot(session, project_id)
     project_data = project_update.model_dump(exclude_unset=True)
     project.sqlmodel_update(project_data)
     check_project_timeout(project)
     session.add(project)
+    etag.bump(session, project_id)
     session.commit()
     session.refresh(project)
+    if hot_project is not None:
+        hot_project.refresh(project)
+    live.hub.notify(project_id)
     return project
 
 
@@ -64,7 +90,8 @@ def read_projects_by_manager(user = Depends(verify_token),
     check_permission(user)
     # projects = session.exec(select(models.Project).offset((page-1)*page_size).limit(page_size)
     #                         .filter_by(creater_id=user.id)).all()
-    projects = session.exec(select(models.Project).filter_by(creater_id=user.id)).all()
+    projects = session.exec(select(models.Project).filter_by(creater_id=user.id)
+                            .where(models.Project.status != PROJECT_DELETED)).all()
     for project in projects:
         if check_project_timeout(project):
             session.add(project)
@@ -73,12 +100,44 @@ def read_projects_by_manager(user = Depends(verify_token),
     return projects
 
 
+IfNoneMatch = Header(default=None, description="上次响应中的`ETag`，项目没有变化时返回304")
+
+
+def check_project_details_etag(project_id: int,
+                            if_none_match: str | None = IfNoneMatch,
+                            fields: str | None = Depends(fastjson.fields_query),
+                            user = Depends(verify_token),
+                            session: Session=Depends(get_session)) -> str:
+    check_permission(user)
+    version = etag.read_version(session, project_id, etag.MANAGER_KINDS)
+    if version is None or version[0] == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    project_etag = etag.make("manager", project_id, *version, fields)
+    if etag.matches(if_none_match, project_etag):
+        etag.not_modified(project_etag)
+    return project_etag
+
+
+USERNAME_CHUNK = 5000      # 每条语句查询的用户数，不超过 SQLite 的参数个数限制
+
+
+def read_usernames(session: Session, user_ids: set[int]) -> dict[int, str]:
+    # 按块批量查询用户名，语句数与参与人数无关（每块一条），不按记录逐个 session.get
+    user_ids = sorted(user_ids)
+    usernames = {}
+    for i in range(0, len(user_ids), USERNAME_CHUNK):
+        usernames.update(session.exec(select(models.User.id, models.User.username)
+                                      .where(models.User.id.in_(user_ids[i:i + USERNAME_CHUNK]))).all())
+    return usernames
+
+
 def read_project_details(project_id: int, 
                         user = Depends(verify_token),
                         session: Session=Depends(get_session)):
     check_permission(user)
     project = session.get(models.Project, project_id)
-    if not project:
+    if not project or project.status == PROJECT_DELETED:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Project not found.")
         
@@ -86,21 +145,22 @@ def read_project_details(project_id: int,
         session.add(project)
         session.commit()
         session.refresh(project)
-    records = session.exec(select(models.Record).filter_by(project_id=project_id)).all()
+    records = list(archive.iter_records(session, project_id))
     project_data = sch.ProjectWithQuestionsAndPrizesForManager.model_validate(project)
     if records != []:
+        usernames = read_usernames(session, {record.user_id for record in records})
         for record in records:
+            if record.user_id not in usernames:     # 已注销的用户
+                continue
             if record.answer_time and record.answer:
-                user = session.get(models.User, record.user_id)
-                qa_participant = sch.QA_ParticipantPublic(id=user.id,
-                                                        username=user.username,
+                qa_participant = sch.QA_ParticipantPublic(id=record.user_id,
+                                                        username=usernames[record.user_id],
                                                         answer=eval(record.answer),
                                                         answer_time=record.answer_time)
                 project_data.qa_participant.append(qa_participant)
             if record.raffle_time and record.raffle_result:
-                user = session.get(models.User, record.user_id)
-                raffle_participant = sch.RaffleParticipantPublic(id=user.id, 
-                                                                username=user.username,
+                raffle_participant = sch.RaffleParticipantPublic(id=record.user_id, 
+                                                                username=usernames[record.user_id],
                                                                 raffle_result=eval(record.raffle_result),
                                                                 raffle_time=record.raffle_time,
                                                                 prize_claim_status=record.prize_claim_status)
@@ -109,53 +169,134 @@ def read_project_details(project_id: int,
     return project
 
 
-def read_project_details_by_user(project_id: int, 
-                                user = Depends(verify_token),
-                                session: Session=Depends(get_session)):
-    project = session.get(models.Project, project_id)
-    if not project:
+# 用户查看项目详情的读模型：只查询响应中需要的列，得到的是元组（Row），不创建 ORM 对象，也没有懒加载。
+# 列从响应的 schema 取，schema 增加字段时这里跟着变
+PROJECT_VIEW_FIELDS = [name for name in sch.ProjectPublic.model_fields if name != "creater"]
+QUESTION_VIEW_COLUMNS = [getattr(models.Question, name) for name in sch.QuestionPublicWithAnswer.model_fields]
+PRIZE_VIEW_COLUMNS = [getattr(models.Prize, name) for name in sch.PrizePublic.model_fields]
+
+
+def touch_project(session: Session, project_id: int):
+    # 一条 UPDATE ... RETURNING 增加访问次数、按截止时间更新状态（同 check_project_timeout），
+    # 并读出项目和创建者的用户名，返回 (项目字段的字典, 创建者)
+    Project = models.Project
+    now = datetime.datetime.now()
+    row = session.exec(update(Project)
+                       .where(Project.id == project_id, Project.status.in_((1, 2)))
+                       .values(browse_times=Project.browse_times + 1,
+                               status=case((and_(Project.status == 1, Project.deadline <= now), 2),
+                                           (and_(Project.status == 2, Project.deadline > now), 1),
+                                           else_=Project.status))
+                       .returning(*[getattr(Project, name) for name in PROJECT_VIEW_FIELDS], Project.creater_id,
+                                  select(models.User.username).where(models.User.id == Project.creater_id)
+                                  .scalar_subquery().label("creater_username"))
+                       .execution_options(synchronize_session=False)).first()
+    if row is None:
+        project = session.get(models.Project, project_id)
+        if not project or project.status == PROJECT_DELETED:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                                detail="Project not found.")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
+                            detail="Project not published.")
+    session.commit()
+    fields = row._asdict()
+    return fields, {"id": fields.pop("creater_id"), "username": fields.pop("creater_username")}
+
+
+def check_project_etag_by_user(project_id: int,
+                            if_none_match: str | None = IfNoneMatch,
+                            fields: str | None = Depends(fastjson.fields_query),
+                            user = Depends(verify_token),
+                            session: Session=Depends(get_session)) -> str:
+    hot_project = hot.get(project_id)
+    # 热模式下以内存中的库存为准，用抽奖序号代替数据库中的计数器
+    version = etag.read_version(session, project_id, () if hot_project is not None else etag.USER_KINDS)
+    if version is None or version[0] == PROJECT_DELETED:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Project not found.")
-    if project.status == 0:
+    if version[0] == 0:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
                             detail="Project not published.")
-    project.browse_times += 1
-    check_project_timeout(project)
-    session.add(project)
-    session.commit()
-    session.refresh(project)
-    record = session.exec(select(models.Record).filter_by(user_id=user.id, project_id=project_id)).first()
-    questions = session.exec(select(models.Question).filter_by(project_id=project_id)).all()
-    prizes = session.exec(select(models.Prize).filter_by(project_id=project_id)).all()
+    if hot_project is not None:
+        state = ("hot", hot_project.seq, etag.record_state(hot_project.record(session, user.id)))
+    else:
+        record = session.exec(select(models.Record.answer_time, models.Record.raffle_time, models.Record.raffle_result)
+                              .where(models.Record.project_id == project_id,
+                                     models.Record.user_id == user.id)).first()
+        state = etag.record_state(record)
+    project_etag = etag.make("user", project_id, user.id, *version, state, fields)
+    if etag.matches(if_none_match, project_etag):
+        touch_project(session, project_id)     # 返回 304 也算一次访问
+        etag.not_modified(project_etag)
+    return project_etag
+
+
+def read_project_details_by_user(project_id: int, 
+                                user = Depends(verify_token),
+                                session: Session=Depends(get_session)):
+    fields, creater = touch_project(session, project_id)
+    hot_project = hot.get(project_id)
+    if hot_project is not None:
+        # 数据库中的抽奖结果和库存可能还没更新，以内存中的为准
+        project_data = hot_project.view().model_copy(update=fields)
+        return user_view(project_data, hot_project.record(session, user.id),
+                        hot_project.correct_answer, bool(hot_project.level), user.id)
+    record = archive.read_record(session, project_id, user.id)
+    questions = session.exec(select(*QUESTION_VIEW_COLUMNS)
+                             .where(models.Question.project_id == project_id).order_by(models.Question.id)).all()
+    prizes = session.exec(select(*PRIZE_VIEW_COLUMNS)
+                          .where(models.Prize.project_id == project_id).order_by(models.Prize.id)).all()
+    project_data = sch.ProjectWithQuestionsAndPrizesForUser.model_validate(
+        {**fields, "creater": creater,
+         "question": [question._asdict() for question in questions],
+         "prize": [prize._asdict() for prize in prizes]})
+    return user_view(project_data, record, [question.a for question in questions], prizes != [], user.id)
+
+
+def user_view(project_data: sch.ProjectWithQuestionsAndPrizesForUser, record: models.Record | None,
+            correct_answer: list[int], has_prize: bool, user_id: int):
+    # 按用户的记录填入答题和抽奖信息，热模式下的项目也用它（见 sql/hot.py）
+    has_question = correct_answer != []
     if record:
-        project_data = sch.ProjectWithQuestionsAndPrizesForUser.model_validate(project)
-        project_data.raffle_time = record.raffle_time
-        if questions != [] and prizes != []:  # 如果是问答+抽奖项目，有记录说明至少已经答了题
-            project_data.user_answer = eval(record.answer)
-            project_data.correct_answer = [question.a for question in questions]
+        if has_question and has_prize:  # 如果是问答+抽奖项目，有记录一般说明已经答了题，也可能是没答题直接抽了奖
+            project_data.raffle_time = record.raffle_time
+            project_data.user_answer = eval(record.answer) if record.answer else None
+            project_data.correct_answer = correct_answer
             project_data.raffle_times = record.raffle_times
             if record.raffle_result:
                 project_data.raffle_result = eval(record.raffle_result)
+                project_data.claim_code = claim_code(project_data.id, user_id)
             else:
                 project_data.raffle_result = []
             project_data.raffle_remain_times = MAX_RAFFLE_TIMES - len(project_data.raffle_result)
-            return project_data
-        elif questions != [] and prizes == []:  # 如果是仅问答项目，有记录说明已经答了题
+        elif has_question:  # 如果是仅问答项目，有记录说明已经答了题
+            project_data.raffle_time = record.raffle_time
             project_data.user_answer = eval(record.answer)
-            project_data.correct_answer = [question.a for question in questions]
-            return project_data
-        elif questions == [] and prizes != []:  # 如果是仅抽奖项目，有记录说明已经抽过奖
+            project_data.correct_answer = correct_answer
+        elif has_prize:  # 如果是仅抽奖项目，有记录说明已经抽过奖
+            project_data.raffle_time = record.raffle_time
             project_data.raffle_times = 1
             project_data.raffle_result = eval(record.raffle_result)
             project_data.raffle_remain_times = 0
-            return project_data
-    else:
-        if questions == [] and prizes != []: # 没记录并且是仅抽奖项目，说明还没参与抽奖
-            project_data = sch.ProjectWithQuestionsAndPrizesForUser.model_validate(project)
-            project_data.raffle_times = 1
-            project_data.raffle_remain_times = 1
-            return project_data
-    return project
+            project_data.claim_code = claim_code(project_data.id, user_id)
+    elif not has_question and has_prize: # 没记录并且是仅抽奖项目，说明还没参与抽奖
+        project_data.raffle_times = 1
+        project_data.raffle_remain_times = 1
+    return project_data
+
+
+def _enqueue_recompute_stats(session: Session, project_id: int, user) -> models.Job:
+    return jobs.enqueue(session, "recompute_stats", {"project_id": project_id},
+                        dedup_key=f"recompute_stats:{project_id}", creater_id=user.id)
+
+
+def _enqueue_regrade(session: Session, project_id: int, user) -> bool:
+    # 题目变了，已有答题的统计数据要按新的题目重算，放到后台执行。草稿项目还没有答题记录，不用重算
+    project = session.get(models.Project, project_id)
+    if not project or project.status in (0, PROJECT_DELETED):
+        return False
+    _enqueue_recompute_stats(session, project_id, user)
+    return True
 
 
 def add_question(question_add: sch.QuestionAdd,
@@ -164,8 +305,12 @@ def add_question(question_add: sch.QuestionAdd,
     check_permission(user)
     question = models.Question.model_validate(question_add)
     session.add(question)
+    etag.bump(session, question.project_id)
+    regrade = _enqueue_regrade(session, question.project_id, user)
     session.commit()
     session.refresh(question)
+    if regrade:
+        jobs.wake()
     return question
 
 
@@ -178,10 +323,17 @@ def update_question(question_id: int, question_update: sch.QuestionUpdate,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Question not found.")
     question_data = question_update.model_dump(exclude_unset=True)
+    regrade = 'a' in question_data and question_data['a'] != question.a
     question.sqlmodel_update(question_data)
     session.add(question)
+    etag.bump(session, question.project_id)
+    if regrade:
+        # 正确答案变了
+        regrade = _enqueue_regrade(session, question.project_id, user)
     session.commit()
     session.refresh(question)
+    if regrade:
+        jobs.wake()
     return question
     
 
@@ -194,19 +346,26 @@ def delete_question(question_id: int,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Question not found.")
     session.delete(question)
+    etag.bump(session, question.project_id)
+    regrade = _enqueue_regrade(session, question.project_id, user)
     session.commit()
+    if regrade:
+        jobs.wake()
     
 
 def add_prize(prize_add: sch.PrizeAdd,
             user = Depends(verify_token),
             session: Session=Depends(get_session)):
     check_permission(user)
+    check_not_hot(session, prize_add.project_id)
     prize_add_dict = prize_add.model_dump()
     prize_add_dict['remain'] = prize_add.amount
     prize = models.Prize(**prize_add_dict)
     session.add(prize)
+    etag.bump(session, prize.project_id)
     session.commit()
     session.refresh(prize)
+    live.hub.notify(prize.project_id)
     return prize
 
 
@@ -218,6 +377,7 @@ def update_prize(prize_id: int, prize_update: sch.PrizeUpdate,
     if not prize:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Prize not found.")
+    check_not_hot(session, prize.project_id)
     prize_data = prize_update.model_dump(exclude_unset=True)
     if 'amount' in prize_data:
         amount_change = prize_data['amount'] - prize.amount
@@ -227,8 +387,10 @@ def update_prize(prize_id: int, prize_update: sch.PrizeUpdate,
                                 detail="Prize amount is less than already raffled.")
     prize.sqlmodel_update(prize_data)
     session.add(prize)
+    etag.bump(session, prize.project_id)
     session.commit()
     session.refresh(prize)
+    live.hub.notify(prize.project_id)
     return prize
 
 
@@ -240,8 +402,12 @@ def delete_prize(prize_id: int,
     if not prize:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Prize not found.")
+    check_not_hot(session, prize.project_id)
+    project_id = prize.project_id
     session.delete(prize)
+    etag.bump(session, project_id)
     session.commit()
+    live.hub.notify(project_id)
     
     
 def delete_project(project_id: int, 
@@ -249,17 +415,18 @@ def delete_project(project_id: int,
                 session: Session=Depends(get_session)):
     check_permission(user)
     project = session.get(models.Project, project_id)
-    if not project:
+    if not project or project.status == PROJECT_DELETED:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Project not found.")
-    questions = session.exec(select(models.Question).filter_by(project_id=project_id)).all()
-    for question in questions:
-        session.delete(question)
-    prizes = session.exec(select(models.Prize).filter_by(project_id=project_id)).all()
-    for prize in prizes:
-        session.delete(prize)
-    session.delete(project)
+    check_not_hot(session, project_id)
+    # 只做删除标记，题目、奖品和记录由后台任务分批删除，见 sql/purge.py
+    project.status = PROJECT_DELETED
+    session.add(project)
+    jobs.enqueue(session, "purge_project", {"project_id": project_id},
+                 dedup_key=f"purge_project:{project_id}", creater_id=user.id)
     session.commit()
+    jobs.wake()
+    live.hub.notify(project_id)
     
     
 def publish_project(project_id: int,
@@ -267,20 +434,30 @@ def publish_project(project_id: int,
                 session: Session=Depends(get_session)):
     check_permission(user)
     project = session.get(models.Project, project_id)
-    if not project:
+    if not project or project.status == PROJECT_DELETED:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Project not found.")
     if project.status == 0:
         project.status = 1
         session.add(project)
+        etag.bump(session, project_id)
         session.commit()
         session.refresh(project)
+        live.hub.notify(project_id)
     return project
 
 
 def answer_question(user_answer: sch.AnswerQuestions,
+                    idempotency_key: idempotency.IdempotencyKeyHeader = None,
                     user = Depends(verify_token),
                     session: Session=Depends(get_session)):
+    return idempotency.run(session, user.id, idempotency_key, f"answer:{user_answer.model_dump_json()}",
+                        sch.ProjectWithQuestionsAndPrizesForUser,
+                        lambda: _answer_question(user_answer, user, session),
+                        lambda: read_project_details_by_user(user_answer.project_id, user, session))
+
+
+def _answer_question(user_answer: sch.AnswerQuestions, user, session: Session):
     questions = session.exec(select(models.Question).filter_by(project_id=user_answer.project_id)).all()
     correct_answer = [question.a for question in questions]
     question_num = len(questions)
@@ -290,8 +467,13 @@ def answer_question(user_answer: sch.AnswerQuestions,
             correct_num += 1
     correct_rate = correct_num / question_num
     raffle_times = int(correct_rate * MAX_RAFFLE_TIMES + 0.5)   # 四舍五入，注意用round()函数会出现银行家舍入问题
-    record_in_db = session.exec(select(models.Record).filter_by(user_id=user.id, 
-                                project_id=user_answer.project_id)).first()
+    hot_project = hot.get(user_answer.project_id)
+    if hot_project is not None:
+        # 热模式下第一次抽奖的记录还只在内存中，已经抽过奖的用户和数据库中有记录时一样，不再创建记录
+        record_in_db = hot_project.record(session, user.id)
+    else:
+        # 项目归档后又被重新开放时，记录可能只在归档文件中
+        record_in_db = archive.read_record(session, user_answer.project_id, user.id)
     if not record_in_db:
         record = models.Record(user_id=user.id,
                             project_id=user_answer.project_id,
@@ -299,23 +481,41 @@ def answer_question(user_answer: sch.AnswerQuestions,
                             answer_time=datetime.datetime.now(),
                             raffle_times=raffle_times)
         session.add(record)
+        stats.record_answer(session, user_answer.project_id, user_answer.answer, correct_answer)
         session.commit()
         session.refresh(record)
+        rollup.add_event(user_answer.project_id, "answer_num")
     project = read_project_details_by_user(project_id=user_answer.project_id, user=user, session=session)
     return project
 
 
 def raffle_prize(project_id: int,
+                idempotency_key: idempotency.IdempotencyKeyHeader = None,
                 user = Depends(verify_token),
                 session: Session=Depends(get_session)):
+    return idempotency.run(session, user.id, idempotency_key, f"raffle:{project_id}",
+                        sch.ProjectWithQuestionsAndPrizesForUser,
+                        lambda: _raffle_prize(project_id, user, session),
+                        lambda: read_project_details_by_user(project_id, user, session))
+
+
+def _raffle_prize(project_id: int, user, session: Session):
+    hot_project = hot.get(project_id)
+    if hot_project is not None:
+        # 热模式：在内存中抽奖，写入预写日志后返回，不读写数据库
+        record = hot_project.draw(session, user.id)
+        return user_view(hot_project.view(), record, hot_project.correct_answer, bool(hot_project.level), user.id)
+    if session.get(models.HotProject, project_id):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                            detail="Project is served by another process.")
     project = session.get(models.Project, project_id)
-    if not project:
+    if not project or project.status == PROJECT_DELETED:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Project not found.")
     if project.status == 2:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
                             detail="Project has ended.")
-    record = session.exec(select(models.Record).filter_by(user_id=user.id, project_id=project_id)).first()
+    record = archive.restore_record(session, project_id, user.id)
     if record and record.raffle_result:
         already_raffled_prize = eval(record.raffle_result)
     else:
@@ -338,32 +538,40 @@ def raffle_prize(project_id: int,
         session.add(record_create)
         session.commit()
         session.refresh(record_create)
-        prize_get = session.get(models.Prize, result[0])
+        # 直接到项目所在的数据库中取奖品，不在所有数据库中按id查找
+        prize_get = session.get(models.Prize, result[0], bind_arguments={"shard_id": shard_of(project_id)})
         prize_get.remain -= 1
         session.add(prize_get)
+        stats.record_raffle(session, project_id, result[0], first_raffle=True)
         session.commit()
         session.refresh(prize_get)
+        rollup.add_event(project_id, "raffle_num")
     else:
         result = random.choices(list(prize_pool.keys()), weights=list(prize_pool.values()), k=1)
         if not record.raffle_result:
             record.raffle_result = str(result)
             record.raffle_time = datetime.datetime.now()
-            prize_get = session.get(models.Prize, result[0])
+            prize_get = session.get(models.Prize, result[0], bind_arguments={"shard_id": shard_of(project_id)})
             prize_get.remain -= 1
             session.add(prize_get)
+            stats.record_raffle(session, project_id, result[0], first_raffle=True)
             session.commit()
             session.refresh(prize_get)
+            rollup.add_event(project_id, "raffle_num")
         elif record.raffle_times > len(eval(record.raffle_result)):
             record.raffle_result = str(eval(record.raffle_result) + result)
             record.raffle_time = datetime.datetime.now()
             session.add(record)
             session.commit()
             session.refresh(record)
-            prize_get = session.get(models.Prize, result[0])
+            prize_get = session.get(models.Prize, result[0], bind_arguments={"shard_id": shard_of(project_id)})
             prize_get.remain -= 1
             session.add(prize_get)
+            stats.record_raffle(session, project_id, result[0], first_raffle=False)
             session.commit()
             session.refresh(prize_get)
+            rollup.add_event(project_id, "raffle_num")
+    live.hub.notify(project_id)
     project = read_project_details_by_user(project_id=project_id, user=user, session=session)
     return project
 
@@ -372,27 +580,325 @@ def read_records_by_user(user = Depends(verify_token),
                         # page: int = Query(default=1, ge=1, description="展示第几页（从1开始）"),
                         # page_size: int = Query(default=10, ge=1, description="每一页展示的项目数"),
                         session: Session=Depends(get_session)):
-    records = session.exec(select(models.Record).filter_by(user_id=user.id)).all()
-    projects = []
-    for record in records:
-        project = session.get(models.Project, record.project_id)
-        projects.append(project)
+    project_ids = session.exec(select(models.Record.project_id).filter_by(user_id=user.id)).all()
+    # 一条语句查出所有项目，按记录的顺序返回
+    projects = {project.id: project for project in
+                session.exec(select(models.Project).where(models.Project.id.in_(project_ids),
+                                                          models.Project.status != PROJECT_DELETED)).all()}
+    projects = [projects[project_id] for project_id in project_ids if project_id in projects]
     # return projects[(page-1)*page_size:page*page_size]
     return projects
 
 
+def claim_code(project_id: int, user_id: int) -> str:
+    # 兑奖码由用户id和签名组成，只在这个项目中有效，不能伪造
+    signature = hmac.new(SECRET_KEY.encode(), f"{project_id}:{user_id}".encode(), hashlib.sha256).hexdigest()
+    return f"{user_id}-{signature[:8]}"
+
+
+def _user_id_from_claim_code(project_id: int, code: str) -> int | None:
+    user_id, _, _ = code.partition("-")
+    if not user_id.isdigit() or not hmac.compare_digest(code, claim_code(project_id, int(user_id))):
+        return None
+    return int(user_id)
+
+
+def _claim_prizes(project_id: int, user_ids: list[int], session: Session) -> dict[int, sch.PrizeClaimResult]:
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    rows = session.exec(select(models.Record.user_id, models.User.username, models.Record.raffle_result)
+                        .join(models.User, models.User.id == models.Record.user_id)
+                        .where(models.Record.project_id == project_id, models.Record.user_id.in_(user_ids),
+                               models.Record.raffle_result.is_not(None))).all()
+    # 一条UPDATE完成兑奖，RETURNING返回的才是这次兑奖的，其余的是已经兑过的，多个兑奖台同时操作也不会重复计数
+    claimed = set(session.exec(update(models.Record)
+                               .where(models.Record.project_id == project_id,
+                                      models.Record.user_id.in_([row.user_id for row in rows]),
+                                      models.Record.raffle_result.is_not(None),
+                                      models.Record.prize_claim_status == False)
+                               .values(prize_claim_status=True)
+                               .returning(models.Record.user_id)).scalars())
+    if claimed:
+        stats.record_claim(session, project_id, len(claimed))
+    session.commit()
+    if claimed:
+        rollup.add_event(project_id, "claim_num", count=len(claimed))
+    return {row.user_id: sch.PrizeClaimResult(user_id=row.user_id,
+                                              username=row.username,
+                                              raffle_result=eval(row.raffle_result),
+                                              status="claimed" if row.user_id in claimed else "already_claimed")
+            for row in rows}
+
+
 def claim_prize(project_id: int = Path(description="兑奖项目的id"), 
                 user_id: int = Path(description="兑奖用户的id"), 
                 user = Depends(verify_token),
                 session: Session=Depends(get_session)):
     check_permission(user)
-    record = session.exec(select(models.Record).filter_by(user_id=user_id, project_id=project_id)).first()
-    if not record or not record.raffle_result:
+    results = _claim_prizes(project_id, [user_id], session)
+    if user_id not in results:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Record not found.")
-    record.prize_claim_status = True
-    session.add(record)
+    return results[user_id]
+
+
+def claim_prizes(project_id: int, prize_claim: sch.PrizeClaim,
+                user = Depends(verify_token),
+                session: Session=Depends(get_session)):
+    check_permission(user)
+    code_user_ids = {code: _user_id_from_claim_code(project_id, code) for code in prize_claim.codes}
+    user_ids = prize_claim.user_ids + [user_id for user_id in code_user_ids.values() if user_id is not None]
+    results = _claim_prizes(project_id, list(dict.fromkeys(user_ids)), session)
+    outcomes = []
+    for user_id in prize_claim.user_ids:
+        outcomes.append(results.get(user_id) or sch.PrizeClaimResult(user_id=user_id, status="not_found"))
+    for code, user_id in code_user_ids.items():
+        if user_id is None:
+            outcomes.append(sch.PrizeClaimResult(code=code, status="invalid_code"))
+        elif user_id in results:
+            outcomes.append(results[user_id].model_copy(update={"code": code}))
+        else:
+            outcomes.append(sch.PrizeClaimResult(user_id=user_id, code=code, status="not_found"))
+    return outcomes
+
+
+def read_project_stats(project_id: int,
+                    user = Depends(verify_token),
+                    session: Session=Depends(get_session)):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    return stats.read_stats(session, project_id)
+
+
+def recompute_project_stats(project_id: int,
+                            user = Depends(verify_token),
+                            session: Session=Depends(get_session)):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    job = _enqueue_recompute_stats(session, project_id, user)
     session.commit()
-    session.refresh(record)
-    project = read_project_details(project_id=project_id, user=user, session=session)
-    return project
\ No newline at end of file
+    session.refresh(job)
+    jobs.wake()
+    return job
+
+
+def read_project_rollup(project_id: int,
+                        resolution: str = Query(default="1m", pattern="^(1m|5m|1h)$",
+                                                description="时间粒度：1m、5m或1h"),
+                        start: datetime.datetime | None = Query(default=None, description="起始时间，默认为一天前"),
+                        end: datetime.datetime | None = Query(default=None, description="结束时间，默认为现在"),
+                        user = Depends(verify_token),
+                        session: Session=Depends(get_session)):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    end = end or datetime.datetime.now()
+    start = start or end - datetime.timedelta(days=1)
+    return rollup.read_rollup(session, project_id, resolution, start, end)
+
+
+def _import_questions(project_id: int, questions: list[sch.QuestionImport], replace: bool,
+                    user, session: Session):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    # 删除旧题目和插入新题目在同一个事务里，替换是原子的
+    if replace:
+        session.exec(delete(models.Question).where(models.Question.project_id == project_id))
+    if questions:
+        session.exec(insert(models.Question),
+                    params=[{**question.model_dump(), "project_id": project_id} for question in questions])
+    etag.bump(session, project_id)
+    regrade = _enqueue_regrade(session, project_id, user)
+    session.commit()
+    if regrade:
+        jobs.wake()
+    return session.exec(select(models.Question).filter_by(project_id=project_id)
+                        .order_by(models.Question.id)).all()
+
+
+def import_questions(project_id: int, questions: list[sch.QuestionImport],
+                    replace: bool = Query(default=False, description="为true时替换项目原有的全部题目"),
+                    user = Depends(verify_token),
+                    session: Session=Depends(get_session)):
+    return _import_questions(project_id, questions, replace, user, session)
+
+
+def import_questions_csv(project_id: int, 
+                        file: UploadFile = File(description="表头为q,o1,o2,o3,o4,a的CSV文件，UTF-8编码"),
+                        replace: bool = Query(default=False, description="为true时替换项目原有的全部题目"),
+                        user = Depends(verify_token),
+                        session: Session=Depends(get_session)):
+    check_permission(user)
+    try:
+        reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8-sig"))
+        rows = list(reader)
+    except (UnicodeDecodeError, csv.Error):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
+                            detail="Invalid CSV file.")
+    questions = []
+    errors = []
+    for line, row in enumerate(rows, start=2):
+        try:
+            questions.append(sch.QuestionImport.model_validate(row))
+        except ValidationError as e:
+            errors.append({"line": line, "errors": e.errors(include_url=False, include_context=False)})
+    if errors:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
+                            detail=errors)
+    return _import_questions(project_id, questions, replace, user, session)
+
+
+def clone_project(project_id: int, project_update: sch.ProjectUpdate | None = None,
+                user = Depends(verify_token),
+                session: Session=Depends(get_session)):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    clone = models.Project(name=project.name,
+                        description=project.description,
+                        create_time=datetime.datetime.now(),
+                        deadline=project.deadline,
+                        creater_id=user.id)
+    if project_update:
+        clone.sqlmodel_update(project_update.model_dump(exclude_unset=True))
+    session.add(clone)
+    session.flush()
+    # 题目和奖品用 INSERT ... SELECT 在数据库内复制，语句数与题目数量无关
+    Question, Prize = models.Question, models.Prize
+    session.exec(insert(Question).from_select(
+        ["q", "o1", "o2", "o3", "o4", "a", "project_id"],
+        select(Question.q, Question.o1, Question.o2, Question.o3, Question.o4, Question.a, literal(clone.id))
+        .where(Question.project_id == project_id).order_by(Question.id)))
+    if shard_of(project_id) == MAIN:
+        session.exec(insert(Prize).from_select(
+            ["name", "image", "level", "amount", "remain", "project_id"],
+            select(Prize.name, Prize.image, Prize.level, Prize.amount, Prize.amount, literal(clone.id))
+            .where(Prize.project_id == project_id).order_by(Prize.id)))
+    else:
+        # 原项目的奖品在分区数据库中，INSERT ... SELECT 不能跨数据库写入，读出来再插入
+        prizes = session.exec(select(Prize.name, Prize.image, Prize.level, Prize.amount)
+                              .where(Prize.project_id == project_id).order_by(Prize.id)).all()
+        if prizes:
+            session.exec(insert(Prize), params=[{**prize._asdict(), "remain": prize.amount, "project_id": clone.id}
+                                                for prize in prizes])
+    session.commit()
+    session.refresh(clone)
+    return clone
+
+
+def check_inventory_access(project_id: int,
+                        header_token: str | None = Depends(optional_oauth2_scheme),
+                        token: str | None = Query(default=None, description="无法设置请求头时（如浏览器的EventSource），用这个参数传access token")):
+    # 不用 get_session：依赖项的会话要到响应结束才关闭，推送连接会一直占着数据库连接
+    with open_session() as session:
+        verify_token(header_token or token or "", session)
+        project = session.get(models.Project, project_id)
+        if not project or project.status == PROJECT_DELETED:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                                detail="Project not found.")
+        if project.status == 0:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
+                                detail="Project not published.")
+
+
+def reconcile_inventory(project_id: int,
+                        repair: bool = Query(default=False, description="是否修复对不上的剩余数量"),
+                        user = Depends(verify_token),
+                        session: Session=Depends(get_session)):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    job = jobs.enqueue(session, "reconcile_inventory", {"project_id": project_id, "repair": repair},
+                       dedup_key=f"reconcile_inventory:{project_id}:{repair}", creater_id=user.id)
+    session.commit()
+    session.refresh(job)
+    jobs.wake()
+    return job
+
+
+def read_hot_mode(project_id: int,
+                user = Depends(verify_token),
+                session: Session=Depends(get_session)):
+    check_permission(user)
+    hot_project = hot.get(project_id)
+    if hot_project is not None:
+        return hot_project.info()
+    state = session.get(models.HotProject, project_id)
+    if not state:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project is not in hot mode.")
+    return sch.HotProjectResponse(project_id=project_id, owner=state.owner, applied_seq=state.applied_seq)
+
+
+def enable_hot_mode(project_id: int,
+                user = Depends(verify_token),
+                session: Session=Depends(get_session)):
+    check_permission(user)
+    project = session.get(models.Project, project_id)
+    if not project or project.status == PROJECT_DELETED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project not found.")
+    if project.status == 0:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
+                            detail="Project not published.")
+    if project.deadline <= datetime.datetime.now():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, 
+                            detail="Project has ended.")
+    return hot.activate(project_id).info()
+
+
+def disable_hot_mode(project_id: int,
+                user = Depends(verify_token),
+                session: Session=Depends(get_session)):
+    check_permission(user)
+    if hot.get(project_id) is None:
+        if session.get(models.HotProject, project_id):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, 
+                                detail="Project is in hot mode in another process.")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Project is not in hot mode.")
+    hot.deactivate(project_id)
+
+
+def read_job(job_id: int,
+            user = Depends(verify_token),
+            session: Session=Depends(get_session)):
+    check_permission(user)
+    job = session.get(models.Job, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Job not found.")
+    return job
+
+
+def read_jobs(job_status: str | None = Query(default=None, alias="status",
+                                             pattern="^(pending|running|succeeded|failed)$",
+                                             description="按状态筛选"),
+            kind: str | None = Query(default=None, description="按任务类型筛选"),
+            limit: int = Query(default=50, ge=1, le=500),
+            user = Depends(verify_token),
+            session: Session=Depends(get_session)):
+    check_permission(user)
+    query = select(models.Job)
+    if job_status is not None:
+        query = query.where(models.Job.status == job_status)
+    if kind is not None:
+        query = query.where(models.Job.kind == kind)
+    return session.exec(query.order_by(models.Job.id.desc()).limit(limit)).all()
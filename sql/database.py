@@ -1,23 +1,182 @@
-from sqlmodel import create_engine, SQLModel, Session
+from sqlmodel import create_engine, SQLModel, Session, select, delete
+from sqlalchemy import literal_column, event, Engine, Table
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.sql.visitors import iterate
 from typing import Annotated
 from fastapi import Depends
+import os
+import time
 
+import sql.models as models
 
-sqlite_file_name = "qa_raffle.db"
+
+sqlite_file_name = os.getenv("QA_RAFFLE_DB", "qa_raffle.db")
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
 connect_args = {"check_same_thread": False}
 engine = create_engine(sqlite_url, connect_args=connect_args)
 
+# 新建引擎时的回调，由 instrument 模块注册，分区数据库的引擎也要统计语句和提交
+engine_created = []
+
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
-    
+
+
+# 分区：选定项目的记录和奖品放在单独的数据库文件中，这些项目抽奖时只锁自己的文件，不和其他项目争同一个写锁。
+# 分区数据库以 shared 的名字附加主数据库，语句中用到的用户、项目等表仍从主数据库读取。
+# 其他表和没有分区的项目都在主数据库（MAIN）中，没有分区时 open_session 返回普通的 Session
+MAIN = "main"
+ID_SHIFT = 32      # 分区中新的记录和奖品的id从 project_id << ID_SHIFT 开始
+PARTITIONED_TABLES = (models.Record.__table__, models.Prize.__table__)
+
+partitions: dict[int, Engine] = {}
+
+
+def partition_engine(file: str) -> Engine:
+    partition = create_engine(f"sqlite:///{file}", connect_args=connect_args)
+
+    @event.listens_for(partition, "connect")
+    def _attach_main(dbapi_connection, connection_record):
+        dbapi_connection.execute("ATTACH DATABASE ? AS shared", (os.path.abspath(sqlite_file_name),))
+
+    for callback in engine_created:
+        callback(partition)
+    return partition
+
+
+def shard_of(project_id: int | None):
+    return project_id if project_id in partitions else MAIN
+
+
+def engine_of(project_id: int | None) -> Engine:
+    return partitions.get(project_id, engine)
+
+
+def shards(table=None) -> list:
+    if table is not None and table not in PARTITIONED_TABLES:
+        return [MAIN]
+    return [MAIN, *partitions]
+
+
+def _bound_values(clause, table, key: str) -> set | None:
+    # 从 WHERE 中用 AND 连接的 key = x / key IN (...) 条件里找出取值，找不到时返回None
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        for child in clause.clauses:
+            values = _bound_values(child, table, key)
+            if values is not None:
+                return values
+        return None
+    if not isinstance(clause, BinaryExpression) or clause.operator not in (operators.eq, operators.in_op):
+        return None
+    for column, value in ((clause.left, clause.right), (clause.right, clause.left)):
+        if getattr(column, "table", None) is table and column.key == key and isinstance(value, BindParameter):
+            value = value.effective_value
+            if value is not None:
+                return set(value) if clause.operator is operators.in_op else {value}
+    return None
+
+
+def _choose_shards(orm_context) -> list:
+    statement = orm_context.statement
+    # ORM 语句中的表是加了注解的副本，按名字比较
+    names = {element.name for element in iterate(statement) if isinstance(element, Table)}
+    tables = [table for table in PARTITIONED_TABLES if table.name in names]
+    if not tables:
+        return [MAIN]
+    # 从项目懒加载奖品和参与记录时，直接去项目所在的数据库
+    parent = orm_context.lazy_loaded_from if orm_context.is_select else None
+    if parent is not None and isinstance(parent.obj(), models.Project):
+        return [shard_of(parent.obj().id)]
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is not None:
+        for table in tables:
+            project_ids = _bound_values(whereclause, table, "project_id")
+            if project_ids is not None:
+                return sorted({shard_of(project_id) for project_id in project_ids}, key=str)
+        for table in tables:
+            # 按id查询（如 session.get、refresh）：分区中新插入的行从id就能知道所在的项目。
+            # 迁移前就有的行id较小，仍要到每个数据库中查找（id不重复，只会找到一行）
+            ids = _bound_values(whereclause, table, "id")
+            if ids and all(id >> ID_SHIFT in partitions for id in ids):
+                return sorted({id >> ID_SHIFT for id in ids})
+    if orm_context.is_insert:
+        return [MAIN]
+    # 跨项目的查询（如某个用户的所有记录）在每个数据库中执行，结果合并
+    return shards()
+
+
+def _route(orm_context):
+    if "shard_id" in orm_context.bind_arguments:
+        return None
+    chosen = _choose_shards(orm_context)
+    if chosen == [MAIN]:
+        return None
+    results = [orm_context.invoke_statement(bind_arguments={**orm_context.bind_arguments, "shard_id": shard_id})
+               for shard_id in chosen]
+    return results[0] if len(results) == 1 else results[0].merge(*results[1:])
+
+
+class RoutedSession(Session):
+    def __init__(self, **kwargs):
+        super().__init__(engine, **kwargs)
+        event.listen(self, "do_orm_execute", _route)
+
+    def get_bind(self, mapper=None, *, shard_id=None, **kwargs):
+        if shard_id is not None and shard_id != MAIN:
+            return partitions[shard_id]
+        return super().get_bind(mapper, **kwargs)
+
+    def flush(self, objects=None):
+        # flush 时每个对象用它所在数据库的连接，同一个会话中的多个数据库依次提交。
+        # 只在 flush 期间设置 connection_callable，设置了它的会话不能执行 ORM 的批量 INSERT
+        self.connection_callable = self._connection_for_instance
+        try:
+            super().flush(objects)
+        finally:
+            del self.connection_callable
+
+    def _connection_for_instance(self, mapper=None, instance=None):
+        shard_id = MAIN
+        if instance is not None and mapper.local_table in PARTITIONED_TABLES:
+            shard_id = shard_of(instance.project_id)
+        return self.get_transaction().connection(mapper, shard_id=shard_id)
+
+
+def open_session() -> Session:
+    return RoutedSession() if partitions else Session(engine)
+
 
 def get_session():
-    with Session(engine) as session:
-        yield session   
+    with open_session() as session:
+        yield session
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
 
+
+ROWID = literal_column("rowid")
+
+
+def delete_in_batches(model, condition, batch_size: int, pause: float) -> int:
+    # 按rowid顺序分批删除，每批一个短事务，批之间暂停让出写锁；
+    # 下一批从上一批最后的rowid之后找起，不必每次从头扫描。rowid 只在同一个数据库中有意义，每个分区分别删除
+    table = model.__table__
+    deleted = 0
+    for shard_id in shards(table):
+        last = 0
+        while True:
+            with open_session() as session:
+                rowids = session.exec(select(ROWID).select_from(table).where(condition, ROWID > last)
+                                      .order_by(ROWID).limit(batch_size),
+                                      bind_arguments={"shard_id": shard_id}).all()
+                if not rowids:
+                    break
+                session.exec(delete(table).where(ROWID.in_(rowids)), bind_arguments={"shard_id": shard_id})
+                session.commit()
+            deleted += len(rowids)
+            last = rowids[-1]
+            time.sleep(pause)
+    return deleted
@@ -0,0 +1,88 @@
+import datetime
+import hashlib
+from fastapi import HTTPException, status
+from sqlmodel import Session, select, func
+from sqlalchemy.dialects.sqlite import insert
+
+import sql.models as models
+import sql.stats as stats
+
+
+# 项目详情的 ETag 不读题目和奖品，由几个很小的值算出：
+# - ProjectVersion：管理员修改项目信息、题目、奖品（包括库存修复）时加一
+# - ProjectStats 中的计数器：答题、抽奖、兑奖时和记录在同一个事务里增加，参与者列表和奖品剩余数量随之变化
+# - 按截止时间算出的实际状态
+# - UserVersion：项目详情中有用户名，任何用户改名或注销时加一。改名很少，所有项目的 ETag 一起失效
+# 访问次数 browse_times 不参与计算，所以是弱 ETag
+
+
+def bump(session: Session, project_id: int):
+    # 不提交，和调用方的修改在同一个事务里提交
+    stmt = insert(models.ProjectVersion).values(project_id=project_id, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=["project_id"],
+                                      set_={"version": models.ProjectVersion.version + 1})
+    session.exec(stmt)
+
+
+def bump_users(session: Session):
+    # 不提交，和用户的修改在同一个事务里提交
+    stmt = insert(models.UserVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=["id"], set_={"version": models.UserVersion.version + 1})
+    session.exec(stmt)
+
+
+def _counter(kind: str):
+    return (select(models.ProjectStats.value)
+            .where(models.ProjectStats.project_id == models.Project.id,
+                   models.ProjectStats.kind == kind, models.ProjectStats.key == 0)
+            .scalar_subquery())
+
+
+def read_version(session: Session, project_id: int, kinds: tuple[str, ...]):
+    # 一条按主键的查询，返回 (状态, 版本, 用户版本, 各计数器的值...)，项目不存在时返回None
+    Project = models.Project
+    version = select(models.ProjectVersion.version).where(models.ProjectVersion.project_id == Project.id)
+    user_version = select(models.UserVersion.version).where(models.UserVersion.id == 1)
+    row = session.exec(select(Project.status, Project.deadline,
+                              func.coalesce(version.scalar_subquery(), 0),
+                              func.coalesce(user_version.scalar_subquery(), 0),
+                              *[func.coalesce(_counter(kind), 0) for kind in kinds])
+                       .where(Project.id == project_id)).first()
+    if row is None:
+        return None
+    project_status, deadline, *values = row
+    # 数据库中的 status 要等有人读取项目时才更新，这里按截止时间算出实际状态
+    now = datetime.datetime.now()
+    if project_status == 1 and deadline <= now:
+        project_status = 2
+    elif project_status == 2 and deadline > now:
+        project_status = 1
+    return (project_status, *values)
+
+
+MANAGER_KINDS = (stats.ANSWER, stats.RAFFLE, stats.CLAIM)
+USER_KINDS = (stats.RAFFLE,)        # 其他用户只影响奖品剩余数量，自己的记录单独读取
+
+
+def record_state(record: models.Record | None) -> tuple:
+    if record is None:
+        return ()
+    return (record.answer_time, record.raffle_time, record.raffle_result)
+
+
+def make(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match 中可以有多个 ETag，比较时忽略弱标记 W/
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def not_modified(etag: str):
+    # 客户端缓存的版本还是最新的，返回没有 body 的 304，不查询和序列化项目详情
+    raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
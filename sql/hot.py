@@ -0,0 +1,374 @@
+import datetime
+import fcntl
+import json
+import logging
+import os
+import random
+import socket
+import threading
+from collections import Counter
+from fastapi import HTTPException, status
+from sqlalchemy import bindparam
+from sqlmodel import Session, select, insert, update, delete
+
+import schemas as sch
+import sql.models as models
+import sql.stats as stats
+import sql.archive as archive
+import sql.rollup as rollup
+import live
+from sql.database import open_session, engine_of
+
+
+# 热模式：活动刚开始时抽奖集中的项目，奖品库存和每个用户的抽奖结果放在一个进程（所有者）的内存里。
+# 每次抽奖追加到本地的预写日志，多个抽奖合并成一次 fsync，写入磁盘后就返回；
+# 后台线程再把日志批量写进数据库，写到的位置（applied_seq）和数据在同一个事务里提交。
+# 进程重启时从数据库读出已写入的状态，再重放日志中 applied_seq 之后的抽奖
+JOURNAL_DIR = os.getenv("QA_RAFFLE_JOURNAL_DIR", "journal")
+JOURNAL_FSYNC = os.getenv("QA_RAFFLE_JOURNAL_FSYNC", "1") != "0"
+APPLY_INTERVAL = 0.2    # 秒
+
+
+logger = logging.getLogger(__name__)
+
+_projects: dict[int, "HotProject"] = {}
+_registry_lock = threading.Lock()
+
+
+def journal_path(project_id: int) -> str:
+    return os.path.join(JOURNAL_DIR, f"project_{project_id}.wal")
+
+
+class Journal:
+    def __init__(self, path: str, seq: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "ab")
+        try:
+            # 同一个项目只能有一个所有者进程
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise
+        self.cond = threading.Condition()
+        self.pending: list[bytes] = []
+        self.appended_seq = seq
+        self.durable_seq = seq
+        self.error: Exception | None = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"journal-{path}", daemon=True)
+        self.thread.start()
+
+    def append(self, seq: int, entry: dict):
+        with self.cond:
+            self.pending.append(json.dumps(entry, separators=(",", ":")).encode() + b"\n")
+            self.appended_seq = seq
+            self.cond.notify_all()
+
+    def wait(self, seq: int):
+        with self.cond:
+            while self.durable_seq < seq and self.error is None:
+                self.cond.wait()
+            if self.durable_seq < seq:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Failed to write the raffle journal.")
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                # 等待期间到达的所有抽奖一起写入、一起 fsync
+                batch, self.pending = self.pending, []
+                seq = self.appended_seq
+            try:
+                self.file.write(b"".join(batch))
+                self.file.flush()
+                if JOURNAL_FSYNC:
+                    os.fsync(self.file.fileno())
+            except Exception as e:
+                logger.exception("Failed to write journal %s.", self.file.name)
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.durable_seq = seq
+                self.cond.notify_all()
+
+    def truncate(self, applied_seq: int):
+        # 日志中的抽奖全部写进数据库之后清空，没写完的不动
+        with self.cond:
+            if self.appended_seq == applied_seq and self.durable_seq == applied_seq:
+                self.file.truncate(0)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self.file.close()
+
+
+def read_journal(path: str, after: int) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 崩溃时写了一半的最后一行，这个抽奖还没有返回给用户
+                break
+            if entry["seq"] > after:
+                entries.append(entry)
+    return entries
+
+
+RECORD_FIELDS = [column.name for column in models.Record.__table__.columns]
+
+
+def _copy_record(record: models.Record) -> models.Record:
+    # 与数据库会话无关的副本
+    return models.Record(**{field: getattr(record, field) for field in RECORD_FIELDS})
+
+
+class HotProject:
+    def __init__(self, project_id: int):
+        self.project_id = project_id
+        self.lock = threading.Lock()
+        self.users: dict[int, models.Record] = {}
+        self.unapplied: list[dict] = []
+        self.closed = False
+        path = journal_path(project_id)
+        # 先拿到日志文件的锁，拿不到说明其他进程是所有者
+        self.journal = Journal(path, 0)
+        try:
+            self._load(path)
+        except Exception:
+            self.journal.close()
+            raise
+        self.seq = self.unapplied[-1]["seq"] if self.unapplied else self.applied_seq
+        self.journal.appended_seq = self.journal.durable_seq = self.seq
+        if self.unapplied:
+            logger.info("Recovered %d journaled draws of project %d.", len(self.unapplied), project_id)
+        self.stopping = threading.Event()
+        self.applier = threading.Thread(target=self._apply_periodically, name=f"hot-{project_id}", daemon=True)
+        self.applier.start()
+
+    def _load(self, path: str):
+        with open_session() as session:
+            project = session.get(models.Project, self.project_id)
+            self.deadline = project.deadline
+            self.base = sch.ProjectWithQuestionsAndPrizesForUser.model_validate(project)
+            self.correct_answer = [question.a for question in project.question]
+            self.level = {prize.id: prize.level for prize in project.prize}
+            self.remain = {prize.id: prize.remain for prize in project.prize}
+            state = session.get(models.HotProject, self.project_id)
+            if state is None:
+                state = models.HotProject(project_id=self.project_id)
+            state.owner = f"{socket.gethostname()}:{os.getpid()}"
+            state.activate_time = datetime.datetime.now()
+            session.add(state)
+            session.commit()
+            self.applied_seq = state.applied_seq
+            # 恢复：数据库中是 applied_seq 为止的状态，日志中之后的抽奖在内存中重放，之后再写进数据库
+            for entry in read_journal(path, self.applied_seq):
+                self.remain[entry["prize_id"]] -= 1
+                record = self.users.get(entry["user_id"]) or self._load_record(session, entry["user_id"])
+                if record is None:
+                    record = models.Record(user_id=entry["user_id"], project_id=self.project_id)
+                record.raffle_result = str(entry["result"])
+                record.raffle_time = datetime.datetime.fromisoformat(entry["time"])
+                self.users[entry["user_id"]] = record
+                self.unapplied.append(entry)
+
+    def refresh(self, project: models.Project):
+        # 管理员修改了项目信息，例如延长截止时间
+        with self.lock:
+            self.deadline = project.deadline
+            self.base = self.base.model_copy(update={field: getattr(project, field)
+                                                     for field in ("name", "description", "deadline", "status")})
+
+    def _load_record(self, session: Session, user_id: int) -> models.Record | None:
+        # 只在归档文件中的记录先放回热表，写回数据库时按 user_id 更新
+        record = archive.restore_record(session, self.project_id, user_id)
+        return _copy_record(record) if record else None
+
+    def record(self, session: Session, user_id: int) -> models.Record | None:
+        record = self.users.get(user_id)
+        if record is None:
+            # 还没有记录的用户不缓存，之后可能会答题创建记录
+            record = self._load_record(session, user_id)
+            if record is not None:
+                with self.lock:
+                    record = self.users.setdefault(user_id, record)
+        return record
+
+    def prizes(self, prizes: list[sch.PrizePublic]) -> list[sch.PrizePublic]:
+        return [prize.model_copy(update={"remain": self.remain.get(prize.id, prize.remain)}) for prize in prizes]
+
+    def view(self) -> sch.ProjectWithQuestionsAndPrizesForUser:
+        project_data = self.base.model_copy(update={"prize": self.prizes(self.base.prize)})
+        if datetime.datetime.now() >= self.deadline:
+            project_data.status = 2
+        return project_data
+
+    def draw(self, session: Session, user_id: int) -> models.Record | None:
+        # 与 crud._raffle_prize 相同的规则，只是不访问数据库（第一次抽奖的用户除外）
+        if datetime.datetime.now() >= self.deadline:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="Project has ended.")
+        record = self.record(session, user_id)
+        with self.lock:
+            if self.closed:
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Project is leaving hot mode, please retry.")
+            record = self.users.get(user_id, record)
+            already = eval(record.raffle_result) if record and record.raffle_result else []
+            if record and record.raffle_result and record.raffle_times <= len(already):
+                return record
+            pool = {prize_id: remain for prize_id, remain in self.remain.items()
+                    if remain > 0 and (prize_id not in already or self.level[prize_id] == 0)}
+            if not pool:
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                    detail="No prize left.")
+            prize_id = random.choices(list(pool.keys()), weights=list(pool.values()), k=1)[0]
+            now = datetime.datetime.now()
+            new_record = record is None
+            record = _copy_record(record) if record else models.Record(user_id=user_id, project_id=self.project_id)
+            record.raffle_result = str(already + [prize_id])
+            record.raffle_time = now
+            self.users[user_id] = record
+            self.remain[prize_id] -= 1
+            self.seq += 1
+            seq = self.seq
+            entry = {"seq": seq, "user_id": user_id, "prize_id": prize_id, "result": already + [prize_id],
+                     "time": now.isoformat(), "new_record": new_record, "first_raffle": not already}
+            self.unapplied.append(entry)
+            self.journal.append(seq, entry)
+        self.journal.wait(seq)
+        return record
+
+    def apply(self) -> int:
+        with self.lock:
+            durable = self.journal.durable_seq
+            batch = [entry for entry in self.unapplied if entry["seq"] <= durable]
+        if not batch:
+            return 0
+        latest = {}
+        new_users = set()
+        for entry in batch:
+            latest[entry["user_id"]] = entry
+            if entry["new_record"]:
+                new_users.add(entry["user_id"])
+        records = [{"user_id": user_id, "raffle_result": str(entry["result"]),
+                    "raffle_time": datetime.datetime.fromisoformat(entry["time"])}
+                   for user_id, entry in latest.items()]
+        table = models.Record.__table__
+        with Session(engine_of(self.project_id)) as session:
+            if new_users:
+                # 第一次抽奖后、写回之前，同一用户可能已经答题创建了记录，这时更新那条记录，不再插入
+                new_users -= set(session.exec(select(table.c.user_id).where(table.c.project_id == self.project_id,
+                                                                           table.c.user_id.in_(new_users))).all())
+            # 整批一个事务，每种修改一条 executemany 语句。分区项目的事务在分区数据库的连接上，
+            # 主数据库中的表通过附加的 shared 写入，applied_seq 和数据仍然一起提交
+            new_records = [record for record in records if record["user_id"] in new_users]
+            if new_records:
+                session.exec(insert(table).values(project_id=self.project_id), params=new_records)
+            old_records = [{"b_" + key: value for key, value in record.items()}
+                           for record in records if record["user_id"] not in new_users]
+            if old_records:
+                session.exec(update(table)
+                             .where(table.c.user_id == bindparam("b_user_id"), table.c.project_id == self.project_id)
+                             .values(raffle_result=bindparam("b_raffle_result"), raffle_time=bindparam("b_raffle_time")),
+                             params=old_records)
+            for prize_id, count in Counter(entry["prize_id"] for entry in batch).items():
+                session.exec(update(models.Prize)
+                             .where(models.Prize.id == prize_id, models.Prize.project_id == self.project_id)
+                             .values(remain=models.Prize.remain - count))
+            stats.record_raffles(session, self.project_id, [(entry["prize_id"], entry["first_raffle"]) for entry in batch])
+            session.exec(update(models.HotProject).where(models.HotProject.project_id == self.project_id)
+                         .values(applied_seq=batch[-1]["seq"]))
+            session.commit()
+        with self.lock:
+            del self.unapplied[:len(batch)]
+            self.applied_seq = batch[-1]["seq"]
+        self.journal.truncate(self.applied_seq)
+        for minute, count in Counter(entry["time"][:16] for entry in batch).items():
+            rollup.add_event(self.project_id, "raffle_num", datetime.datetime.fromisoformat(minute), count)
+        live.hub.notify(self.project_id)
+        return len(batch)
+
+    def _apply_periodically(self):
+        while not self.stopping.wait(APPLY_INTERVAL):
+            try:
+                self.apply()
+            except Exception:
+                logger.exception("Failed to apply journaled draws of project %d.", self.project_id)
+
+    def close(self):
+        # 停止接受抽奖，把已经返回给用户的抽奖全部写进数据库
+        with self.lock:
+            self.closed = True
+        self.stopping.set()
+        self.applier.join()
+        self.journal.wait(self.seq)
+        while self.apply():
+            pass
+        self.journal.close()
+
+    def info(self) -> sch.HotProjectResponse:
+        return sch.HotProjectResponse(project_id=self.project_id, owner=f"{socket.gethostname()}:{os.getpid()}",
+                                      seq=self.seq, durable_seq=self.journal.durable_seq,
+                                      applied_seq=self.applied_seq, user_num=len(self.users))
+
+
+def get(project_id: int) -> HotProject | None:
+    return _projects.get(project_id)
+
+
+def activate(project_id: int) -> HotProject:
+    with _registry_lock:
+        hot_project = _projects.get(project_id)
+        if hot_project is None:
+            try:
+                hot_project = _projects[project_id] = HotProject(project_id)
+            except BlockingIOError:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="Project is in hot mode in another process.")
+        return hot_project
+
+
+def deactivate(project_id: int):
+    with _registry_lock:
+        hot_project = _projects.pop(project_id, None)
+    if hot_project is not None:
+        hot_project.close()
+    with open_session() as session:
+        session.exec(delete(models.HotProject).where(models.HotProject.project_id == project_id))
+        session.commit()
+
+
+def recover():
+    # 启动时接管上次没有退出热模式的项目，其他进程已经接管的跳过
+    with open_session() as session:
+        project_ids = session.exec(select(models.HotProject.project_id)).all()
+    for project_id in project_ids:
+        try:
+            activate(project_id)
+        except HTTPException:
+            pass
+        except Exception:
+            logger.exception("Failed to recover hot project %d.", project_id)
+
+
+def close():
+    # 退出进程时写完日志，但保留热模式，下次启动时 recover 重新接管
+    with _registry_lock:
+        hot_projects = list(_projects.values())
+        _projects.clear()
+    for hot_project in hot_projects:
+        hot_project.close()
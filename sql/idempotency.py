@@ -0,0 +1,137 @@
+import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Annotated
+from fastapi import Header, HTTPException, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, update, delete
+
+import sql.models as models
+from sql.database import delete_in_batches
+
+
+# 客户端超时重试时带上同一个 Idempotency-Key，只执行一次，重复的请求直接返回第一次的响应。
+# 响应保存在 IdempotencyKey 表中（多个进程共享），最近用过的同时缓存在内存里
+KEY_TTL = datetime.timedelta(hours=24)
+# 处理中的请求（还没有保存响应）的占用期限。进程崩溃或保存响应失败时占用不会被释放，
+# 超过期限后同一个 key 的重试接手，不必等到 KEY_TTL 过期。原请求可能已经提交了抽奖或答题，只是没有保存响应，
+# 所以接手时不再执行 handler（会重复抽奖），而是用 reconcile 读出当前的状态作为响应
+LEASE = datetime.timedelta(seconds=60)
+CACHE_SIZE = 10000
+MAX_KEY_LENGTH = 64
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+IdempotencyKeyHeader = Annotated[str | None, Header(alias="Idempotency-Key", max_length=MAX_KEY_LENGTH,
+                                                    description="客户端生成的唯一键（如UUID），重试时使用同一个")]
+
+_lock = threading.Lock()
+_cache: OrderedDict[tuple[int, str], tuple[datetime.datetime, str, str]] = OrderedDict()
+
+
+def _cache_get(user_id: int, key: str) -> tuple[str, str] | None:
+    with _lock:
+        entry = _cache.get((user_id, key))
+        if entry is None:
+            return None
+        if entry[0] <= datetime.datetime.now() - KEY_TTL:
+            del _cache[(user_id, key)]
+            return None
+        _cache.move_to_end((user_id, key))
+        return entry[1:]
+
+
+def _cache_put(user_id: int, key: str, create_time: datetime.datetime, request: str, response: str):
+    with _lock:
+        _cache[(user_id, key)] = (create_time, request, response)
+        _cache.move_to_end((user_id, key))
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _replay(request: str, stored_request: str, response: str | None) -> JSONResponse:
+    if stored_request != request:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key reused for a different request.")
+    if response is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="A request with this Idempotency-Key is in progress.")
+    return JSONResponse(content=json.loads(response), headers={REPLAYED_HEADER: "true"})
+
+
+def run(session: Session, user_id: int, key: str | None, request: str, response_model, handler, reconcile):
+    # 执行 handler 并保存响应；同一个用户用同一个 key 再次请求时返回保存的响应，不再执行 handler。
+    # reconcile 不做任何修改，只读出 handler 执行后的状态，用于接手占用过期的请求
+    if key is None:
+        return handler()
+    # 只保存请求内容的摘要，用来发现同一个 key 被用在了不同的请求上
+    request = hashlib.sha256(request.encode()).hexdigest()[:32]
+    cached = _cache_get(user_id, key)
+    if cached is not None:
+        return _replay(request, *cached)
+    IdempotencyKey = models.IdempotencyKey
+    owned = (IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.response.is_(None))
+    create_time = datetime.datetime.now()
+    record = session.get(IdempotencyKey, (user_id, key))
+    if record is not None and record.create_time > create_time - KEY_TTL:
+        if record.response is not None or record.create_time > create_time - LEASE or record.request != request:
+            return _replay(request, record.request, record.response)
+        # 占用已经过期，接手。条件更新保证同时到达的多个重试只有一个接手
+        taken = session.exec(update(IdempotencyKey)
+                             .where(*owned, IdempotencyKey.create_time == record.create_time)
+                             .values(create_time=create_time)).rowcount
+        session.commit()
+        if not taken:
+            session.refresh(record)
+            return _replay(request, record.request, record.response)
+        # reconcile 失败时保留占用，之后的重试再次接手
+        result = reconcile()
+        _save(session, user_id, key, owned, create_time, request, response_model, result)
+        return result
+    else:
+        if record is not None:
+            session.delete(record)
+        # 先占住这个 key 再执行，同时到达的重复请求插入时会主键冲突
+        session.add(IdempotencyKey(user_id=user_id, key=key, request=request, create_time=create_time))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            record = session.get(IdempotencyKey, (user_id, key))
+            return _replay(request, record.request, record.response)
+    # 下面只修改仍由这次请求占用的行（create_time 没变），超过期限被其他重试接手后不再覆盖
+    commits = []
+    track = lambda session: commits.append(True)
+    event.listen(session, "after_commit", track)
+    try:
+        result = handler()
+    except HTTPException:
+        # 其他异常（以及提交了修改之后的失败）保留占用：可能已经抽过奖，占用过期后由重试 reconcile
+        if commits:
+            raise
+        # 没有提交任何修改就被拒绝的请求不保存，允许用同一个 key 重试
+        session.rollback()
+        session.exec(delete(IdempotencyKey).where(*owned, IdempotencyKey.create_time == create_time))
+        session.commit()
+        raise
+    finally:
+        event.remove(session, "after_commit", track)
+    _save(session, user_id, key, owned, create_time, request, response_model, result)
+    return result
+
+
+def _save(session: Session, user_id: int, key: str, owned: tuple, create_time: datetime.datetime,
+          request: str, response_model, result):
+    response = response_model.model_validate(result).model_dump_json()
+    session.exec(update(models.IdempotencyKey).where(*owned, models.IdempotencyKey.create_time == create_time)
+                 .values(response=response))
+    session.commit()
+    _cache_put(user_id, key, create_time, request, response)
+
+
+def purge_expired(batch_size: int = 1000, pause: float = 0.05) -> int:
+    cutoff = datetime.datetime.now() - KEY_TTL
+    return delete_in_batches(models.IdempotencyKey, models.IdempotencyKey.create_time < cutoff, batch_size, pause)
@@ -0,0 +1,142 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+
+from sql.database import engine, engine_created
+
+
+# 单个请求执行的语句数超过这个值时记录一条警告，通常意味着有 N+1 查询
+STATEMENT_LOG_THRESHOLD = 30
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLStats:
+    __slots__ = ("statements", "duration", "statement_counts", "timeline")
+
+    def __init__(self):
+        self.statements = 0
+        self.duration = 0.0
+        self.statement_counts = Counter()
+        self.timeline = None    # 需要时设置为列表，记录每条语句的 (开始时间, 耗时, 语句)
+
+    def add(self, statement: str, duration: float):
+        self.statements += 1
+        self.duration += duration
+        self.statement_counts[statement] += 1
+        if self.timeline is not None:
+            self.timeline.append((time.perf_counter() - duration, duration, statement))
+
+    def most_repeated(self, n: int = 3) -> list[tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statement_counts.most_common(n) if count > 1]
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+# 当前请求的统计对象。中间件里设置，线程池中执行的同步依赖会继承同一个对象
+_current: ContextVar[SQLStats | None] = ContextVar("sql_stats", default=None)
+
+# 全局的回调，由 metrics 模块注册，避免 sql 包依赖上层模块
+on_commit = []
+on_lock_wait = []
+
+# count_queries() 打开的统计对象及是否只统计请求中执行的语句，用于测试和基准
+_collectors: list[tuple[SQLStats, bool]] = []
+
+
+def start_request():
+    stats = SQLStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token, label: str = ""):
+    stats = _current.get()
+    _current.reset(token)
+    if stats is not None and stats.statements > STATEMENT_LOG_THRESHOLD:
+        logger.warning("%s executed %d SQL statements (threshold %d), most repeated: %s",
+                       label, stats.statements, STATEMENT_LOG_THRESHOLD, stats.most_repeated())
+
+
+def current() -> SQLStats | None:
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.add(statement, duration)
+    for collector, requests_only in _collectors:
+        if stats is not None or not requests_only:
+            collector.add(statement, duration)
+
+
+def _handle_error(context):
+    start_times = context.connection.info.get("query_start_time") if context.connection else None
+    if start_times:
+        start_times.pop()
+    if "database is locked" in str(context.original_exception):
+        for callback in on_lock_wait:
+            callback()
+
+
+@contextmanager
+def count_queries(requests_only: bool = False):
+    """统计代码块内执行的所有 SQL 语句（包括 TestClient 在其他线程中处理的请求）。
+
+    requests_only 为 True 时只统计 HTTP 请求中执行的语句，不包括任务队列、汇总写入等后台线程同时执行的语句。
+    """
+    stats = SQLStats()
+    collector = (stats, requests_only)
+    _collectors.append(collector)
+    try:
+        yield stats
+    finally:
+        _collectors.remove(collector)
+
+
+@contextmanager
+def assert_query_budget(max_statements: int):
+    """代码块内执行的语句数超过 max_statements 时抛出 QueryBudgetExceeded，用于在测试中发现 N+1 查询。
+
+    with assert_query_budget(10):
+        client.get("/api/project/1", headers=headers)
+    """
+    with count_queries(requests_only=True) as stats:
+        yield stats
+    if stats.statements > max_statements:
+        repeated = "\n".join(f"  {count}x {statement}" for statement, count in stats.most_repeated())
+        raise QueryBudgetExceeded(f"Executed {stats.statements} SQL statements, "
+                                  f"budget is {max_statements}. Most repeated:\n{repeated}")
+
+
+def _timed_commit(do_commit):
+    def wrapper(dbapi_connection):
+        start = time.perf_counter()
+        do_commit(dbapi_connection)
+        duration = time.perf_counter() - start
+        for callback in on_commit:
+            callback(duration)
+    return wrapper
+
+
+def watch(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    # SQLAlchemy 没有提交之后的连接事件，所以直接包装方言的 do_commit 来计时
+    engine.dialect.do_commit = _timed_commit(engine.dialect.do_commit)
+
+
+watch(engine)
+engine_created.append(watch)
@@ -0,0 +1,137 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import traceback
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select, update, or_, and_
+
+import sql.models as models
+from sql.database import engine, delete_in_batches
+
+
+# 后台任务队列：任务保存在 Job 表中，进程重启后继续执行；本进程内的 worker 从表中领取任务。
+# 领取时设置租约，执行任务的进程崩溃后，租约过期的任务会被重新领取，所以任务本身要能重复执行
+WORKERS = int(os.getenv("QA_RAFFLE_JOB_WORKERS", "2"))
+POLL_INTERVAL = 1.0             # 秒，其他进程加入的任务靠轮询发现
+LEASE = datetime.timedelta(minutes=30)
+RETRY_BASE_DELAY = 5            # 秒，第n次失败后等待 5 * 2^(n-1) 秒再重试
+RETRY_MAX_DELAY = 600
+KEEP_FINISHED = datetime.timedelta(days=7)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_wakeup: asyncio.Event | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def handler(kind: str):
+    # 注册任务处理函数，任务的 payload 作为关键字参数传入，返回值保存为任务结果
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(session: Session, kind: str, payload: dict | None = None, dedup_key: str | None = None,
+            max_attempts: int = 5, delay: float = 0, creater_id: int | None = None) -> models.Job:
+    # 不提交，和调用方的修改在同一个事务里提交，提交后调用 wake()。
+    # 同一个 dedup_key 已经有等待中的任务时直接返回它，不重复加入
+    if dedup_key is not None:
+        job = session.exec(select(models.Job).where(models.Job.dedup_key == dedup_key,
+                                                    models.Job.status == PENDING)).first()
+        if job is not None:
+            return job
+    now = datetime.datetime.now()
+    job = models.Job(kind=kind, payload=json.dumps(payload or {}), dedup_key=dedup_key,
+                     max_attempts=max_attempts, run_after=now + datetime.timedelta(seconds=delay),
+                     creater_id=creater_id, create_time=now)
+    session.add(job)
+    return job
+
+
+def wake():
+    # 可以在线程池中调用
+    if _loop is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def claim() -> models.Job | None:
+    now = datetime.datetime.now()
+    # 一条 UPDATE ... RETURNING 领取任务，多个 worker（包括其他进程的）不会领到同一个
+    # 租约过期的任务（执行它的进程崩溃了）也算一次尝试，次数用完的不再领取，标记为失败
+    expired = and_(models.Job.status == RUNNING, models.Job.lease_until < now)
+    candidate = (select(models.Job.id)
+                 .where(or_(and_(models.Job.status == PENDING, models.Job.run_after <= now),
+                            and_(expired, models.Job.attempts < models.Job.max_attempts)))
+                 .order_by(models.Job.run_after, models.Job.id).limit(1).scalar_subquery())
+    with Session(engine) as session:
+        exhausted = session.exec(update(models.Job).where(expired, models.Job.attempts >= models.Job.max_attempts)
+                                 .values(status=FAILED, lease_until=None, finish_time=now,
+                                         last_error="Lease expired, the worker running the job may have crashed."))
+        if exhausted.rowcount:
+            logger.warning("Failed %d jobs whose lease expired on the last attempt.", exhausted.rowcount)
+        job = session.exec(update(models.Job).where(models.Job.id == candidate)
+                           .values(status=RUNNING, attempts=models.Job.attempts + 1, lease_until=now + LEASE)
+                           .returning(models.Job)
+                           .execution_options(synchronize_session=False)).scalars().first()
+        if job is not None:
+            session.expunge(job)
+        session.commit()
+    return job
+
+
+def execute(job: models.Job):
+    func = _handlers.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f"Unknown job kind: {job.kind}")
+        result = func(**json.loads(job.payload))
+    except Exception:
+        logger.exception("Job %d (%s) failed, attempt %d/%d.", job.id, job.kind, job.attempts, job.max_attempts)
+        values = {"last_error": traceback.format_exc(limit=5)[-2000:], "lease_until": None}
+        if job.attempts < job.max_attempts:
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+            values.update(status=PENDING, run_after=datetime.datetime.now() + datetime.timedelta(seconds=delay))
+        else:
+            values.update(status=FAILED, finish_time=datetime.datetime.now())
+    else:
+        values = {"status": SUCCEEDED, "result": json.dumps(result), "lease_until": None,
+                  "finish_time": datetime.datetime.now()}
+    with Session(engine) as session:
+        session.exec(update(models.Job).where(models.Job.id == job.id).values(**values))
+        session.commit()
+
+
+async def work():
+    global _wakeup, _loop
+    if _wakeup is None:
+        _wakeup, _loop = asyncio.Event(), asyncio.get_running_loop()
+    while True:
+        try:
+            job = await run_in_threadpool(claim)
+        except Exception:
+            logger.exception("Failed to claim a job.")
+            job = None
+        if job is not None:
+            await run_in_threadpool(execute, job)
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def purge_finished(batch_size: int = 1000, pause: float = 0.05) -> int:
+    cutoff = datetime.datetime.now() - KEEP_FINISHED
+    return delete_in_batches(models.Job, and_(models.Job.status.in_((SUCCEEDED, FAILED)),
+                                              models.Job.finish_time < cutoff), batch_size, pause)
@@ -2,6 +2,9 @@ from sqlmodel import SQLModel, Field, Relationship
 import datetime
 
 
+PROJECT_DELETED = -1    # Project.status：已删除、等待后台清理的项目
+
+
 
 class User(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
@@ -48,6 +51,9 @@ class Question(SQLModel, table=True):
 
 
 class Prize(SQLModel, table=True):
+    # AUTOINCREMENT：删除（或迁移到分区）的行的id不会被重新分配，见 sql/partition.py
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id: int | None = Field(default=None, primary_key=True)
     name: str
     image: str | None = Field(default=None)
@@ -61,6 +67,8 @@ class Prize(SQLModel, table=True):
     
     
 class Record(SQLModel, table=True):
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id: int | None = Field(default=None, primary_key=True)
     user_id: int | None = Field(default=None, foreign_key="user.id")
     project_id: int | None = Field(default=None, foreign_key="project.id")
@@ -74,3 +82,79 @@ class Record(SQLModel, table=True):
     user : User | None = Relationship(back_populates="record")
     project: Project | None = Relationship(back_populates="participant")
 
+    
+    
+class ProjectStats(SQLModel, table=True):
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    kind: str = Field(primary_key=True)
+    key: int = Field(default=0, primary_key=True)
+    value: int = Field(default=0)
+    
+    
+class ParticipationRollup(SQLModel, table=True):
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    minute: datetime.datetime = Field(primary_key=True)
+    answer_num: int = Field(default=0)
+    raffle_num: int = Field(default=0)
+    claim_num: int = Field(default=0)
+    
+    
+class ProjectArchive(SQLModel, table=True):
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    file: str
+    record_num: int = Field(default=0)
+    answer_num: int = Field(default=0)
+    raffle_num: int = Field(default=0)
+    claim_num: int = Field(default=0)
+    archive_time: datetime.datetime
+    
+    
+class IdempotencyKey(SQLModel, table=True):
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    key: str = Field(primary_key=True)
+    request: str
+    response: str | None = Field(default=None)     # 为空表示请求还在处理中
+    create_time: datetime.datetime = Field(index=True)
+    
+    
+class Job(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str = Field(index=True)
+    payload: str = Field(default="{}")      # JSON
+    dedup_key: str | None = Field(default=None, index=True)
+    status: str = Field(default="pending", index=True)     # pending、running、succeeded、failed
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    run_after: datetime.datetime = Field(index=True)
+    lease_until: datetime.datetime | None = Field(default=None)
+    last_error: str | None = Field(default=None)
+    result: str | None = Field(default=None)       # JSON
+    creater_id: int | None = Field(default=None, foreign_key="user.id")
+    create_time: datetime.datetime
+    finish_time: datetime.datetime | None = Field(default=None)
+    
+    
+class HotProject(SQLModel, table=True):
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    owner: str | None = Field(default=None)         # 所有者进程，主机名:进程号
+    applied_seq: int = Field(default=0)             # 预写日志中已经写进数据库的位置
+    activate_time: datetime.datetime | None = Field(default=None)
+
+
+class ProjectPartition(SQLModel, table=True):
+    # 记录和奖品放在单独数据库文件中的项目
+    project_id: int = Field(primary_key=True)
+    file: str
+    create_time: datetime.datetime | None = Field(default=None)
+
+
+class ProjectVersion(SQLModel, table=True):
+    # 项目信息、题目或奖品每修改一次加一，用于生成 ETag（见 sql/etag.py）
+    project_id: int = Field(foreign_key="project.id", primary_key=True)
+    version: int = Field(default=0)
+
+
+class UserVersion(SQLModel, table=True):
+    # 只有一行，任何用户改名或注销时加一。项目详情中有创建者和参与者的用户名，也计入 ETag
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
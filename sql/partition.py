@@ -0,0 +1,115 @@
+import datetime
+import logging
+import os
+from sqlalchemy import Table, MetaData, Column, Index
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+import sql.models as models
+from sql.database import engine, partitions, partition_engine, PARTITIONED_TABLES, ID_SHIFT
+
+
+# 把哪些项目放到单独的数据库文件中，逗号分隔的项目id。每个进程启动时迁移还没迁移的项目，并加载所有分区
+PARTITIONED_PROJECTS = [int(project_id) for project_id in os.getenv("QA_RAFFLE_PARTITIONED_PROJECTS", "").split(",")
+                        if project_id.strip()]
+PARTITION_DIR = os.getenv("QA_RAFFLE_PARTITION_DIR", "partitions")
+
+
+logger = logging.getLogger(__name__)
+
+
+def partition_path(project_id: int) -> str:
+    return os.path.join(PARTITION_DIR, f"project_{project_id}.db")
+
+
+def _partition_metadata() -> MetaData:
+    # 分区中的表不带外键（引用的表在主数据库中），用 AUTOINCREMENT 让新的id从 project_id << ID_SHIFT 开始，
+    # 不和主数据库及其他分区中的id重复。主数据库中的表也是 AUTOINCREMENT（见 _autoincrement_main），
+    # 迁移走的id不会被重新分配，奖品id和记录id在整个系统中唯一
+    metadata = MetaData()
+    for table in PARTITIONED_TABLES:
+        Table(table.name, metadata,
+              *[Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                for column in table.columns],
+              sqlite_autoincrement=True)
+    Index("ix_record_user_id", metadata.tables["record"].c.user_id)
+    return metadata
+
+
+def _raise_sequence(conn, schema: str, table: str, seq_sql: str, params: tuple = ()):
+    # 把 schema 中 table 的 AUTOINCREMENT 计数器提高到至少 seq_sql 的值，之后插入的行id比它大
+    conn.exec_driver_sql(f"INSERT INTO {schema}.sqlite_sequence (name, seq) "
+                         f"SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM {schema}.sqlite_sequence WHERE name = ?)",
+                         (table, table))
+    conn.exec_driver_sql(f"UPDATE {schema}.sqlite_sequence SET seq = max(seq, ({seq_sql})) WHERE name = ?",
+                         (*params, table))
+
+
+def _autoincrement_main():
+    # 早先创建的主数据库中 prize、record 表没有 AUTOINCREMENT，SQLite 会把当前最大id之后的id重新分配出去，
+    # 与已经迁移到分区中的行重复，按id查询时会取到别的项目的行。这里重建为 AUTOINCREMENT 的表（没有其他表引用它们），
+    # 并把计数器提高到已有分区中迁移过去的最大id。主数据库的id增长到 1 << ID_SHIFT 之前不会进入分区的范围
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            create_sql = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                              (table.name,)).scalar()
+            if "AUTOINCREMENT" in create_sql.upper():
+                continue
+            columns = ", ".join(column.name for column in table.columns)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {table.name}_old")
+            table.create(conn)
+            conn.exec_driver_sql(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old")
+            conn.exec_driver_sql(f"DROP TABLE {table.name}_old")
+            logger.info("Rebuilt table %s with AUTOINCREMENT.", table.name)
+    for project_id, partition in partitions.items():
+        with partition.begin() as conn:
+            for table in PARTITIONED_TABLES:
+                _raise_sequence(conn, "shared", table.name,
+                                f"SELECT coalesce(max(id), 0) FROM main.{table.name} WHERE id < ?",
+                                (project_id << ID_SHIFT,))
+
+
+def create_partition(project_id: int):
+    os.makedirs(PARTITION_DIR, exist_ok=True)
+    path = partition_path(project_id)
+    partition = partition_engine(path)
+    _partition_metadata().create_all(partition)
+    first_id = project_id << ID_SHIFT
+    try:
+        # 复制、删除和登记在同一个事务中提交，跨主数据库和分区数据库也是原子的
+        with partition.begin() as conn:
+            for table in PARTITIONED_TABLES:
+                columns = ", ".join(column.name for column in table.columns)
+                conn.exec_driver_sql(f"INSERT INTO main.{table.name} ({columns}) "
+                                     f"SELECT {columns} FROM shared.{table.name} WHERE project_id = ?", (project_id,))
+                _raise_sequence(conn, "main", table.name, "?", (first_id,))
+                # 主数据库中不再分配迁移走的id
+                _raise_sequence(conn, "shared", table.name,
+                                f"SELECT coalesce(max(id), 0) FROM shared.{table.name} WHERE project_id = ?",
+                                (project_id,))
+                conn.exec_driver_sql(f"DELETE FROM shared.{table.name} WHERE project_id = ?", (project_id,))
+            conn.exec_driver_sql("INSERT INTO shared.projectpartition (project_id, file, create_time) VALUES (?, ?, ?)",
+                                 (project_id, path, datetime.datetime.now()))
+    except IntegrityError:
+        # 其他进程已经迁移了这个项目
+        pass
+    partitions[project_id] = partition
+
+
+def setup():
+    with Session(engine) as session:
+        registered = session.exec(select(models.ProjectPartition)).all()
+        existing = set(session.exec(select(models.Project.id)
+                                    .where(models.Project.id.in_(PARTITIONED_PROJECTS))).all())
+    for partition in registered:
+        partitions[partition.project_id] = partition_engine(partition.file)
+    if partitions or PARTITIONED_PROJECTS:
+        _autoincrement_main()
+    for project_id in PARTITIONED_PROJECTS:
+        if project_id in partitions:
+            continue
+        if project_id not in existing:
+            logger.warning("Project %d does not exist, not partitioned.", project_id)
+            continue
+        create_partition(project_id)
+        logger.info("Moved records and prizes of project %d to %s.", project_id, partition_path(project_id))
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import select, delete
+
+import sql.models as models
+import sql.idempotency as idempotency
+import sql.jobs as jobs
+from sql.models import PROJECT_DELETED
+from sql.database import delete_in_batches, open_session
+
+
+PURGE_INTERVAL = 30     # 秒
+BATCH_SIZE = 1000       # 每个事务最多删除的行数
+BATCH_PAUSE = 0.05      # 两批之间让出写锁的时间，秒
+# 依赖项目的表，全部清理完之后再删除项目本身
+DEPENDENT_MODELS = (models.Record, models.Question, models.Prize,
+                    models.ProjectStats, models.ParticipationRollup, models.ProjectArchive,
+                    models.HotProject, models.ProjectVersion)
+
+
+logger = logging.getLogger(__name__)
+
+
+def purge_project(project_id: int, batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE) -> int:
+    with open_session() as session:
+        archive = session.get(models.ProjectArchive, project_id)
+        if archive and os.path.exists(archive.file):
+            os.remove(archive.file)
+    purged = sum(delete_in_batches(model, model.project_id == project_id, batch_size, pause)
+                 for model in DEPENDENT_MODELS)
+    with open_session() as session:
+        session.exec(delete(models.Project).where(models.Project.id == project_id,
+                                                  models.Project.status == PROJECT_DELETED))
+        session.commit()
+    return purged
+
+
+@jobs.handler("purge_project")
+def purge_project_job(project_id: int) -> dict:
+    return {"purged": purge_project(project_id)}
+
+
+def enqueue_deleted_projects() -> int:
+    # 已删除的项目只由 purge_project 任务清理，租约、重试退避和去重都交给任务队列。
+    # 这里只给还没有任务的项目补上任务（例如以前删除的项目）；等待中、执行中和已经放弃（failed）的任务不重复加入
+    with open_session() as session:
+        project_ids = session.exec(select(models.Project.id)
+                                   .where(models.Project.status == PROJECT_DELETED)).all()
+        queued = set(session.exec(select(models.Job.dedup_key)
+                                  .where(models.Job.kind == "purge_project",
+                                         models.Job.status.in_((jobs.PENDING, jobs.RUNNING, jobs.FAILED)))).all())
+        enqueued = 0
+        for project_id in project_ids:
+            dedup_key = f"purge_project:{project_id}"
+            if dedup_key not in queued:
+                jobs.enqueue(session, "purge_project", {"project_id": project_id}, dedup_key=dedup_key)
+                enqueued += 1
+        session.commit()
+    if enqueued:
+        jobs.wake()
+    return enqueued
+
+
+def purge_orphans(batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE) -> int:
+    # 以前删除项目时不删除记录，这些记录的项目已经不存在了
+    project_ids = select(models.Project.id)
+    return sum(delete_in_batches(model, model.project_id.not_in(project_ids), batch_size, pause)
+               for model in DEPENDENT_MODELS)
+
+
+async def purge_periodically(interval: float = PURGE_INTERVAL):
+    try:
+        purged = await run_in_threadpool(purge_orphans)
+        if purged:
+            logger.info("Purged %d orphaned rows.", purged)
+    except Exception:
+        logger.exception("Failed to purge orphaned rows.")
+    while True:
+        try:
+            await run_in_threadpool(enqueue_deleted_projects)
+        except Exception:
+            logger.exception("Failed to enqueue purge of deleted projects.")
+        try:
+            await run_in_threadpool(idempotency.purge_expired)
+        except Exception:
+            logger.exception("Failed to purge expired idempotency keys.")
+        try:
+            await run_in_threadpool(jobs.purge_finished)
+        except Exception:
+            logger.exception("Failed to purge finished jobs.")
+        await asyncio.sleep(interval)
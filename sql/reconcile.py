@@ -0,0 +1,124 @@
+import datetime
+import json
+import logging
+import time
+from collections import Counter
+from sqlmodel import Session, select, update, func
+
+import sql.models as models
+import sql.archive as archive
+import sql.jobs as jobs
+import sql.etag as etag
+import live
+from sql.database import open_session
+
+
+# 抽奖时先提交记录再扣减奖品剩余，两次提交之间崩溃或并发覆盖会让 Prize.remain 和实际发出的数量对不上。
+# 对账按 id 分批统计 raffle_result（每批一个短的读事务，不阻塞抽奖），只在内存里保留每个奖品的计数
+CHUNK_SIZE = 5000
+CHUNK_PAUSE = 0.01      # 秒，批之间让出数据库
+QUIET_PERIOD = 2.0      # 秒，对账开始前这段时间内有过抽奖的，视为可能有还没扣减完的抽奖
+
+
+logger = logging.getLogger(__name__)
+
+
+def count_issued(project_id: int, chunk_size: int = CHUNK_SIZE, pause: float = CHUNK_PAUSE) -> tuple[int, Counter]:
+    # 返回 (记录数, 每个奖品发出的数量)。每批先找到这一批最后一条记录的id，再在数据库中按 raffle_result 分组计数，
+    # 同一个项目中不同的抽奖结果很少，每种只需要解析一次
+    issued = Counter()
+    record_num = 0
+    last = 0
+    while True:
+        with open_session() as session:
+            condition = (models.Record.project_id == project_id, models.Record.id > last)
+            upper = session.exec(select(models.Record.id).where(*condition).order_by(models.Record.id)
+                                 .offset(chunk_size - 1).limit(1)).first()
+            if upper is not None:
+                condition += (models.Record.id <= upper,)
+            groups = session.exec(select(models.Record.raffle_result, func.count())
+                                  .where(*condition).group_by(models.Record.raffle_result)).all()
+        for raffle_result, count in groups:
+            record_num += count
+            if raffle_result:
+                for prize_id in json.loads(raffle_result):
+                    issued[prize_id] += count
+        if upper is None:
+            break
+        last = upper
+        time.sleep(pause)
+    with open_session() as session:
+        archived = session.get(models.ProjectArchive, project_id)
+        if archived is None:
+            return record_num, issued
+        # 热表中的记录以热表为准，与 archive.iter_records 相同。归档后热表中剩下的记录很少
+        hot_users = set(session.exec(select(models.Record.user_id)
+                                     .where(models.Record.project_id == project_id)).all())
+    for record in archive._read_file(archived.file):
+        if record.user_id in hot_users:
+            continue
+        record_num += 1
+        if record.raffle_result:
+            issued.update(json.loads(record.raffle_result))
+    return record_num, issued
+
+
+def _read_prizes(session: Session, project_id: int) -> list:
+    return session.exec(select(models.Prize.id, models.Prize.amount, models.Prize.remain)
+                        .where(models.Prize.project_id == project_id).order_by(models.Prize.id)).all()
+
+
+@jobs.handler("reconcile_inventory")
+def reconcile_inventory(project_id: int, repair: bool = False) -> dict:
+    started = datetime.datetime.now()
+    with open_session() as session:
+        prizes = _read_prizes(session, project_id)
+    record_num, issued = count_issued(project_id)
+    with open_session() as session:
+        # 扫描期间（以及开始前不久）有人抽奖的话，计数和剩余数量不是同一时刻的，只报告不修复
+        busy = session.exec(select(models.Record.id)
+                            .where(models.Record.project_id == project_id,
+                                   models.Record.raffle_time >= started - datetime.timedelta(seconds=QUIET_PERIOD))
+                            .limit(1)).first() is not None
+        # 热模式下库存以所有者进程内存中的为准，数据库中的还在追赶
+        hot = session.get(models.HotProject, project_id) is not None
+        stable = not busy and not hot and _read_prizes(session, project_id) == prizes
+        report = []
+        drifted = []
+        oversold = []
+        for prize_id, amount, remain in prizes:
+            expected = amount - issued.get(prize_id, 0)     # 负数表示超发
+            report.append({"id": prize_id, "amount": amount, "remain": remain,
+                           "issued": issued.get(prize_id, 0), "expected_remain": expected,
+                           "drift": remain - expected})
+            if expected < 0:
+                # 发出的比总数多，remain 改成什么都对不上，单独报告，不自动修复，由管理员处理
+                oversold.append({"id": prize_id, "amount": amount, "issued": issued.get(prize_id, 0),
+                                 "oversold": -expected, "remain": remain})
+            elif remain != expected:
+                drifted.append((prize_id, remain, expected))
+        if oversold:
+            logger.warning("Project %d has oversold prizes: %s", project_id, oversold)
+        prize_ids = {prize_id for prize_id, _, _ in prizes}
+        result = {"project_id": project_id, "record_num": record_num, "stable": stable, "repaired": 0,
+                  "prize": report, "oversold": oversold,
+                  "unknown_prize": {prize_id: n for prize_id, n in issued.items() if prize_id not in prize_ids}}
+        if not repair or not drifted:
+            return result
+        if not stable:
+            # 抛出异常让任务队列稍后重试
+            raise RuntimeError(f"Project {project_id} had draws during reconciliation.")
+        for prize_id, remain, expected in drifted:
+            # 只在剩余数量仍是对账时读到的值时修改，期间被抽奖改过的话放弃整个修复
+            updated = session.exec(update(models.Prize)
+                                   .where(models.Prize.id == prize_id, models.Prize.project_id == project_id,
+                                          models.Prize.remain == remain)
+                                   .values(remain=expected)).rowcount
+            if not updated:
+                session.rollback()
+                raise RuntimeError(f"Prize {prize_id} changed during reconciliation.")
+        etag.bump(session, project_id)
+        session.commit()
+    result["repaired"] = len(drifted)
+    live.hub.notify(project_id)
+    return result
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import logging
+import threading
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select
+from sqlalchemy.dialects.sqlite import insert
+
+import schemas as sch
+import sql.models as models
+from sql.database import engine
+
+
+FLUSH_INTERVAL = 10     # 秒
+EVENT_KINDS = ("answer_num", "raffle_num", "claim_num")
+RESOLUTIONS = {"1m": 1, "5m": 5, "1h": 60}  # 每个桶包含的分钟数
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_buckets: dict[tuple[int, datetime.datetime], dict[str, int]] = {}
+
+
+def _floor(time: datetime.datetime, minutes: int = 1) -> datetime.datetime:
+    time = time.replace(second=0, microsecond=0)
+    return time - datetime.timedelta(minutes=(time.hour * 60 + time.minute) % minutes)
+
+
+def add_event(project_id: int, kind: str, time: datetime.datetime | None = None, count: int = 1):
+    minute = _floor(time or datetime.datetime.now())
+    with _lock:
+        bucket = _buckets.setdefault((project_id, minute), dict.fromkeys(EVENT_KINDS, 0))
+        bucket[kind] += count
+
+
+def flush():
+    global _buckets
+    with _lock:
+        pending, _buckets = _buckets, {}
+    if not pending:
+        return
+    stmt = insert(models.ParticipationRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["project_id", "minute"],
+        set_={kind: getattr(models.ParticipationRollup, kind) + getattr(stmt.excluded, kind)
+              for kind in EVENT_KINDS})
+    try:
+        with Session(engine) as session:
+            session.exec(stmt, params=[{"project_id": project_id, "minute": minute, **bucket}
+                                       for (project_id, minute), bucket in pending.items()])
+            session.commit()
+    except Exception:
+        # 写入失败时把数据放回内存，下次再试
+        with _lock:
+            for key, bucket in pending.items():
+                merged = _buckets.setdefault(key, dict.fromkeys(EVENT_KINDS, 0))
+                for kind in EVENT_KINDS:
+                    merged[kind] += bucket[kind]
+        raise
+
+
+async def flush_periodically(interval: float = FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(flush)
+        except Exception:
+            logger.exception("Failed to flush participation rollups.")
+
+
+def read_rollup(session: Session, project_id: int, resolution: str,
+                start: datetime.datetime, end: datetime.datetime) -> sch.ParticipationRollupResponse:
+    minutes = RESOLUTIONS[resolution]
+    merged: dict[datetime.datetime, dict[str, int]] = {}
+
+    def merge(minute, counts):
+        bucket = merged.setdefault(_floor(minute, minutes), dict.fromkeys(EVENT_KINDS, 0))
+        for kind in EVENT_KINDS:
+            bucket[kind] += counts[kind]
+
+    rows = session.exec(select(models.ParticipationRollup)
+                        .where(models.ParticipationRollup.project_id == project_id,
+                               models.ParticipationRollup.minute >= start,
+                               models.ParticipationRollup.minute < end)).all()
+    for row in rows:
+        merge(row.minute, {kind: getattr(row, kind) for kind in EVENT_KINDS})
+    # 还没写入数据库的桶也要算上
+    with _lock:
+        pending = [(minute, dict(bucket)) for (pid, minute), bucket in _buckets.items()
+                   if pid == project_id and start <= minute < end]
+    for minute, counts in pending:
+        merge(minute, counts)
+    return sch.ParticipationRollupResponse(
+        project_id=project_id,
+        resolution=resolution,
+        buckets=[sch.RollupBucket(time=time, **counts) for time, counts in sorted(merged.items())])
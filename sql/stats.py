@@ -0,0 +1,130 @@
+from collections import Counter
+import schemas as sch
+import sql.models as models
+import sql.archive as archive
+import sql.jobs as jobs
+from sql.database import engine_of
+from sqlmodel import Session, select, delete
+from sqlalchemy.dialects.sqlite import insert
+
+
+# ProjectStats 中每一行是一个计数器，kind 区分计数器的种类，key 区分同一种类下的不同桶
+ANSWER = "answer"                       # 答题人数
+QUESTION_CORRECT = "question_correct"   # key 为题目序号，值为答对该题的人数
+SCORE = "score"                         # key 为答对题数，值为人数
+RAFFLE_USER = "raffle_user"             # 抽过奖的人数
+RAFFLE = "raffle"                       # 抽奖总次数
+PRIZE_HIT = "prize_hit"                 # key 为奖品id，值为被抽中的次数
+CLAIM = "claim"                         # 已兑奖人数
+
+
+def increment(session: Session, project_id: int, kind: str, key: int = 0, value: int = 1):
+    # 不提交，和调用方的修改在同一个事务里提交
+    stmt = insert(models.ProjectStats).values(project_id=project_id, kind=kind, key=key, value=value)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["project_id", "kind", "key"],
+        set_={"value": models.ProjectStats.value + stmt.excluded.value})
+    session.exec(stmt)
+
+
+def record_answer(session: Session, project_id: int, answer: list[int], correct_answer: list[int]):
+    increment(session, project_id, ANSWER)
+    correct_num = 0
+    for i, a in enumerate(correct_answer):
+        correct = i < len(answer) and answer[i] == a
+        increment(session, project_id, QUESTION_CORRECT, i, int(correct))   # 答错也写入，保证每道题都有一行
+        correct_num += correct
+    increment(session, project_id, SCORE, correct_num)
+
+
+def record_raffle(session: Session, project_id: int, prize_id: int, first_raffle: bool):
+    if first_raffle:
+        increment(session, project_id, RAFFLE_USER)
+    increment(session, project_id, RAFFLE)
+    increment(session, project_id, PRIZE_HIT, prize_id)
+
+
+def record_raffles(session: Session, project_id: int, draws: list[tuple[int, bool]]):
+    # record_raffle 的批量版本，draws 中每项为 (奖品id, 是否第一次抽奖)，合并成一条语句
+    counters = Counter()
+    for prize_id, first_raffle in draws:
+        if first_raffle:
+            counters[(RAFFLE_USER, 0)] += 1
+        counters[(RAFFLE, 0)] += 1
+        counters[(PRIZE_HIT, prize_id)] += 1
+    if not counters:
+        return
+    stmt = insert(models.ProjectStats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["project_id", "kind", "key"],
+        set_={"value": models.ProjectStats.value + stmt.excluded.value})
+    session.exec(stmt, params=[{"project_id": project_id, "kind": kind, "key": key, "value": value}
+                               for (kind, key), value in counters.items()])
+
+
+def record_claim(session: Session, project_id: int, count: int = 1):
+    increment(session, project_id, CLAIM, value=count)
+
+
+def read_stats(session: Session, project_id: int) -> sch.ProjectStatsResponse:
+    rows = session.exec(select(models.ProjectStats).filter_by(project_id=project_id)).all()
+    counters = {}
+    for row in rows:
+        counters.setdefault(row.kind, {})[row.key] = row.value
+    answer_num = counters.get(ANSWER, {}).get(0, 0)
+    raffle_user_num = counters.get(RAFFLE_USER, {}).get(0, 0)
+    claim_num = counters.get(CLAIM, {}).get(0, 0)
+    question_correct = counters.get(QUESTION_CORRECT, {})
+    question_num = max(question_correct.keys(), default=-1) + 1
+    return sch.ProjectStatsResponse(
+        project_id=project_id,
+        answer_num=answer_num,
+        question_correct_rate=[question_correct.get(i, 0) / answer_num if answer_num else 0.0
+                               for i in range(question_num)],
+        score_distribution=dict(sorted(counters.get(SCORE, {}).items())),
+        raffle_user_num=raffle_user_num,
+        raffle_num=counters.get(RAFFLE, {}).get(0, 0),
+        prize_hit=dict(sorted(counters.get(PRIZE_HIT, {}).items())),
+        claim_num=claim_num,
+        claim_rate=claim_num / raffle_user_num if raffle_user_num else 0.0)
+
+
+def recompute_stats(session: Session, project_id: int):
+    # 全量重算，用于修复计数器。汇总和清空重建在同一个 BEGIN IMMEDIATE 事务中，
+    # 期间答题抽奖的计数器增量要等它提交后才能写入，不会在读取和替换之间丢失。
+    # session 不能有未提交的修改，要用项目所在数据库的普通 Session（见 recompute_stats_job）
+    session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+    questions = session.exec(select(models.Question).filter_by(project_id=project_id)).all()
+    correct_answer = [question.a for question in questions]
+    counters = Counter()
+    for record in archive.iter_records(session, project_id):
+        if record.answer:
+            answer = eval(record.answer)
+            counters[(ANSWER, 0)] += 1
+            correct_num = 0
+            for i, a in enumerate(correct_answer):
+                correct = i < len(answer) and answer[i] == a
+                counters[(QUESTION_CORRECT, i)] += correct
+                correct_num += correct
+            counters[(SCORE, correct_num)] += 1
+        if record.raffle_result:
+            raffle_result = eval(record.raffle_result)
+            counters[(RAFFLE_USER, 0)] += 1
+            counters[(RAFFLE, 0)] += len(raffle_result)
+            for prize_id in raffle_result:
+                counters[(PRIZE_HIT, prize_id)] += 1
+            if record.prize_claim_status:
+                counters[(CLAIM, 0)] += 1
+    session.exec(delete(models.ProjectStats).where(models.ProjectStats.project_id == project_id))
+    if counters:
+        session.exec(insert(models.ProjectStats),
+                     params=[{"project_id": project_id, "kind": kind, "key": key, "value": value}
+                             for (kind, key), value in counters.items()])
+    session.commit()
+
+
+@jobs.handler("recompute_stats")
+def recompute_stats_job(project_id: int):
+    # 和 hot.apply 一样在项目所在数据库的连接上执行，主数据库中的表通过附加的 shared 读写
+    with Session(engine_of(project_id)) as session:
+        recompute_stats(session, project_id)
@@ -0,0 +1,59 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 测试在临时目录中运行，数据库、分区、归档等文件都写到这里，不影响仓库目录
+_workdir = tempfile.mkdtemp(prefix="qa_raffle_test_")
+os.environ["QA_RAFFLE_DB"] = os.path.join(_workdir, "qa_raffle.db")
+os.environ["RATE_LIMITS"] = "{}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(_workdir)
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+_names = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def register(client):
+    def register(manager: bool = False) -> dict:
+        username = f"user{next(_names)}"
+        client.post("/api/register", json={"username": username, "password": "password",
+                                           "manage_permission": manager})
+        response = client.post("/api/login", data={"username": username, "password": "password"})
+        return {"Authorization": "Bearer " + response.json()["access_token"]}
+    return register
+
+
+@pytest.fixture
+def manager(register):
+    return register(manager=True)
+
+
+@pytest.fixture
+def make_project(client, manager):
+    # prizes 中每项为 (level, amount)
+    def make_project(questions: int = 0, prizes=((1, 10),)) -> int:
+        project_id = client.post("/api/project", json={"name": "test", "deadline": "2099-01-01 00:00:00"},
+                                 headers=manager).json()["id"]
+        for i in range(questions):
+            client.post("/api/question", json={"project_id": project_id, "q": "q", "o1": "A", "o2": "B",
+                                               "o3": "C", "o4": "D", "a": 1 + i % 4}, headers=manager)
+        for level, amount in prizes:
+            client.post("/api/prize", json={"project_id": project_id, "name": f"prize{level}",
+                                            "level": level, "amount": amount}, headers=manager)
+        client.patch(f"/api/project/{project_id}/publish", headers=manager)
+        return project_id
+    return make_project
@@ -0,0 +1,52 @@
+from sqlmodel import Session, select
+
+import sql.archive as archive
+import sql.models as models
+from sql.database import engine
+
+
+def records(project_id: int) -> list[models.Record]:
+    with Session(engine) as session:
+        return session.exec(select(models.Record).filter_by(project_id=project_id)).all()
+
+
+def test_archived_record_is_not_created_again(client, register, make_project):
+    project_id = make_project(questions=2, prizes=((0, 10),))
+    user = register()
+    assert client.post("/api/answer", json={"project_id": project_id, "answer": [1, 2]},
+                       headers=user).status_code == 200
+    assert client.post(f"/api/raffle/{project_id}", headers=user).status_code == 200
+    archived, = records(project_id)
+    archive.archive_project(project_id, pause=0)
+    assert records(project_id) == []
+
+    # 项目重新开放后再答题、抽奖：接着归档中的记录，不会产生新的记录，也不会重新计算抽奖次数
+    assert client.post("/api/answer", json={"project_id": project_id, "answer": [1, 2]},
+                       headers=user).status_code == 200
+    assert records(project_id) == []
+    assert client.post(f"/api/raffle/{project_id}", headers=user).status_code == 200
+    restored, = records(project_id)
+    assert restored.id == archived.id and restored.answer_time == archived.answer_time
+    assert eval(restored.raffle_result)[:1] == eval(archived.raffle_result)
+    assert len(eval(restored.raffle_result)) == 2
+
+
+def test_record_modified_while_archiving_is_kept(client, register, make_project, monkeypatch):
+    project_id = make_project()
+    assert client.post(f"/api/raffle/{project_id}", headers=register()).status_code == 200
+    record, = records(project_id)
+
+    delete_archived = archive._delete_archived
+    def claim_then_delete(*args):
+        # 文件已经写好、还没有删除时兑奖
+        with Session(engine) as session:
+            session.get(models.Record, record.id).prize_claim_status = True
+            session.commit()
+        return delete_archived(*args)
+    monkeypatch.setattr(archive, "_delete_archived", claim_then_delete)
+    archive.archive_project(project_id, pause=0)
+
+    kept, = records(project_id)
+    assert kept.prize_claim_status
+    with Session(engine) as session:
+        assert archive.read_record(session, project_id, record.user_id).prize_claim_status
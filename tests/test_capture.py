@@ -0,0 +1,20 @@
+import hashlib
+
+import jwt
+
+import capture
+from routers.login import SECRET_KEY, ALGORITHM
+
+
+def bearer(username: str) -> str:
+    return "Bearer " + jwt.encode({"sub": username}, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def test_pseudonym_is_keyed_and_stable():
+    pseudonym = capture._pseudonym(bearer("alice"))
+    # 同一次采集中稳定，回放时同一个用户对应同一个账号
+    assert pseudonym == capture._pseudonym(bearer("alice"))
+    assert pseudonym != capture._pseudonym(bearer("bob"))
+    # 不能用未加盐的哈希反查用户名
+    assert pseudonym != hashlib.sha256(b"alice").hexdigest()[:16]
+    assert capture._pseudonym("Bearer invalid") is None
@@ -0,0 +1,13 @@
+def test_username_change_invalidates_project_details(client, manager, register, make_project):
+    project_id = make_project(prizes=((0, 10),))
+    user = register()
+    assert client.post(f"/api/raffle/{project_id}", headers=user).status_code == 200
+    response = client.get(f"/api/project/{project_id}", headers=manager)
+    project_etag = response.headers["ETag"]
+    assert client.get(f"/api/project/{project_id}", headers={**manager, "If-None-Match": project_etag}
+                      ).status_code == 304
+
+    assert client.patch("/api/user/me", json={"username": "renamed"}, headers=user).status_code == 200
+    response = client.get(f"/api/project/{project_id}", headers={**manager, "If-None-Match": project_etag})
+    assert response.status_code == 200 and response.headers["ETag"] != project_etag
+    assert [participant["username"] for participant in response.json()["raffle_participant"]] == ["renamed"]
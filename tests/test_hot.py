@@ -0,0 +1,40 @@
+from sqlmodel import Session, select
+
+import sql.hot as hot
+import sql.models as models
+from sql.database import engine
+
+
+def records(project_id: int) -> list[models.Record]:
+    with Session(engine) as session:
+        return session.exec(select(models.Record).filter_by(project_id=project_id)).all()
+
+
+def test_answer_after_first_hot_draw_does_not_create_record(client, register, make_project):
+    project_id = make_project(questions=1, prizes=((0, 10),))
+    user = register()
+    hot.activate(project_id)
+    try:
+        assert client.post(f"/api/raffle/{project_id}", headers=user).status_code == 200
+        assert client.post("/api/answer", json={"project_id": project_id, "answer": [1]},
+                           headers=user).status_code == 200
+    finally:
+        hot.deactivate(project_id)
+    record, = records(project_id)
+    assert record.answer is None and len(eval(record.raffle_result)) == 1
+
+
+def test_apply_updates_record_created_after_first_draw(client, register, make_project):
+    project_id = make_project(questions=1, prizes=((0, 10),))
+    hot_project = hot.activate(project_id)
+    try:
+        with Session(engine) as session:
+            user_id = session.exec(select(models.User.id).order_by(models.User.id.desc())).first()
+            hot_project.draw(session, user_id)
+            # 第一次抽奖还没写回时，同一用户的答题已经创建了记录
+            session.add(models.Record(user_id=user_id, project_id=project_id, answer="[1]", raffle_times=5))
+            session.commit()
+    finally:
+        hot.deactivate(project_id)
+    record, = records(project_id)
+    assert record.answer == "[1]" and record.raffle_times == 5 and len(eval(record.raffle_result)) == 1
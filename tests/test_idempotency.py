@@ -0,0 +1,57 @@
+import datetime
+import hashlib
+
+from sqlmodel import Session
+
+import sql.idempotency as idempotency
+import sql.models as models
+from sql.database import engine
+
+
+def reserve(user_id: int, key: str, request: str, age: datetime.timedelta):
+    # 模拟占住 key 之后、保存响应之前崩溃的请求
+    with Session(engine) as session:
+        session.add(models.IdempotencyKey(user_id=user_id, key=key, request=request,
+                                          create_time=datetime.datetime.now() - age))
+        session.commit()
+
+
+def raffle_request(project_id: int) -> str:
+    return hashlib.sha256(f"raffle:{project_id}".encode()).hexdigest()[:32]
+
+
+def test_expired_reservation_is_reconciled_not_run_again(client, register, make_project):
+    project_id = make_project(questions=1, prizes=((0, 100),))
+    user = register()
+    user_id = client.get("/api/user/me", headers=user).json()["id"]
+    client.post("/api/answer", json={"project_id": project_id, "answer": [1]}, headers=user)
+    # 原请求已经提交了抽奖，保存响应之前崩溃
+    drawn = client.post(f"/api/raffle/{project_id}", headers=user).json()["raffle_result"]
+    reserve(user_id, "crashed", raffle_request(project_id), idempotency.LEASE + datetime.timedelta(seconds=1))
+
+    response = client.post(f"/api/raffle/{project_id}", headers={**user, "Idempotency-Key": "crashed"})
+    assert response.status_code == 200
+    assert response.json()["raffle_result"] == drawn
+    replayed = client.post(f"/api/raffle/{project_id}", headers={**user, "Idempotency-Key": "crashed"})
+    assert replayed.headers.get(idempotency.REPLAYED_HEADER) == "true"
+    assert replayed.json()["raffle_result"] == drawn
+
+
+def test_rejected_request_releases_key(client, register, make_project):
+    project_id = make_project()
+    client.patch(f"/api/project/{project_id}", json={"deadline": "2000-01-01 00:00:00"},
+                 headers=register(manager=True))
+    user = register()
+    headers = {**user, "Idempotency-Key": "ended"}
+    assert client.post(f"/api/raffle/{project_id}", headers=headers).status_code == 403
+    assert client.post(f"/api/raffle/{project_id}", headers=headers).status_code == 403
+
+
+def test_request_in_progress_is_not_taken_over(client, register, make_project):
+    project_id = make_project()
+    user = register()
+    user_id = client.get("/api/user/me", headers=user).json()["id"]
+    reserve(user_id, "running", raffle_request(project_id), datetime.timedelta(seconds=1))
+
+    response = client.post(f"/api/raffle/{project_id}", headers={**user, "Idempotency-Key": "running"})
+    assert response.status_code == 409
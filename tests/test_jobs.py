@@ -0,0 +1,26 @@
+import datetime
+
+from sqlmodel import Session
+
+import sql.jobs as jobs
+import sql.models as models
+from sql.database import engine
+
+
+def test_expired_job_on_last_attempt_is_failed_not_reclaimed(client):
+    now = datetime.datetime.now()
+    with Session(engine) as session:
+        # 执行最后一次尝试的进程崩溃了
+        job = models.Job(kind="crashing", payload="{}", status=jobs.RUNNING, attempts=3, max_attempts=3,
+                         run_after=now, lease_until=now - datetime.timedelta(seconds=1), create_time=now)
+        session.add(job)
+        session.commit()
+        job_id = job.id
+
+    claimed = jobs.claim()
+    if claimed is not None:
+        assert claimed.id != job_id
+        jobs.execute(claimed)
+    with Session(engine) as session:
+        job = session.get(models.Job, job_id)
+        assert job.status == jobs.FAILED and job.attempts == 3 and job.finish_time is not None
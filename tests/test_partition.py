@@ -0,0 +1,36 @@
+import sql.partition as partition
+from sql.database import ID_SHIFT
+
+
+def prizes_of(client, manager, project_id: int) -> dict:
+    return {prize["id"]: prize for prize in client.get(f"/api/project/{project_id}", headers=manager).json()["prize"]}
+
+
+def test_ids_do_not_collide_after_partitioning(client, manager, register, make_project):
+    partitioned = make_project(prizes=((1, 2),))
+    other = make_project(prizes=())
+    partition.create_partition(partitioned)
+    moved = prizes_of(client, manager, partitioned)
+
+    # 主数据库中新增的奖品不能重新用到迁移走的id
+    prize = client.post("/api/prize", json={"project_id": other, "name": "new", "level": 1, "amount": 10},
+                        headers=manager).json()
+    assert prize["project_id"] == other and prize["name"] == "new"
+    assert prize["id"] not in moved
+
+    # 抽奖扣减的是本项目的奖品
+    assert client.post(f"/api/raffle/{other}", headers=register()).status_code == 200
+    assert prizes_of(client, manager, other)[prize["id"]]["remain"] == 9
+    assert {id: prize["remain"] for id, prize in prizes_of(client, manager, partitioned).items()} \
+        == {id: prize["remain"] for id, prize in moved.items()}
+
+    updated = client.patch(f"/api/prize/{prize['id']}", json={"name": "renamed"}, headers=manager).json()
+    assert updated["id"] == prize["id"] and updated["project_id"] == other and updated["name"] == "renamed"
+    assert all(prize["name"] != "renamed" for prize in prizes_of(client, manager, partitioned).values())
+
+    # 分区中新增的奖品id从 project_id << ID_SHIFT 开始
+    prize = client.post("/api/prize", json={"project_id": partitioned, "name": "new", "level": 1, "amount": 1},
+                        headers=manager).json()
+    assert prize["project_id"] == partitioned and prize["id"] >> ID_SHIFT == partitioned
+    assert client.delete(f"/api/prize/{prize['id']}", headers=manager).status_code == 204
+    assert prizes_of(client, manager, partitioned).keys() == moved.keys()
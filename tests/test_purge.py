@@ -0,0 +1,31 @@
+import time
+
+from sqlmodel import Session, select
+
+import sql.models as models
+import sql.purge as purge
+from sql.database import engine
+
+
+def test_deleted_projects_are_purged_by_one_job(client, make_project):
+    project_id = make_project()
+    # 没有清理任务的已删除项目（例如以前删除的）
+    with Session(engine) as session:
+        project = session.get(models.Project, project_id)
+        project.status = models.PROJECT_DELETED
+        session.add(project)
+        session.commit()
+
+    purge.enqueue_deleted_projects()
+    purge.enqueue_deleted_projects()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with Session(engine) as session:
+            if session.get(models.Project, project_id) is None:
+                break
+        time.sleep(0.1)
+    with Session(engine) as session:
+        assert session.get(models.Project, project_id) is None
+        purge_jobs = session.exec(select(models.Job)
+                                  .where(models.Job.dedup_key == f"purge_project:{project_id}")).all()
+    assert [job.status for job in purge_jobs] == ["succeeded"]
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+from sqlmodel import Session, select
+
+import sql.instrument as instrument
+import sql.models as models
+from sql.database import engine, shards
+
+
+# 每个请求的语句数上限，与参与人数和项目数无关。超出通常说明引入了 N+1 查询
+PROJECT_DETAILS_BUDGET = 8
+PROJECTS_BY_USER_BUDGET = 2      # 另外用户的记录在每个数据库（主数据库和各分区）中各查一次
+
+
+@pytest.mark.parametrize("participants", [1, 10])
+def test_project_details_budget(client, manager, register, make_project, participants):
+    project_id = make_project(questions=2, prizes=((1, 5), (0, 100)))
+    for _ in range(participants):
+        user = register()
+        client.post("/api/answer", json={"project_id": project_id, "answer": [1, 2]}, headers=user)
+        client.post(f"/api/raffle/{project_id}", headers=user)
+    with instrument.assert_query_budget(PROJECT_DETAILS_BUDGET):
+        response = client.get(f"/api/project/{project_id}", headers=manager)
+    assert response.status_code == 200
+    assert len(response.json()["raffle_participant"]) == participants
+
+
+@pytest.mark.parametrize("projects", [1, 10])
+def test_projects_by_user_budget(client, register, make_project, projects):
+    user = register()
+    for _ in range(projects):
+        client.post(f"/api/raffle/{make_project()}", headers=user)
+    with instrument.assert_query_budget(PROJECTS_BY_USER_BUDGET + len(shards())):
+        response = client.get("/api/projects/user", headers=user)
+    assert response.status_code == 200
+    assert len(response.json()) == projects
+
+
+def test_budget_ignores_background_statements():
+    # 任务队列、汇总写入等后台线程的语句不计入请求的预算
+    def background():
+        with Session(engine) as session:
+            session.exec(select(models.Job.id).limit(1)).all()
+    with instrument.assert_query_budget(0) as stats:
+        thread = threading.Thread(target=background)
+        thread.start()
+        thread.join()
+    assert stats.statements == 0
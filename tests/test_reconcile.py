@@ -0,0 +1,30 @@
+from sqlmodel import Session, select
+
+import sql.models as models
+import sql.reconcile as reconcile
+from sql.database import engine
+
+
+def test_oversold_prize_is_reported_and_not_repaired(client, manager, register, make_project, monkeypatch):
+    monkeypatch.setattr(reconcile, "QUIET_PERIOD", 0)
+    project_id = make_project(prizes=((0, 5),))
+    for _ in range(2):
+        assert client.post(f"/api/raffle/{project_id}", headers=register()).status_code == 200
+    drifted = client.post("/api/prize", json={"project_id": project_id, "name": "drifted", "level": 1, "amount": 3},
+                          headers=manager).json()["id"]
+    with Session(engine) as session:
+        oversold, = session.exec(select(models.Prize).where(models.Prize.project_id == project_id,
+                                                            models.Prize.id != drifted)).all()
+        oversold.amount, oversold.remain = 1, 0      # 抽出2个，总数只有1个
+        session.get(models.Prize, drifted).remain = 1
+        session.commit()
+        oversold = oversold.id
+
+    result = reconcile.reconcile_inventory(project_id, repair=True)
+    prizes = {prize["id"]: prize for prize in result["prize"]}
+    assert prizes[oversold]["expected_remain"] == -1 and prizes[oversold]["drift"] == 1
+    assert result["oversold"] == [{"id": oversold, "amount": 1, "issued": 2, "oversold": 1, "remain": 0}]
+    assert result["repaired"] == 1
+    with Session(engine) as session:
+        assert session.get(models.Prize, oversold).remain == 0
+        assert session.get(models.Prize, drifted).remain == 3
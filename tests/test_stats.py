@@ -0,0 +1,51 @@
+import time
+
+from sqlmodel import Session, select
+
+import sql.models as models
+import sql.partition as partition
+import sql.stats as stats
+from sql.database import engine
+
+
+def wait_for_jobs(project_id: int):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with Session(engine) as session:
+            pending = session.exec(select(models.Job).where(models.Job.dedup_key == f"recompute_stats:{project_id}",
+                                                            models.Job.status.in_(("pending", "running")))).all()
+        if not pending:
+            return
+        time.sleep(0.1)
+    raise AssertionError("recompute_stats job did not finish")
+
+
+def test_deleting_question_recomputes_stats(client, manager, register, make_project):
+    project_id = make_project(questions=2)
+    for answer in ([1, 2], [1, 1]):
+        assert client.post("/api/answer", json={"project_id": project_id, "answer": answer},
+                           headers=register()).status_code == 200
+    result = client.get(f"/api/project/{project_id}/stats", headers=manager).json()
+    assert result["question_correct_rate"] == [1.0, 0.5]
+    assert result["score_distribution"] == {"1": 1, "2": 1}
+
+    question_id = client.get(f"/api/project/{project_id}", headers=manager).json()["question"][1]["id"]
+    assert client.delete(f"/api/question/{question_id}", headers=manager).status_code == 204
+    wait_for_jobs(project_id)
+    result = client.get(f"/api/project/{project_id}/stats", headers=manager).json()
+    assert result["question_correct_rate"] == [1.0]
+    assert result["score_distribution"] == {"1": 2}
+
+
+def test_recompute_partitioned_project(client, manager, register, make_project):
+    project_id = make_project(prizes=((0, 10),))
+    partition.create_partition(project_id)
+    for _ in range(2):
+        assert client.post(f"/api/raffle/{project_id}", headers=register()).status_code == 200
+    with Session(engine) as session:
+        session.exec(models.ProjectStats.__table__.delete().where(models.ProjectStats.project_id == project_id))
+        session.commit()
+
+    stats.recompute_stats_job(project_id)
+    result = client.get(f"/api/project/{project_id}/stats", headers=manager).json()
+    assert result["raffle_user_num"] == 2 and result["raffle_num"] == 2
@@ -0,0 +1,252 @@
+"""sql/crud.py 中各函数和 routers/login.py 中认证函数的微基准测试。
+
+每个规模（答题抽奖记录数）先生成一个种子数据库并缓存在 --workdir 中，每次运行都从它复制一份来测，
+保证多次运行的数据完全一致：
+
+    python -m tools.bench --scales 1000,100000 --out bench.json
+    python -m tools.bench --scales 1000,100000 --compare bench.json --threshold 0.2
+
+--compare 会把结果与之前保存的 JSON 对比，中位数变慢超过 threshold 的函数会被标出，并以非零状态退出。
+结果中还有每次调用执行的 SQL 语句数（statements）和分配内存的峰值（peak_kb），只用于对比，不参与判断。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+
+from sqlmodel import SQLModel, Session, create_engine, select, delete
+
+import schemas as sch
+import sql.crud as crud
+import sql.models as models
+import sql.stats as stats
+import routers.login as login
+from sql import instrument
+
+
+PROJECT_RECORDS = 1000      # 每个项目的记录数
+USER_RECORDS = 10           # 每个用户参与的项目数
+QUESTION_NUM = 10
+BENCH_USERS = 2000          # 没有记录的用户，供答题和抽奖的基准使用
+
+
+def seed_database(path: str, records: int, seed: int = 0):
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    project_num = max(USER_RECORDS, records // PROJECT_RECORDS)
+    user_num = max(1, records // USER_RECORDS)
+    hashed_password = login.get_password_hash("p")
+    now = datetime.datetime.now()
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"username": "manager", "hashed_password": hashed_password, "manage_permission": True}])
+        conn.execute(models.User.__table__.insert(), [
+            {"username": f"user{i}", "hashed_password": hashed_password, "manage_permission": False}
+            for i in range(user_num + BENCH_USERS)])
+        conn.execute(models.Project.__table__.insert(), [
+            {"name": f"project{i}", "create_time": now, "deadline": now + datetime.timedelta(days=365),
+             "status": 1, "browse_times": 0, "creater_id": 1} for i in range(project_num)])
+        conn.execute(models.Question.__table__.insert(), [
+            {"q": f"q{j}", "o1": "A", "o2": "B", "o3": "C", "o4": "D", "a": rng.randint(1, 4), "project_id": i + 1}
+            for i in range(project_num) for j in range(QUESTION_NUM)])
+        # 每个项目一个一等奖、一个二等奖和一个数量足够多的安慰奖
+        conn.execute(models.Prize.__table__.insert(), [
+            {"name": f"prize{level}", "level": level, "amount": amount, "remain": amount, "project_id": i + 1}
+            for i in range(project_num) for level, amount in ((1, 10**6), (2, 10**6), (0, 10**8))])
+        batch = []
+        for i in range(records):
+            project_id = i % project_num + 1
+            raffle_times = rng.randint(0, crud.MAX_RAFFLE_TIMES)
+            raffle_result = [(project_id - 1) * 3 + rng.randint(1, 3) for _ in range(rng.randint(0, raffle_times))]
+            batch.append({"user_id": i // USER_RECORDS + 2, "project_id": project_id,
+                          "answer": str([rng.randint(1, 4) for _ in range(QUESTION_NUM)]),
+                          "answer_time": now, "raffle_times": raffle_times,
+                          "raffle_result": str(raffle_result) if raffle_result else None,
+                          "raffle_time": now if raffle_result else None,
+                          "prize_claim_status": bool(raffle_result) and rng.random() < 0.3})
+            if len(batch) == 50000:
+                conn.execute(models.Record.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(models.Record.__table__.insert(), batch)
+    engine.dispose()
+
+
+def timeit(fn, repeat: int) -> dict:
+    # 第一次调用预热（编译语句、填充缓存），第二次统计执行的语句数和分配内存的峰值，
+    # tracemalloc 会拖慢调用，这两次都不计时
+    fn(0)
+    with instrument.count_queries() as queries:
+        tracemalloc.start()
+        try:
+            fn(1)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    timings = []
+    for i in range(2, repeat):
+        start = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": timings[0] * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "statements": queries.statements,
+        "peak_kb": peak / 1024,
+    }
+
+
+def run_scale(path: str, repeat: int) -> dict:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    instrument.watch(engine)
+    session = Session(engine)
+    manager = session.exec(select(models.User).filter_by(username="manager")).one()
+    participant = session.exec(select(models.User).filter_by(username="user0")).one()
+    fresh = iter(session.exec(select(models.User).order_by(models.User.id.desc()).limit(BENCH_USERS)).all())
+    token = login.create_access_token({"sub": participant.username})
+    hashed_password = login.get_password_hash("p")
+    project_id = 1
+    questions = session.exec(select(models.Question).filter_by(project_id=project_id)).all()
+    question_ids = [question.id for question in questions]
+    correct_answer = [question.a for question in questions]
+
+    def new_project():
+        return crud.create_project(sch.ProjectCreate(name="bench", deadline="2099-01-01 00:00:00"),
+                                   user=manager, session=session)
+
+    def answer(i):
+        user = next(fresh)
+        crud.answer_question(sch.AnswerQuestions(project_id=project_id, answer=correct_answer),
+                             user=user, session=session)
+        return user
+
+    # 每个用户最多抽 MAX_RAFFLE_TIMES 次，预先准备好足够多答过题的用户
+    raffle_users = [answer(i) for i in range(-(-repeat // crud.MAX_RAFFLE_TIMES))]
+
+    def raffle(i):
+        crud.raffle_prize(project_id=project_id, user=raffle_users[i // crud.MAX_RAFFLE_TIMES], session=session)
+
+    results = {}
+    # 增加类的函数和对应的删除函数一起测，保证每次运行后数据库保持不变
+    benchmarks = {
+        "login.verify_password": lambda i: login.verify_password("p", hashed_password),
+        "login.get_password_hash": lambda i: login.get_password_hash("p"),
+        "login.create_access_token": lambda i: login.create_access_token({"sub": participant.username}),
+        "login.create_refresh_token": lambda i: login.create_refresh_token({"sub": participant.username}),
+        "login.verify_token": lambda i: login.verify_token(token=token, session=session),
+        "crud.create_project": lambda i: new_project(),
+        "crud.update_project": lambda i: crud.update_project(
+            project_id, sch.ProjectUpdate(description=f"bench {i}"), user=manager, session=session),
+        "crud.read_projects_by_manager": lambda i: crud.read_projects_by_manager(user=manager, session=session),
+        "crud.read_project_details": lambda i: crud.read_project_details(project_id, user=manager, session=session),
+        "crud.read_project_details_by_user": lambda i: crud.read_project_details_by_user(
+            project_id, user=participant, session=session),
+        "crud.add_question": lambda i: crud.delete_question(crud.add_question(
+            sch.QuestionAdd(project_id=project_id, q="bench", o1="A", o2="B", o3="C", o4="D", a=1),
+            user=manager, session=session).id, user=manager, session=session),
+        "crud.update_question": lambda i: crud.update_question(
+            question_ids[0], sch.QuestionUpdate(q=f"bench {i}"), user=manager, session=session),
+        "crud.add_prize": lambda i: crud.delete_prize(crud.add_prize(
+            sch.PrizeAdd(project_id=project_id, name="bench", level=3, amount=1),
+            user=manager, session=session).id, user=manager, session=session),
+        "crud.update_prize": lambda i: crud.update_prize(
+            1, sch.PrizeUpdate(name=f"bench {i}"), user=manager, session=session),
+        "crud.delete_project": lambda i: crud.delete_project(new_project().id, user=manager, session=session),
+        "crud.publish_project": lambda i: crud.publish_project(new_project().id, user=manager, session=session),
+        "crud.answer_question": answer,
+        "crud.raffle_prize": raffle,
+        "crud.read_records_by_user": lambda i: crud.read_records_by_user(user=participant, session=session),
+        "crud.claim_prize": lambda i: crud.claim_prize(project_id=project_id, user_id=raffle_users[-1].id,
+                                                       user=manager, session=session),
+        "crud.read_project_stats": lambda i: crud.read_project_stats(project_id, user=manager, session=session),
+        # 接口只加入后台任务，直接测重算本身
+        "stats.recompute_stats": lambda i: stats.recompute_stats(session, project_id),
+        "crud.read_project_rollup": lambda i: crud.read_project_rollup(
+            project_id, resolution="5m", start=None, end=None, user=manager, session=session),
+    }
+    for name, fn in benchmarks.items():
+        # 哈希密码本身就很慢，少跑几次
+        results[name] = timeit(fn, max(3, repeat // 10) if "password" in name else max(3, repeat))
+        session.expire_all()
+        print(f"  {name:<40}{results[name]['median_ms']:>10.3f} ms{results[name]['statements']:>6} stmts"
+              f"{results[name]['peak_kb']:>10.1f} KB")
+    # 修改题目时加入的重算任务（同一个项目只有一个等待中的），种子数据库中没有任务
+    session.exec(delete(models.Job))
+    session.commit()
+    session.close()
+    engine.dispose()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for scale, functions in results.items():
+        for name, result in functions.items():
+            old = baseline.get("results", {}).get(scale, {}).get(name)
+            if old and result["median_ms"] > old["median_ms"] * (1 + threshold):
+                regressions.append(f"{scale} records {name}: {old['median_ms']:.3f} ms -> "
+                                   f"{result['median_ms']:.3f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark crud and auth functions on seeded databases.")
+    parser.add_argument("--scales", default="1000,100000,1000000",
+                        help="comma separated record counts of the seeded databases")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default="bench_data", help="where seeded databases are cached")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative median slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {}
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        seeded = os.path.join(args.workdir, f"seed_{scale}_{args.seed}.db")
+        if not os.path.exists(seeded):
+            print(f"seeding {scale} records into {seeded} ...")
+            seed_database(seeded + ".tmp", scale, args.seed)
+            os.replace(seeded + ".tmp", seeded)
+        working = os.path.join(args.workdir, "run.db")
+        shutil.copyfile(seeded, working)
+        print(f"{scale} records:")
+        results[str(scale)] = run_scale(working, args.repeat)
+        os.remove(working)
+
+    output = {
+        "meta": {"time": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+                 "platform": platform.platform(), "repeat": args.repeat, "seed": args.seed},
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
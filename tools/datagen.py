@@ -0,0 +1,239 @@
+"""生成用于规模测试的模拟数据，直接批量写入配置的数据库（QA_RAFFLE_DB）。
+
+    python -m tools.datagen --records 10000000 --projects 5000 --users 1000000 --seed 1
+
+同一个种子和同样的参数（包括`--now`）写入空数据库时，生成的数据完全相同（密码哈希使用随机盐，除外）。
+所有时间都以`--now`为基准，而不是当前时间；id 从目标数据库中已有的最大 id 之后开始分配，
+所以写入非空的数据库时 id 会不同。每个项目的参与人数服从长尾分布，
+抽奖过程按接口的规则模拟（同一用户不会重复抽到非安慰奖），所以奖品的`remain`与抽奖记录一致，
+统计表 ProjectStats 也一并写入。写入使用 executemany，不经过 ORM。
+"""
+import argparse
+import datetime
+import random
+import sys
+import time
+from collections import Counter
+
+from sqlmodel import SQLModel
+
+import sql.models as models
+import sql.stats as stats
+from sql.database import engine
+from sql.crud import MAX_RAFFLE_TIMES
+from routers.login import get_password_hash
+
+
+BATCH_SIZE = 50000
+COMMIT_ROWS = 1000000   # 每写入这么多行提交一次，避免回滚日志过大
+
+
+def _format_time(time: datetime.datetime) -> str:
+    # 与 SQLAlchemy 在 SQLite 中保存 DateTime 的格式一致
+    return time.isoformat(sep=" ", timespec="microseconds")
+
+
+class Writer:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.batches: dict[str, list[tuple]] = {}
+        self.sql: dict[str, str] = {}
+        self.uncommitted = 0
+        self.rows = Counter()
+
+    def add(self, model, row: tuple):
+        table = model.__tablename__
+        if table not in self.sql:
+            columns = [column.name for column in model.__table__.columns]
+            self.sql[table] = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+                               f'VALUES ({", ".join("?" * len(columns))})')
+            self.batches[table] = []
+        batch = self.batches[table]
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            self.flush(table)
+
+    def flush(self, table: str | None = None):
+        for name in [table] if table else list(self.batches):
+            batch = self.batches[name]
+            if batch:
+                self.cursor.executemany(self.sql[name], batch)
+                self.rows[name] += len(batch)
+                self.uncommitted += len(batch)
+                batch.clear()
+        if self.uncommitted >= COMMIT_ROWS:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.flush()
+        self.conn.commit()
+
+
+def _next_id(cursor, model) -> int:
+    return (cursor.execute(f'SELECT max(id) FROM "{model.__tablename__}"').fetchone()[0] or 0) + 1
+
+
+def _participant_counts(rng: random.Random, projects: int, records: int, users: int) -> list[int]:
+    # 长尾分布：少数热门项目占了大部分参与记录
+    weights = [1 / (i + 1) ** 0.8 for i in range(projects)]
+    rng.shuffle(weights)
+    total = sum(weights)
+    counts = [min(users, int(records * weight / total)) for weight in weights]
+    remainder = records - sum(counts)
+    i = 0
+    while remainder > 0 and i < 10 * projects:
+        if counts[i % projects] < users:
+            counts[i % projects] += 1
+            remainder -= 1
+        i += 1
+    return counts
+
+
+def generate(args) -> Counter:
+    rng = random.Random(args.seed)
+    SQLModel.metadata.create_all(engine)
+    conn = engine.raw_connection()
+    writer = Writer(conn)
+    cursor = writer.cursor
+    cursor.execute("PRAGMA synchronous=OFF")
+    user_id = _next_id(cursor, models.User)
+    project_id = _next_id(cursor, models.Project)
+    question_id = _next_id(cursor, models.Question)
+    prize_id = _next_id(cursor, models.Prize)
+    record_id = _next_id(cursor, models.Record)
+    now = args.now.replace(microsecond=0)
+    hashed_password = get_password_hash(args.password)
+    prefix = args.prefix or f"gen{args.seed}_"
+
+    manager_ids = list(range(user_id, user_id + args.managers))
+    for i, id in enumerate(manager_ids):
+        writer.add(models.User, (id, f"{prefix}manager{i}", hashed_password, None, None, True))
+    user_id += args.managers
+    first_user_id = user_id
+    for i in range(args.users):
+        writer.add(models.User, (user_id + i, f"{prefix}user{i}", hashed_password,
+                                 str(rng.randrange(10**8, 10**10)) if rng.random() < 0.5 else None,
+                                 f"1{rng.randrange(10**9, 10**10)}" if rng.random() < 0.5 else None, False))
+    writer.flush()
+
+    metas = []
+    for p in range(args.projects):
+        kind = rng.choices(("qa_raffle", "qa", "raffle"), weights=(70, 15, 15))[0]
+        create_time = now - datetime.timedelta(days=rng.randint(1, 365), seconds=rng.randrange(86400))
+        deadline = create_time + datetime.timedelta(days=rng.randint(3, 60))
+        status = 2 if deadline <= now else 1
+        if rng.random() < 0.05:
+            status = 0      # 少量未发布的草稿，没有参与记录
+        metas.append((kind, create_time, deadline, status))
+    published = [p for p, meta in enumerate(metas) if meta[3]]
+    counts = dict(zip(published, _participant_counts(rng, len(published), args.records, args.users)))
+    choices = (1, 2, 3, 4)
+    for p, (kind, create_time, deadline, status) in enumerate(metas):
+        pid = project_id + p
+        participant_num = counts.get(p, 0)
+        writer.add(models.Project, (pid, f"{prefix}project{p}", f"generated project {p}", _format_time(create_time),
+                                    _format_time(deadline), status, participant_num * rng.randint(1, 4),
+                                    rng.choice(manager_ids)))
+
+        correct_answer = []
+        if kind != "raffle":
+            for q in range(rng.randint(max(1, args.questions // 2), args.questions)):
+                a = rng.randint(1, 4)
+                correct_answer.append(a)
+                writer.add(models.Question, (question_id, f"question {q}", "A", "B", "C", "D", a, pid))
+                question_id += 1
+
+        prizes = []     # [id, level, amount, remain]
+        if kind != "qa":
+            for level in range(1, rng.randint(2, 4)):
+                amount = max(1, int(participant_num * rng.uniform(0.01, 0.1) / level))
+                prizes.append([prize_id, level, amount, amount])
+                prize_id += 1
+            amount = max(1, participant_num * MAX_RAFFLE_TIMES)
+            prizes.append([prize_id, 0, amount, amount])
+            prize_id += 1
+
+        counters = Counter()
+        duration = max(1, int(((min(deadline, now) - create_time).total_seconds())))
+        for user_index in rng.sample(range(args.users), participant_num):
+            answer = answer_time = raffle_result = raffle_time = None
+            raffle_times = 1
+            claimed = False
+            offset = rng.randrange(duration)
+            if correct_answer:
+                skill = rng.random()
+                user_answer = [a if rng.random() < skill else rng.choice(choices) for a in correct_answer]
+                correct = [x == a for x, a in zip(user_answer, correct_answer)]
+                correct_num = sum(correct)
+                raffle_times = int(correct_num / len(correct_answer) * MAX_RAFFLE_TIMES + 0.5)
+                answer = str(user_answer)
+                answer_time = _format_time(create_time + datetime.timedelta(seconds=offset))
+                counters[(stats.ANSWER, 0)] += 1
+                for i, c in enumerate(correct):
+                    counters[(stats.QUESTION_CORRECT, i)] += c
+                counters[(stats.SCORE, correct_num)] += 1
+            if prizes:
+                draws = raffle_times if kind == "raffle" else rng.randint(0, raffle_times)
+                result = []
+                for _ in range(draws):
+                    pool = [prize for prize in prizes
+                            if prize[3] > 0 and (prize[1] == 0 or prize[0] not in result)]
+                    if not pool:
+                        break
+                    prize = rng.choices(pool, weights=[prize[3] for prize in pool])[0]
+                    prize[3] -= 1
+                    result.append(prize[0])
+                    counters[(stats.PRIZE_HIT, prize[0])] += 1
+                if result:
+                    raffle_result = str(result)
+                    raffle_time = _format_time(create_time + datetime.timedelta(
+                        seconds=min(duration, offset + rng.randrange(600))))
+                    claimed = status == 2 and rng.random() < 0.6
+                    counters[(stats.RAFFLE_USER, 0)] += 1
+                    counters[(stats.RAFFLE, 0)] += len(result)
+                    counters[(stats.CLAIM, 0)] += claimed
+            if answer is None and raffle_result is None:
+                continue
+            writer.add(models.Record, (record_id, first_user_id + user_index, pid, answer, answer_time,
+                                       raffle_times, raffle_result, raffle_time, claimed))
+            record_id += 1
+
+        for prize in prizes:
+            writer.add(models.Prize, (prize[0], f"prize level {prize[1]}", None, prize[1], prize[2], prize[3], pid))
+        for (kind_, key), value in counters.items():
+            writer.add(models.ProjectStats, (pid, kind_, key, value))
+        if args.verbose and (p + 1) % 100 == 0:
+            print(f"  {p + 1}/{args.projects} projects, {writer.rows['record']} records", file=sys.stderr)
+    writer.close()
+    conn.close()
+    return writer.rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic data into the configured database.")
+    parser.add_argument("--managers", type=int, default=20)
+    parser.add_argument("--projects", type=int, default=1000)
+    parser.add_argument("--questions", type=int, default=20, help="maximum questions per project")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--now", type=datetime.datetime.fromisoformat, default=datetime.datetime(2025, 1, 1),
+                        help="reference time of the generated data, ISO format (default: 2025-01-01)")
+    parser.add_argument("--prefix", help="username and project name prefix (default: gen<seed>_)")
+    parser.add_argument("--password", default="password", help="password of every generated user")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = generate(args)
+    elapsed = time.perf_counter() - start
+    for table, count in sorted(rows.items()):
+        print(f"{table:<20}{count:>12}")
+    print(f"done in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
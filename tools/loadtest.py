@@ -0,0 +1,282 @@
+"""问答抽奖流程的端到端压测。
+
+在进程内直接调用 ASGI 应用（默认，使用临时数据库），或者对本地运行的 uvicorn 发请求：
+
+    python -m tools.loadtest --users 200 --concurrency 32
+    python -m tools.loadtest --url http://127.0.0.1:8000 --users 500
+
+依次执行注册、登录、查看项目、答题、多次抽奖，输出每个接口的吞吐量和 p50/p95/p99 延迟，
+最后通过管理员接口检查奖品剩余数量不为负、每个用户的抽奖次数不超过答题得到的次数。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+
+MAX_RAFFLE_TIMES = 5    # 与 sql.crud.MAX_RAFFLE_TIMES 一致，远程模式下不导入应用代码
+
+
+class ASGITransport:
+    """在当前事件循环中直接调用 ASGI 应用，不经过网络。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, bytes]:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("loadtest", 80),
+        }
+        request_sent = False
+        response_done = asyncio.Event()
+        status = 500
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await response_done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response_done.set()
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            # 未处理的异常在返回500之后仍会被抛出，这里只记为一次失败的请求
+            status = 500
+        response_done.set()
+        return status, b"".join(chunks)
+
+
+class HTTPTransport:
+    """用标准库对真实的服务发请求，每个请求在线程池中执行。"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+
+    def _request(self, method, path, headers, body):
+        request = urllib.request.Request(self.base_url + path, data=body or None, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    async def request(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, bytes]:
+        return await asyncio.to_thread(self._request, method, path, headers, body)
+
+
+class Client:
+    def __init__(self, transport, concurrency: int):
+        self.transport = transport
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.elapsed = defaultdict(float)
+
+    async def call(self, name: str, method: str, path: str, token: str | None = None,
+                   json_body=None, form_body: dict | None = None):
+        headers = {}
+        body = b""
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if json_body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(json_body).encode()
+        elif form_body is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            body = urllib.parse.urlencode(form_body).encode()
+        async with self.semaphore:
+            start = time.perf_counter()
+            status, content = await self.transport.request(method, path, headers, body)
+            self.latencies[name].append(time.perf_counter() - start)
+        if status >= 400:
+            self.errors[name] += 1
+        try:
+            data = json.loads(content) if content else None
+        except ValueError:
+            data = None
+        return status, data
+
+    async def phase(self, name: str, calls):
+        # 同一阶段的请求并发执行，吞吐量按阶段的墙钟时间计算
+        start = time.perf_counter()
+        results = await asyncio.gather(*calls)
+        self.elapsed[name] += time.perf_counter() - start
+        return results
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def report(client: Client) -> list[dict]:
+    rows = []
+    for name, latencies in client.latencies.items():
+        elapsed = client.elapsed.get(name) or sum(latencies)
+        rows.append({
+            "endpoint": name,
+            "requests": len(latencies),
+            "errors": client.errors[name],
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        })
+    return rows
+
+
+def print_report(rows: list[dict], violations: list[str]):
+    print(f"{'endpoint':<32}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in rows:
+        print(f"{row['endpoint']:<32}{row['requests']:>10}{row['errors']:>8}{row['throughput']:>10.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    if violations:
+        print(f"\n{len(violations)} invariant violation(s):")
+        for violation in violations:
+            print(f"  {violation}")
+    else:
+        print("\nAll invariants hold.")
+
+
+async def run(client: Client, args) -> list[str]:
+    rng = random.Random(args.seed)
+    prefix = f"lt{int(time.time())}{rng.randrange(10000)}"
+
+    # 准备：管理员创建项目、题目和奖品，并发布
+    await client.call("POST /api/register", "POST", "/api/register",
+                      json_body={"username": f"{prefix}_manager", "password": "p", "manage_permission": True})
+    _, data = await client.call("POST /api/login", "POST", "/api/login",
+                                form_body={"username": f"{prefix}_manager", "password": "p"})
+    manager_token = data["access_token"]
+    _, project = await client.call("POST /api/project", "POST", "/api/project", manager_token,
+                                   json_body={"name": prefix, "deadline": "2099-01-01 00:00:00"})
+    project_id = project["id"]
+    for i in range(args.questions):
+        await client.call("POST /api/question", "POST", "/api/question", manager_token,
+                          json_body={"project_id": project_id, "q": f"q{i}", "o1": "A", "o2": "B",
+                                     "o3": "C", "o4": "D", "a": rng.randint(1, 4)})
+    for level, amount in ((1, max(1, args.users // 20)), (2, max(1, args.users // 5)), (0, args.users * 2)):
+        await client.call("POST /api/prize", "POST", "/api/prize", manager_token,
+                          json_body={"project_id": project_id, "name": f"level{level}",
+                                     "level": level, "amount": amount})
+    await client.call("PATCH /api/project/{id}/publish", "PATCH", f"/api/project/{project_id}/publish",
+                      manager_token)
+
+    usernames = [f"{prefix}_user{i}" for i in range(args.users)]
+    await client.phase("POST /api/register", [
+        client.call("POST /api/register", "POST", "/api/register",
+                    json_body={"username": username, "password": "p"}) for username in usernames])
+    logins = await client.phase("POST /api/login", [
+        client.call("POST /api/login", "POST", "/api/login",
+                    form_body={"username": username, "password": "p"}) for username in usernames])
+    tokens = [data["access_token"] for status, data in logins if status == 200]
+
+    await client.phase("GET /api/project/{id}/user", [
+        client.call("GET /api/project/{id}/user", "GET", f"/api/project/{project_id}/user", token)
+        for token in tokens])
+    await client.phase("POST /api/answer", [
+        client.call("POST /api/answer", "POST", "/api/answer", token,
+                    json_body={"project_id": project_id,
+                               "answer": [rng.randint(1, 4) for _ in range(args.questions)]})
+        for token in tokens])
+
+    async def raffle_repeatedly(token):
+        for _ in range(args.raffles):
+            await client.call("POST /api/raffle/{id}", "POST", f"/api/raffle/{project_id}", token)
+
+    await client.phase("POST /api/raffle/{id}", [raffle_repeatedly(token) for token in tokens])
+
+    # 检查不变量
+    _, details = await client.call("GET /api/project/{id}", "GET", f"/api/project/{project_id}", manager_token)
+    violations = []
+    issued = defaultdict(int)
+    for participant in details["raffle_participant"]:
+        for prize_id in participant["raffle_result"]:
+            issued[prize_id] += 1
+    for prize in details["prize"]:
+        if prize["remain"] < 0:
+            violations.append(f"prize {prize['id']} has negative remain {prize['remain']}")
+        if prize["amount"] - prize["remain"] != issued[prize["id"]]:
+            violations.append(f"prize {prize['id']} remain {prize['remain']} does not match "
+                              f"{issued[prize['id']]} draws recorded out of {prize['amount']}")
+    correct_answer = [question["a"] for question in details["question"]]
+    raffle_times = {}
+    for participant in details["qa_participant"]:
+        correct_num = sum(1 for a, b in zip(participant["answer"], correct_answer) if a == b)
+        raffle_times[participant["id"]] = int(correct_num / len(correct_answer) * MAX_RAFFLE_TIMES + 0.5)
+    for participant in details["raffle_participant"]:
+        allowed = raffle_times.get(participant["id"], 1)
+        if len(participant["raffle_result"]) > allowed:
+            violations.append(f"user {participant['id']} drew {len(participant['raffle_result'])} times, "
+                              f"allowed {allowed}")
+    return violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the question & raffle flow.")
+    parser.add_argument("--url", help="base url of a running server; runs in-process when omitted")
+    parser.add_argument("--db", help="database file for in-process runs (default: a temporary file)")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--raffles", type=int, default=MAX_RAFFLE_TIMES + 1,
+                        help="draw attempts per user, more than allowed to exercise the limit")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        transport = HTTPTransport(args.url)
+    else:
+        os.environ.setdefault("RATE_LIMITS", "{}")    # 所有请求都来自同一个地址，关闭限流
+        os.environ["QA_RAFFLE_DB"] = args.db or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+        from main import app
+        transport = ASGITransport(app)
+
+    client = Client(transport, args.concurrency)
+    violations = asyncio.run(run(client, args))
+    rows = report(client)
+    print_report(rows, violations)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "endpoints": rows, "violations": violations}, f, indent=2)
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
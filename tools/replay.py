@@ -0,0 +1,139 @@
+"""回放 CaptureMiddleware 记录的请求。
+
+    python -m tools.replay traces.ndjson --url http://127.0.0.1:8000 --speed 4
+    python -m tools.replay traces.ndjson --db copy_of_production.db --speed 0
+
+按记录中的时间间隔发出请求，--speed 为加速倍数，0 表示不等待、尽快发出。
+路径参数和请求体中的项目id等原样使用，所以目标实例应使用开始记录时的生产数据库快照。
+记录中的每个匿名用户在回放时对应一个新注册的用户；注册和登录请求用这些用户重新构造。
+输出每个路由的吞吐量和延迟，以及与记录中原始延迟的对比。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from tools.loadtest import ASGITransport, Client, HTTPTransport, percentile, report
+
+
+def load_traces(path: str) -> list[dict]:
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                traces.append(json.loads(line))
+    traces.sort(key=lambda trace: trace["t"])
+    return traces
+
+
+def build_path(trace: dict) -> str:
+    path = trace["r"]
+    for key, value in trace.get("p", {}).items():
+        path = path.replace("{" + key + "}", str(value))
+    query = {key: value for key, value in trace.get("q", {}).items() if value is not None}
+    if query:
+        path += "?" + "&".join(f"{key}={value}" for key, value in query.items())
+    return path
+
+
+async def replay(client: Client, traces: list[dict], speed: float, prefix: str):
+    # 先为每个匿名用户注册并登录一个回放用户，全部设为管理员以便能调用后台接口
+    pseudonyms = sorted({trace["u"] for trace in traces if trace.get("u")})
+    await asyncio.gather(*[
+        client.call("setup", "POST", "/api/register",
+                    json_body={"username": f"{prefix}{pseudonym}", "password": "replay", "manage_permission": True})
+        for pseudonym in pseudonyms])
+    logins = await asyncio.gather(*[
+        client.call("setup", "POST", "/api/login",
+                    form_body={"username": f"{prefix}{pseudonym}", "password": "replay"})
+        for pseudonym in pseudonyms])
+    tokens = {pseudonym: data["access_token"] for pseudonym, (status, data) in zip(pseudonyms, logins)
+              if status == 200}
+    client.latencies.pop("setup", None)
+    client.errors.pop("setup", None)
+
+    register_count = 0
+
+    async def issue(trace: dict):
+        nonlocal register_count
+        name = f"{trace['m']} {trace['r']}"
+        json_body = form_body = None
+        if trace["r"] == "/api/register":
+            register_count += 1
+            json_body = dict(trace.get("b") or {})
+            json_body.update(username=f"{prefix}new{register_count}", password="replay")
+        elif trace["r"] == "/api/login":
+            pseudonym = trace.get("u") or (pseudonyms[register_count % len(pseudonyms)] if pseudonyms else "")
+            form_body = {"username": f"{prefix}{pseudonym}", "password": "replay"}
+        elif trace.get("c") == "json":
+            json_body = trace.get("b")
+        elif trace.get("c") == "form":
+            form_body = {key: "replay" for key in trace.get("b") or {}}
+        await client.call(name, trace["m"], build_path(trace), tokens.get(trace.get("u")),
+                          json_body=json_body, form_body=form_body)
+
+    start = time.perf_counter()
+    origin = traces[0]["t"]
+    tasks = []
+    for trace in traces:
+        if speed > 0:
+            delay = (trace["t"] - origin) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(issue(trace)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured request traces.")
+    parser.add_argument("traces")
+    parser.add_argument("--url", help="base url of a running server; runs in-process when omitted")
+    parser.add_argument("--db", help="database file for in-process runs (default: a temporary file)")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed-up factor, 0 for as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--limit", type=int, help="only replay the first N traces")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.traces)[:args.limit]
+    if not traces:
+        print("no traces")
+        return 1
+    if args.url:
+        transport = HTTPTransport(args.url)
+    else:
+        os.environ.setdefault("RATE_LIMITS", "{}")    # 所有请求都来自同一个地址，关闭限流
+        os.environ["QA_RAFFLE_DB"] = args.db or os.path.join(tempfile.mkdtemp(), "replay.db")
+        from main import app
+        transport = ASGITransport(app)
+
+    client = Client(transport, args.concurrency)
+    elapsed = asyncio.run(replay(client, traces, args.speed, f"replay{int(time.time())}_"))
+    rows = report(client)
+    original = defaultdict(list)
+    for trace in traces:
+        original[f"{trace['m']} {trace['r']}"].append(trace["d"])
+    print(f"replayed {len(traces)} requests in {elapsed:.1f}s "
+          f"(captured over {traces[-1]['t'] - traces[0]['t']:.1f}s)")
+    print(f"{'route':<40}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'orig p50':>10}{'orig p95':>10}")
+    for row in rows:
+        durations = original[row["endpoint"]]
+        row["original_p50_ms"] = statistics.median(durations) * 1000 if durations else 0.0
+        row["original_p95_ms"] = percentile(durations, 95) * 1000
+        print(f"{row['endpoint']:<40}{row['requests']:>9}{row['errors']:>8}{row['p50_ms']:>9.1f}"
+              f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['original_p50_ms']:>10.1f}{row['original_p95_ms']:>10.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "elapsed": elapsed, "routes": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())